@@ -0,0 +1,253 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CSRGraph:
+    """
+    Compact directed graph in compressed sparse row form.
+
+    Node ids are interned to consecutive integers once; the adjacency is kept in NumPy
+    arrays (offsets plus targets, for outgoing and incoming edges), so a graph costs a few
+    bytes per edge instead of Python objects per edge and million-edge corpora fit in
+    bounded memory.
+
+    Use CSRGraph.from_edges to build one.
+    """
+
+    def __init__(self, node_ids, sources, targets, index=None):
+        self.node_ids = node_ids
+        self.index = index if index is not None else {node_id: i for i, node_id in enumerate(node_ids)}
+        n = len(node_ids)
+        self.out_offsets, self.out_targets = self._csr(sources, targets, n)
+        self.in_offsets, self.in_targets = self._csr(targets, sources, n)
+
+    @staticmethod
+    def _csr(sources, targets, n):
+        order = np.argsort(sources, kind="stable")
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+        return offsets, targets[order].astype(np.int32)
+
+    @classmethod
+    def from_edges(cls, edges, node_ids=()):
+        """
+        Builds the graph from an iterable of (source_id, target_id) pairs, consumed once.
+
+        Parameters:
+        edges (iterable): The edges; ids are interned as they are first seen.
+        node_ids (iterable): Additional node ids, e.g. nodes without edges.
+        """
+        index = {}
+        ids = []
+
+        def intern(node_id):
+            i = index.get(node_id)
+            if i is None:
+                i = index[node_id] = len(ids)
+                ids.append(node_id)
+            return i
+
+        for node_id in node_ids:
+            intern(node_id)
+        sources = array("i")
+        targets = array("i")
+        for source, target in edges:
+            sources.append(intern(source))
+            targets.append(intern(target))
+        return cls(ids, np.frombuffer(sources, dtype=np.int32), np.frombuffer(targets, dtype=np.int32), index)
+
+    @property
+    def node_count(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.out_targets)
+
+    def _expand(self, frontier, directed):
+        # (owner, neighbor) pairs for every edge leaving the frontier, gathered with array operations
+        owners, neighbors = self._gather(self.out_offsets, self.out_targets, frontier)
+        if not directed:
+            in_owners, in_neighbors = self._gather(self.in_offsets, self.in_targets, frontier)
+            owners = np.concatenate([owners, in_owners])
+            neighbors = np.concatenate([neighbors, in_neighbors])
+        return owners, neighbors
+
+    @staticmethod
+    def _gather(offsets, targets, frontier):
+        starts = offsets[frontier]
+        lengths = offsets[frontier + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # position of every gathered entry: its row start plus its rank inside the row
+        row_base = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.repeat(frontier, lengths), targets[row_base + np.arange(total)].astype(np.int64)
+
+    def degree_centrality(self):
+        """
+        Returns (in_degree, out_degree, normalized total degree) arrays.
+        """
+        out_degree = np.diff(self.out_offsets)
+        in_degree = np.diff(self.in_offsets)
+        scale = 1.0 / (self.node_count - 1) if self.node_count > 1 else 1.0
+        return in_degree, out_degree, (in_degree + out_degree) * scale
+
+    def pagerank(self, damping=0.85, iterations=100, tolerance=1e-8):
+        """
+        Returns the PageRank of every node, computed by power iteration over the CSR arrays.
+        """
+        n = self.node_count
+        if n == 0:
+            return np.zeros(0)
+        out_degree = np.diff(self.out_offsets).astype(np.float64)
+        sources = np.repeat(np.arange(n), np.diff(self.out_offsets))
+        dangling = out_degree == 0
+        rank = np.full(n, 1.0 / n)
+        for _ in range(iterations):
+            share = np.where(dangling, 0.0, rank / np.maximum(out_degree, 1.0))
+            updated = np.bincount(self.out_targets, weights=share[sources], minlength=n)
+            updated = damping * (updated + rank[dangling].sum() / n) + (1.0 - damping) / n
+            if np.abs(updated - rank).sum() < tolerance:
+                return updated
+            rank = updated
+        return rank
+
+    def connected_components(self):
+        """
+        Returns an array with the weakly connected component label of every node, computed
+        by vectorized label propagation with pointer jumping.
+        """
+        n = self.node_count
+        labels = np.arange(n)
+        sources = np.repeat(np.arange(n), np.diff(self.out_offsets))
+        targets = self.out_targets
+        while True:
+            previous = labels.copy()
+            np.minimum.at(labels, sources, labels[targets])
+            np.minimum.at(labels, targets, labels[sources])
+            labels = labels[labels]
+            if np.array_equal(labels, previous):
+                return labels
+
+    def k_hop(self, node_id, k, directed=False):
+        """
+        Returns the integer ids of the nodes within k hops of node_id, including itself.
+        """
+        seen = np.zeros(self.node_count, dtype=bool)
+        frontier = np.array([self.index[node_id]], dtype=np.int64)
+        seen[frontier] = True
+        for _ in range(k):
+            if len(frontier) == 0:
+                break
+            _, neighbors = self._expand(frontier, directed)
+            frontier = np.unique(neighbors[~seen[neighbors]])
+            seen[frontier] = True
+        return np.flatnonzero(seen)
+
+    def shortest_path(self, source_id, target_id, directed=False):
+        """
+        Returns the node ids on a shortest path from source_id to target_id (breadth-first),
+        or None if the target is unreachable.
+        """
+        source, target = self.index[source_id], self.index[target_id]
+        parent = np.full(self.node_count, -1, dtype=np.int64)
+        parent[source] = source
+        frontier = np.array([source], dtype=np.int64)
+        while len(frontier) and parent[target] < 0:
+            owners, neighbors = self._expand(frontier, directed)
+            fresh = parent[neighbors] < 0
+            # any owner on the frontier is a valid parent, duplicates just overwrite
+            parent[neighbors[fresh]] = owners[fresh]
+            frontier = np.unique(neighbors[fresh])
+        if parent[target] < 0:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(int(parent[path[-1]]))
+        return [self.node_ids[i] for i in reversed(path)]
+
+    def summary(self, top=10):
+        """
+        Returns graph-wide analytics: counts, density, connected components and the top
+        nodes by degree and PageRank.
+        """
+        n = self.node_count
+        in_degree, out_degree, degree = self.degree_centrality()
+        rank = self.pagerank()
+        labels = self.connected_components()
+        sizes = np.sort(np.bincount(labels, minlength=n)[np.unique(labels)])[::-1] if n else np.zeros(0)
+
+        def ranked(scores):
+            order = np.argsort(-scores, kind="stable")[:top]
+            return [
+                {"id": self.node_ids[i], "score": float(scores[i]),
+                 "in_degree": int(in_degree[i]), "out_degree": int(out_degree[i])}
+                for i in order
+            ]
+
+        return {
+            "node_count": n,
+            "edge_count": self.edge_count,
+            "density": self.edge_count / (n * (n - 1)) if n > 1 else 0.0,
+            "components": {"count": int(len(sizes)), "largest": [int(size) for size in sizes[:top]]},
+            "degree_centrality": ranked(degree),
+            "pagerank": ranked(rank),
+        }
+
+
+def graph_to_csr(graph):
+    """
+    Builds the CSRGraph of a knowledge graph dict ("from"/"to" edges).
+    """
+    return CSRGraph.from_edges(
+        ((edge["from"], edge["to"]) for edge in graph["edges"]),
+        node_ids=(node["id"] for node in graph["nodes"]),
+    )
+
+
+class AnalyticsCache:
+    """
+    Keeps the CSRGraph and computed summaries of recently analyzed graphs.
+
+    Entries are tagged with a version (the graph's lastUpdatedOn); a request with a newer
+    version rebuilds them, so results are reused exactly until the graph changes.
+
+    Parameters:
+    max_graphs (int): Number of graphs kept, least recently used are dropped first.
+    """
+
+    def __init__(self, max_graphs=64):
+        self.max_graphs = max_graphs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """
+        Returns the cached entry dict {"csr": CSRGraph, "results": {...}} for the key, calling
+        build() for a CSRGraph when there is none for this version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["version"] == version:
+                self._entries.move_to_end(key)
+                return entry
+        entry = {"version": version, "csr": build(), "results": {}}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_graphs:
+                self._entries.popitem(last=False)
+        return entry
+
+    def result(self, entry, name, compute):
+        """
+        Returns a memoized computation on a cached entry.
+        """
+        results = entry["results"]
+        if name not in results:
+            results[name] = compute(entry["csr"])
+        return results[name]
@@ -0,0 +1,236 @@
+"""
+Generates knowledge graphs offline from a JSONL file of prompts.
+
+Every input line is a JSON object holding the prompt (the first of "user_input", "prompt",
+"text" or "body", or --field) and optionally an id ("id" or "request_id", or --id-field;
+the line number otherwise). Generations run on --concurrency threads and rate limits are
+retried with jittered exponential backoff. Finished ids are appended to a checkpoint
+file, so an interrupted job resumes where it stopped when run again with the same
+arguments.
+
+Results are written as JSONL ({"id", "meta", "graph"} per line) with --output, and/or
+bulk-loaded into Neo4j with --neo4j (NEO4J_URL, NEO4J_USERNAME and NEO4J_PASSWORD) or
+into a SQLite graph store with --sqlite PATH.
+
+Example:
+    python batch.py prompts.jsonl --output graphs.jsonl --concurrency 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from generation import generate_knowledge_graph, graph_to_dict, new_graph_meta, token_usage
+from layout import apply_layout
+from storage import Neo4jStorage, SQLiteStorage
+
+PROMPT_FIELDS = ("user_input", "prompt", "text", "body")
+ID_FIELDS = ("id", "request_id")
+
+
+def read_prompts(path, field=None, id_field=None):
+    """
+    Yields (id, prompt) for every non-empty line of a JSONL file.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            prompt = item.get(field) if field else next((item[k] for k in PROMPT_FIELDS if item.get(k)), None)
+            if not prompt:
+                print("line {}: no prompt, skipped".format(line_number), file=sys.stderr)
+                continue
+            item_id = item.get(id_field) if id_field else next((item[k] for k in ID_FIELDS if k in item), None)
+            yield str(item_id if item_id is not None else line_number), prompt
+
+
+class Checkpoint:
+    """
+    Append-only file of finished ids. Every id is flushed and synced before the next one is
+    recorded, so a crash loses at most the results that were not written yet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, item_ids):
+        for item_id in item_ids:
+            self._file.write(item_id + "\n")
+            self.done.add(item_id)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def generate(item_id, prompt, max_retries):
+    """
+    Generates, lays out and describes one graph. Runs on a worker thread.
+    """
+    graph = graph_to_dict(generate_knowledge_graph(prompt, max_retries=max_retries))
+    apply_layout(graph)
+    return item_id, graph, new_graph_meta(graph)
+
+
+class Sink:
+    """
+    Writes finished graphs to the JSONL output and/or a storage backend, and checkpoints
+    their ids once they are stored. Storage writes are buffered and sent store_batch graphs
+    at a time.
+    """
+
+    def __init__(self, checkpoint, output=None, storage=None, store_batch=100):
+        self.checkpoint = checkpoint
+        self.output = open(output, "a", encoding="utf-8") if output else None
+        self.storage = storage
+        self.store_batch = store_batch
+        self._pending = []
+
+    def add(self, item_id, graph, meta):
+        if self.output:
+            self.output.write(json.dumps({"id": item_id, "meta": meta, "graph": graph}) + "\n")
+        if self.storage:
+            self._pending.append((item_id, meta, graph))
+            if len(self._pending) >= self.store_batch:
+                self.flush()
+        else:
+            self.output.flush()
+            self.checkpoint.add([item_id])
+
+    def flush(self):
+        if self.output:
+            self.output.flush()
+        if self._pending:
+            self.storage.save_graphs([(meta, graph) for _, meta, graph in self._pending])
+            self.checkpoint.add([item_id for item_id, _, _ in self._pending])
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        if self.output:
+            self.output.close()
+
+
+def neo4j_storage_from_env():
+    url, username, password = (os.getenv(name) for name in ("NEO4J_URL", "NEO4J_USERNAME", "NEO4J_PASSWORD"))
+    if not (url and username and password):
+        raise SystemExit("--neo4j needs NEO4J_URL, NEO4J_USERNAME and NEO4J_PASSWORD")
+    from neo4j import GraphDatabase
+
+    driver = GraphDatabase.driver(url, auth=(username, password))
+    driver.verify_connectivity()
+    storage = Neo4jStorage(driver)
+    storage.ensure_schema()
+    return storage
+
+
+def report(started, completed, failed, skipped):
+    """
+    Returns the throughput and token usage of the run so far.
+    """
+    elapsed = time.monotonic() - started
+    usage = token_usage.snapshot()
+    minutes = max(elapsed, 1e-9) / 60.0
+    return {
+        "completed": completed,
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed, 1),
+        "graphs_per_minute": round(completed / minutes, 2),
+        "tokens_per_minute": round(usage["total_tokens"] / minutes, 1),
+        **usage,
+    }
+
+
+def run(args):
+    checkpoint = Checkpoint(args.checkpoint or args.input + ".checkpoint")
+    storage = neo4j_storage_from_env() if args.neo4j else SQLiteStorage(args.sqlite) if args.sqlite else None
+    sink = Sink(checkpoint, args.output, storage, args.store_batch)
+
+    started = time.monotonic()
+    last_report = started
+    counts = {"completed": 0, "failed": 0, "skipped": 0}
+    failed_ids = []
+    in_flight = set()
+
+    def collect(future):
+        if future.exception() is None:
+            sink.add(*future.result())
+            counts["completed"] += 1
+        else:
+            counts["failed"] += 1
+            failed_ids.append(future.item_id)
+            print("{}: {}".format(future.item_id, future.exception()), file=sys.stderr)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for item_id, prompt in read_prompts(args.input, args.field, args.id_field):
+                if item_id in checkpoint.done:
+                    counts["skipped"] += 1
+                    continue
+                # a bounded window of futures keeps memory flat for any input size
+                while len(in_flight) >= args.concurrency * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        collect(future)
+                future = executor.submit(generate, item_id, prompt, args.max_retries)
+                future.item_id = item_id
+                in_flight.add(future)
+
+                if time.monotonic() - last_report >= args.report_interval:
+                    last_report = time.monotonic()
+                    print(json.dumps(report(started, **counts)), file=sys.stderr)
+
+            for future in in_flight:
+                collect(future)
+    finally:
+        sink.close()
+        checkpoint.close()
+        if storage:
+            storage.close()
+
+    summary = report(started, **counts)
+    summary["failed_ids"] = failed_ids
+    print(json.dumps(summary, indent=2))
+    return 1 if failed_ids else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate knowledge graphs from a JSONL file of prompts.")
+    parser.add_argument("input", help="JSONL file with one prompt object per line")
+    parser.add_argument("--output", help="append the generated graphs to this JSONL file")
+    parser.add_argument("--neo4j", action="store_true", help="bulk-load the generated graphs into Neo4j")
+    parser.add_argument("--sqlite", help="bulk-load the generated graphs into this SQLite graph store")
+    parser.add_argument("--store-batch", "--neo4j-batch", dest="store_batch", type=int, default=100,
+                        help="graphs per storage write (default 100)")
+    parser.add_argument("--checkpoint", help="file of finished ids (default <input>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=8, help="generations in flight (default 8)")
+    parser.add_argument("--max-retries", type=int, default=6,
+                        help="retries per OpenAI call on rate limits and transient errors (default 6)")
+    parser.add_argument("--field", help="name of the prompt field")
+    parser.add_argument("--id-field", help="name of the id field")
+    parser.add_argument("--report-interval", type=float, default=30.0,
+                        help="seconds between progress reports on stderr (default 30)")
+    args = parser.parse_args(argv)
+    if args.neo4j and args.sqlite:
+        parser.error("give --neo4j or --sqlite, not both")
+    if not (args.output or args.neo4j or args.sqlite):
+        parser.error("give --output, --neo4j, --sqlite or a combination")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
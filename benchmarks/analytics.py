@@ -0,0 +1,148 @@
+"""
+Measures the CSR graph analytics (analytics.py) on a corpus-sized graph: building the
+index from streamed edges, the full summary (degree centrality, PageRank, connected
+components), k-hop neighborhoods and shortest paths. Every step is timed, then run again
+under tracemalloc for its peak memory, since tracing slows down allocations.
+
+Edges are streamed from a generator that formats new string node ids for every edge, as
+the rows of iter_corpus_edges are, so the build never holds them as a list. Their targets are
+skewed towards low node numbers, which gives the graph hubs as entity keys shared by many
+graphs do. --baseline also builds a dict of adjacency lists from the same edges, the
+Python structure the CSR arrays replace, for comparison.
+
+Example:
+    python -m benchmarks.analytics --nodes 200000 --edges 1000000 --baseline --output analytics.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from analytics import CSRGraph
+from benchmarks.run import environment, percentile
+
+
+def make_edges(nodes, edges, seed):
+    """
+    Returns (sources, targets): two integer arrays of edge ends.
+    """
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, nodes, size=edges)
+    # squaring a uniform draw favors low numbers: a few nodes get many edges
+    targets = np.minimum((rng.random(edges) ** 2 * nodes).astype(np.int64), nodes - 1)
+    return sources, targets
+
+
+def node_id(i):
+    return "graph-{:06d}:node-{}".format(i // 50, i % 50)
+
+
+def stream(sources, targets, chunk=65536):
+    # converted a chunk at a time, so the generator itself holds little memory
+    for start in range(0, len(sources), chunk):
+        for source, target in zip(sources[start:start + chunk].tolist(), targets[start:start + chunk].tolist()):
+            yield node_id(source), node_id(target)
+
+
+def measure(func):
+    """
+    Returns (result, seconds, peak MiB allocated while func ran, MiB still allocated after),
+    the time from an untraced run and the memory from a second, traced one.
+    """
+    started = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    result = func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2 ** 20, retained / 2 ** 20
+
+
+def step(seconds, peak_mib, **extra):
+    return dict(extra, seconds=round(seconds, 4), peak_memory_mib=round(peak_mib, 1))
+
+
+def python_adjacency(edges):
+    adjacency = {}
+    for source, target in edges:
+        adjacency.setdefault(source, []).append(target)
+        adjacency.setdefault(target, [])
+    return adjacency
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure CSR analytics time and memory on a large graph.")
+    parser.add_argument("--nodes", type=int, default=200000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=20, help="k-hop and shortest path queries")
+    parser.add_argument("--k", type=int, default=2, help="hops of the k-hop queries")
+    parser.add_argument("--baseline", action="store_true", help="also build a dict of adjacency lists")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    sources, targets = make_edges(args.nodes, args.edges, args.seed)
+    results = {}
+
+    csr, seconds, peak, retained = measure(lambda: CSRGraph.from_edges(stream(sources, targets)))
+    arrays = sum(a.nbytes for a in (csr.out_offsets, csr.out_targets, csr.in_offsets, csr.in_targets))
+    results["build"] = step(seconds, peak, retained_mib=round(retained, 1), nodes=csr.node_count, edges=csr.edge_count,
+                            adjacency_mib=round(arrays / 2 ** 20, 1),
+                            bytes_per_edge=round(arrays / max(csr.edge_count, 1), 1))
+
+    _, seconds, peak, _ = measure(lambda: csr.summary(10))
+    results["summary"] = step(seconds, peak)
+
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.integers(0, csr.node_count, size=(args.queries, 2)).tolist()
+    for name, query in [
+        ("k_hop", lambda pair: csr.k_hop(csr.node_ids[pair[0]], args.k)),
+        ("shortest_path", lambda pair: csr.shortest_path(csr.node_ids[pair[0]], csr.node_ids[pair[1]])),
+    ]:
+        latencies = []
+
+        def run_queries():
+            for pair in picks:
+                started = time.perf_counter()
+                query(pair)
+                latencies.append(time.perf_counter() - started)
+
+        run_queries()
+        timed_latencies = sorted(latencies)
+        tracemalloc.start()
+        run_queries()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        latencies = timed_latencies
+        results[name] = step(sum(latencies), peak, queries=len(latencies),
+                             p50_ms=round(percentile(latencies, 0.50) * 1000.0, 2),
+                             max_ms=round(latencies[-1] * 1000.0, 2))
+
+    if args.baseline:
+        del csr
+        _, seconds, peak, retained = measure(lambda: python_adjacency(stream(sources, targets)))
+        results["python_adjacency_build"] = step(seconds, peak, retained_mib=round(retained, 1))
+
+    for name, result in results.items():
+        print("{:<24} {:>8.3f} s  peak {:>8.1f} MiB".format(
+            name, result["seconds"], result["peak_memory_mib"]), file=sys.stderr)
+
+    report = {
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+A local stand-in for the OpenAI chat completions API that answers every function call
+with a canned knowledge graph, so the app can be benchmarked without network access.
+
+The size of the graph is taken from "nodes=<n>" in the prompt (default --nodes), with
+about --edges-per-node edges per node. Labels are derived from the prompt, so different
+prompts give different graphs. Both plain and streamed (stream=true) responses are
+supported, and --latency adds a fixed delay per response.
+
+Example:
+    python -m benchmarks.fake_openai --port 8765 --latency 0.2
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 python main.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NODES_PATTERN = re.compile(r"nodes=(\d+)")
+COLORS = ("#FFB3BA", "#FFDFBA", "#FFFFBA", "#BAFFC9", "#BAE1FF", "#E0BBE4")
+
+
+def canned_graph(prompt, default_nodes=20, edges_per_node=1.5):
+    """
+    Returns a knowledge graph dict (the function call arguments) for the prompt.
+    """
+    match = NODES_PATTERN.search(prompt)
+    node_count = int(match.group(1)) if match else default_nodes
+    seed = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+    rng = random.Random(seed)
+    nodes = [
+        {
+            "id": str(i),
+            "label": "Entity {} {}".format(seed[:6], i),
+            "type": "Type {}".format(i % 7),
+            "color": COLORS[i % len(COLORS)],
+            "properties": {},
+        }
+        for i in range(1, node_count + 1)
+    ]
+    edges = []
+    if node_count > 1:
+        for _ in range(int(node_count * edges_per_node)):
+            source, target = rng.sample(range(1, node_count + 1), 2)
+            edges.append({
+                "from": str(source), "to": str(target),
+                "relationship": "relates to {}".format(rng.randrange(5)),
+                "direction": "outgoing", "color": "#999999", "properties": {},
+            })
+    return {
+        "metadata": {"createdDate": "2023-01-01", "lastUpdated": "2023-01-01", "description": "Benchmark " + seed[:8]},
+        "nodes": nodes,
+        "edges": edges,
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        time.sleep(server.latency)
+
+        prompt = " ".join(message.get("content") or "" for message in body.get("messages", []))
+        name = (body.get("function_call") or {}).get("name", "KnowledgeGraph")
+        arguments = json.dumps(canned_graph(prompt, server.nodes, server.edges_per_node))
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(arguments) // 4,
+            "total_tokens": len(prompt) // 4 + len(arguments) // 4,
+        }
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            step = max(1, len(arguments) // 50)
+            for i in range(0, len(arguments), step):
+                delta = {"function_call": {"arguments": arguments[i:i + step]}}
+                if i == 0:
+                    delta["function_call"]["name"] = name
+                self._write_chunk("data: {}\n\n".format(json.dumps({
+                    **base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                })))
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        payload = json.dumps({
+            **base, "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": None,
+                            "function_call": {"name": name, "arguments": arguments}},
+                "finish_reason": "function_call",
+            }],
+            "usage": usage,
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+def start_server(host="127.0.0.1", port=0, latency=0.0, nodes=20, edges_per_node=1.5):
+    """
+    Starts the fake server on a background thread and returns it; server.server_address
+    holds the bound address and server.requests counts the completions served.
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.nodes = nodes
+    server.edges_per_node = edges_per_node
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of delay per response")
+    parser.add_argument("--nodes", type=int, default=20, help="nodes per graph without nodes=<n> in the prompt")
+    parser.add_argument("--edges-per-node", type=float, default=1.5)
+    args = parser.parse_args()
+    server = start_server(args.host, args.port, args.latency, args.nodes, args.edges_per_node)
+    print("fake OpenAI listening on http://{}:{}/v1".format(*server.server_address))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
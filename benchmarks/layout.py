@@ -0,0 +1,76 @@
+"""
+Measures the server-side force-directed layout (layout.py) against the number of nodes.
+
+Every size is laid out with the canned graphs of fake_openai.py (about --edges-per-node
+edges per node, as generated graphs have), --repeat times after one warm-up run. The
+repulsion step compares every pair of nodes, so the time per iteration grows with the
+square of the node count; its memory is bounded by REPULSION_BLOCK rows at a time, so
+the peak memory of a layout, measured separately with tracemalloc, grows linearly.
+
+Example:
+    python -m benchmarks.layout --nodes 50,200,1000,3000 --output layout.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fake_openai import canned_graph
+from benchmarks.run import environment
+from layout import LAYOUT_ITERATIONS, compute_layout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure layout time against node count.")
+    parser.add_argument("--nodes", default="50,200,1000,3000", help="comma-separated node counts")
+    parser.add_argument("--edges-per-node", type=float, default=1.5)
+    parser.add_argument("--iterations", type=int, default=LAYOUT_ITERATIONS, help="simulation steps per layout")
+    parser.add_argument("--repeat", type=int, default=3, help="timed layouts per node count")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+    args.nodes = [int(count) for count in args.nodes.split(",")]
+
+    results = {}
+    for count in args.nodes:
+        graph = canned_graph("layout nodes={}".format(count), edges_per_node=args.edges_per_node)
+        compute_layout(graph, args.iterations)
+        seconds = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            compute_layout(graph, args.iterations)
+            seconds.append(time.perf_counter() - started)
+        seconds.sort()
+
+        tracemalloc.start()
+        compute_layout(graph, args.iterations)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        median = seconds[len(seconds) // 2]
+        results[str(count)] = {
+            "nodes": count,
+            "edges": len(graph["edges"]),
+            "median_seconds": round(median, 4),
+            "min_seconds": round(seconds[0], 4),
+            "ms_per_iteration": round(median * 1000.0 / max(args.iterations, 1), 3),
+            "peak_memory_mib": round(peak / 2 ** 20, 2),
+        }
+        print("{:>6} nodes {:>9.3f} s  {:>8.2f} MiB".format(
+            count, median, results[str(count)]["peak_memory_mib"]), file=sys.stderr)
+
+    report = {
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
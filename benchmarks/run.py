@@ -0,0 +1,264 @@
+"""
+End-to-end benchmark of the Flask app against the fake OpenAI server.
+
+The app runs in this process on a local threaded HTTP server, without Neo4j: graphs are
+stored in a temporary SQLite graph store (--storage sqlite, the default) or only in the
+in-process graph store (--storage memory). For every graph size and concurrency level,
+/get_response_data, /get_graph_history and /graphviz are driven over HTTP and
+throughput, latency percentiles and the mean time per processing stage (from
+metrics.py) are reported as JSON.
+
+Example:
+    python -m benchmarks.run --sizes 10,100,500 --concurrency 1,8,32 --output before.json
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_openai import start_server
+
+ENDPOINTS = ("get_response_data", "get_graph_history", "graphviz")
+
+
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def start_app(openai_base, storage_backend, sqlite_path):
+    """
+    Imports the app configured for the benchmark and serves it on a local port.
+    """
+    os.environ.update({
+        "STORAGE_BACKEND": storage_backend,
+        "SQLITE_DB_PATH": sqlite_path,
+        "OPENAI_API_BASE": openai_base,
+        "OPENAI_API_KEY": "benchmark",
+        # empty values keep a .env file from configuring Neo4j or the disk cache
+        "NEO4J_URL": "", "NEO4J_USERNAME": "", "NEO4J_PASSWORD": "",
+        "CACHE_DB_PATH": "", "SCRAPE_CACHE_DIR": "", "RATE_LIMIT_DB_PATH": "",
+    })
+    from werkzeug.serving import make_server
+
+    import main
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, main.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_port)
+
+
+def stage_snapshot():
+    from metrics import stage_seconds
+
+    with stage_seconds._lock:
+        return {key[0]: (sum(counts[:-1]), counts[-1]) for key, counts in stage_seconds._values.items()}
+
+
+def stage_means(before, after):
+    """
+    Returns the mean milliseconds per call of every stage that ran between two snapshots.
+    """
+    means = {}
+    for stage, (count, total) in after.items():
+        previous_count, previous_total = before.get(stage, (0, 0.0))
+        if count > previous_count:
+            means[stage] = round((total - previous_total) / (count - previous_count) * 1000.0, 3)
+    return means
+
+
+class Scenario:
+    """
+    Runs one endpoint at one graph size and concurrency level.
+    """
+
+    def __init__(self, base_url, endpoint, size, concurrency, requests_count, run_id, graph_ids):
+        self.base_url = base_url
+        self.endpoint = endpoint
+        self.size = size
+        self.concurrency = concurrency
+        self.requests_count = requests_count
+        self.run_id = run_id
+        self.graph_ids = graph_ids
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def request(self, i):
+        session = self._session()
+        if self.endpoint == "get_response_data":
+            prompt = "benchmark {} {} {} nodes={}".format(self.run_id, self.concurrency, i, self.size)
+            response = session.post(self.base_url + "/get_response_data", json={"user_input": prompt})
+            if response.status_code == 200:
+                self.graph_ids.append(response.json()["meta"]["unique_id"])
+            return response.status_code == 200
+        if self.endpoint == "get_graph_history":
+            response = session.get(self.base_url + "/get_graph_history", params={"limit": 10})
+            return response.status_code == 200
+        unique_id = self.graph_ids[i % len(self.graph_ids)]
+        response = session.post(self.base_url + "/graphviz", json={"unique_id": unique_id, "format": "svg"})
+        return response.status_code in (200, 202)
+
+    def timed_request(self, i):
+        started = time.perf_counter()
+        try:
+            ok = self.request(i)
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    def run(self):
+        before = stage_snapshot()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(self.timed_request, range(self.requests_count)))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for latency, ok in results if ok)
+        return {
+            "endpoint": self.endpoint,
+            "nodes": self.size,
+            "concurrency": self.concurrency,
+            "requests": self.requests_count,
+            "errors": sum(1 for _, ok in results if not ok),
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "latency_ms": {
+                name: round(value * 1000.0, 2) if value is not None else None
+                for name, value in [
+                    ("p50", percentile(latencies, 0.50)),
+                    ("p90", percentile(latencies, 0.90)),
+                    ("p99", percentile(latencies, 0.99)),
+                    ("max", latencies[-1] if latencies else None),
+                    ("mean", sum(latencies) / len(latencies) if latencies else None),
+                ]
+            },
+            "stage_mean_ms": stage_means(before, stage_snapshot()),
+        }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit or None,
+        "graphviz_available": shutil.which("dot") is not None,
+    }
+
+
+def compare(report, baseline):
+    """
+    Prints throughput and latency of every scenario relative to a baseline report.
+    """
+    previous = {(r["endpoint"], r["nodes"], r["concurrency"]): r for r in baseline["results"]}
+    print("{:<18} {:>6} {:>5} {:>12} {:>12} {:>12}".format("endpoint", "nodes", "conc", "rps", "p50", "p99"))
+
+    def ratio(new, old):
+        return "{:+.0%}".format(new / old - 1) if new and old else "n/a"
+
+    for result in report["results"]:
+        old = previous.get((result["endpoint"], result["nodes"], result["concurrency"]))
+        if old is None:
+            continue
+        print("{:<18} {:>6} {:>5} {:>12} {:>12} {:>12}".format(
+            result["endpoint"], result["nodes"], result["concurrency"],
+            ratio(result["throughput_rps"], old["throughput_rps"]),
+            ratio(result["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            ratio(result["latency_ms"]["p99"], old["latency_ms"]["p99"]),
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app against a fake OpenAI server.")
+    parser.add_argument("--sizes", default="10,100,500", help="comma-separated nodes per graph")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated endpoints to run")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated OpenAI latency in seconds")
+    parser.add_argument("--edges-per-node", type=float, default=1.5)
+    parser.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite",
+                        help="graph storage of the app (default sqlite, in a temporary directory)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error("unknown endpoints: {}".format(", ".join(sorted(unknown))))
+
+    fake = start_server(latency=args.latency, edges_per_node=args.edges_per_node)
+    openai_base = "http://{}:{}/v1".format(*fake.server_address)
+    run_id = uuid.uuid4().hex[:8]
+    results = []
+    app_output = sys.stdout if args.verbose else io.StringIO()
+    workdir = tempfile.TemporaryDirectory()
+    with contextlib.redirect_stdout(app_output):
+        server, base_url = start_app(openai_base, args.storage, os.path.join(workdir.name, "graphs.db"))
+        for size in sizes:
+            for level in levels:
+                graph_ids = []
+                for endpoint in ENDPOINTS:
+                    # /get_response_data always runs, it creates the graphs the other
+                    # scenarios list and render
+                    if endpoint not in endpoints and endpoint != "get_response_data":
+                        continue
+                    result = Scenario(base_url, endpoint, size, level, args.requests, run_id, graph_ids).run()
+                    if endpoint in endpoints:
+                        results.append(result)
+                        print(json.dumps(result), file=sys.stderr)
+        server.shutdown()
+    fake.shutdown()
+    workdir.cleanup()
+
+    report = {
+        "environment": environment(),
+        "config": {
+            "sizes": sizes, "concurrency": levels, "requests": args.requests, "endpoints": endpoints,
+            "openai_latency_seconds": args.latency, "edges_per_node": args.edges_per_node,
+            "storage": args.storage,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
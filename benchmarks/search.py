@@ -0,0 +1,114 @@
+"""
+Measures the BM25 search index (search.py): building it and query latency over a corpus
+of synthetic graphs.
+
+Graph descriptions and node labels are drawn from a vocabulary with Zipf-distributed word
+frequencies, as in natural text, so a few terms occur in nearly every graph and most in
+very few. Queries are grouped by how common their terms are, since the work per query
+grows with the postings of its terms. --replaced re-adds that share of the graphs with
+an extra node, as expansions do, leaving tombstoned documents in the index.
+
+Example:
+    python -m benchmarks.search --graphs 100000 --output search.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.run import environment, percentile
+from search import SearchIndex
+
+# Query groups by vocabulary rank: 0 is the most frequent word
+QUERIES = {
+    "common_1_term": [(0,), (1,), (2,)],
+    "common_3_terms": [(0, 1, 2), (1, 5, 200), (3, 4, 10)],
+    "common_4_terms": [(0, 1, 2, 3), (0, 2, 4, 6)],
+    "mid_3_terms": [(100, 3000, 4000), (50, 500, 5000)],
+    "rare_2_terms": [(7000, 13000), (20000, 30000)],
+}
+
+
+def make_corpus(count, vocabulary, words_per_graph, seed):
+    """
+    Returns count (meta, nodes) pairs: a 10 word description and nodes labelled with word
+    pairs from a Zipf-distributed vocabulary.
+    """
+    rng = random.Random(seed)
+    words = ["w{}".format(rank) for rank in range(vocabulary)]
+    weights = [1.0 / (rank + 1) for rank in range(vocabulary)]
+    corpus = []
+    for i in range(count):
+        drawn = rng.choices(words, weights, k=words_per_graph + 10)
+        nodes = [{"label": " ".join(drawn[j:j + 2]), "type": "Thing"} for j in range(0, words_per_graph, 2)]
+        meta = {"unique_id": "graph-{:08d}".format(i), "description": " ".join(drawn[words_per_graph:]),
+                "lastUpdatedOn": "2024-01-01T00:00:00"}
+        corpus.append((meta, nodes))
+    return corpus
+
+
+def latency(latencies):
+    latencies = sorted(latencies)
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000.0, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000.0, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000.0, 3),
+        "max_ms": round(latencies[-1] * 1000.0, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure BM25 index build time and query latency.")
+    parser.add_argument("--graphs", type=int, default=100000, help="graphs in the index")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words")
+    parser.add_argument("--words", type=int, default=50, help="node label words per graph")
+    parser.add_argument("--replaced", type=float, default=0.0, help="share of graphs re-added after an expansion")
+    parser.add_argument("--repeat", type=int, default=100, help="runs of every query")
+    parser.add_argument("--limit", type=int, default=10, help="results per query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    corpus = make_corpus(args.graphs, args.vocabulary, args.words, args.seed)
+    index = SearchIndex()
+    started = time.perf_counter()
+    for meta, nodes in corpus:
+        index.add(meta, nodes)
+    build_seconds = time.perf_counter() - started
+    rng = random.Random(args.seed)
+    for meta, nodes in rng.sample(corpus, int(len(corpus) * args.replaced)):
+        index.add(dict(meta, lastUpdatedOn="2024-01-02T00:00:00"), nodes + [{"label": "expanded", "type": "Thing"}])
+    print("index built in {:.1f}s: {}".format(build_seconds, index.stats()), file=sys.stderr)
+
+    results = {}
+    for group, queries in QUERIES.items():
+        latencies = []
+        for ranks in queries:
+            query = " ".join("w{}".format(rank) for rank in ranks if rank < args.vocabulary)
+            index.search(query, args.limit)
+            for _ in range(args.repeat):
+                query_started = time.perf_counter()
+                index.search(query, args.limit)
+                latencies.append(time.perf_counter() - query_started)
+        results[group] = latency(latencies)
+        print("{:<16} p50 {:>8.3f} ms  p99 {:>8.3f} ms".format(
+            group, results[group]["p50_ms"], results[group]["p99_ms"]), file=sys.stderr)
+
+    report = {
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "index": dict(index.stats(), build_seconds=round(build_seconds, 3)),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Measures how fast the app starts: importing main, creating the app, answering its first
+request and becoming ready.
+
+Every run is a fresh Python process, as a new gunicorn worker or pod would be. The app
+is served by the test client, with graphs kept in memory (STORAGE_BACKEND=memory) unless
+--env says otherwise. Point --path at another checkout to measure it the same way;
+trees without create_app() or /readyz are measured up to their first request.
+--neo4j-unreachable configures Neo4j at an address that never answers, to show what an
+unreachable database costs at startup.
+
+Example:
+    python -m benchmarks.startup --runs 10 --output after.json
+    python -m benchmarks.startup --path ../instagraph-before --output before.json
+    python -m benchmarks.startup --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import environment
+
+# Runs in the child process, with the checkout on sys.path; writes its timings as JSON to
+# the file named by its second argument, apart from the app's own output
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+timings = {}
+import main
+timings["import_main"] = time.perf_counter() - started
+app = main.create_app() if hasattr(main, "create_app") else main.app
+timings["create_app"] = time.perf_counter() - started
+client = app.test_client()
+probe = "/healthz" if "healthz" in {rule.endpoint.rpartition(".")[2] for rule in app.url_map.iter_rules()} else "/cache_stats"
+status = client.get(probe).status_code
+timings["first_request"] = time.perf_counter() - started
+readiness = getattr(main, "readiness", None)
+if readiness is not None:
+    readiness.wait(float(sys.argv[1]))
+    status = client.get("/readyz").status_code
+    timings["ready"] = time.perf_counter() - started if status == 200 else None
+with open(sys.argv[2], "w") as f:
+    json.dump({"status": status, "seconds": timings, "modules": len(sys.modules)}, f)
+"""
+
+STAGES = ("import_main", "create_app", "first_request", "ready")
+
+
+def run_once(path, env, ready_timeout):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = os.path.join(workdir, "startup.json")
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", PROBE, str(ready_timeout), output], cwd=path, env=env,
+                                   capture_output=True, text=True, timeout=ready_timeout + 120)
+        wall = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise RuntimeError("startup probe failed:\n" + completed.stderr[-2000:])
+        with open(output, encoding="utf-8") as f:
+            result = json.load(f)
+    result["seconds"]["process"] = wall
+    return result
+
+
+def summarize(runs):
+    summary = {}
+    for stage in STAGES + ("process",):
+        values = [run["seconds"].get(stage) for run in runs]
+        values = [value for value in values if value is not None]
+        if values:
+            summary[stage] = {
+                "median_ms": round(statistics.median(values) * 1000.0, 1),
+                "min_ms": round(min(values) * 1000.0, 1),
+                "max_ms": round(max(values) * 1000.0, 1),
+            }
+    return summary
+
+
+def compare(report, baseline):
+    """
+    Prints the median of every stage relative to a baseline report.
+    """
+    print("{:<14} {:>12} {:>12} {:>8}".format("stage", "before ms", "after ms", "change"))
+    for stage, after in report["summary"].items():
+        before = baseline["summary"].get(stage)
+        if before is None:
+            continue
+        change = after["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else None
+        print("{:<14} {:>12} {:>12} {:>8}".format(stage, before["median_ms"], after["median_ms"],
+                                                  "{:+.0%}".format(change) if change is not None else "n/a"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the app's cold start in fresh processes.")
+    parser.add_argument("--path", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="checkout to measure (default: this one)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ready-timeout", type=float, default=60.0, help="seconds to wait for /readyz")
+    parser.add_argument("--neo4j-unreachable", action="store_true",
+                        help="configure Neo4j at a non-routable address")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app, may be repeated")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.path.abspath(args.path),
+        "STORAGE_BACKEND": "memory",
+        "OPENAI_API_KEY": "benchmark",
+        # empty values keep a .env file from configuring Neo4j or the disk caches
+        "NEO4J_URL": "", "NEO4J_USERNAME": "", "NEO4J_PASSWORD": "",
+        "CACHE_DB_PATH": "", "SCRAPE_CACHE_DIR": "", "RATE_LIMIT_DB_PATH": "",
+    })
+    if args.neo4j_unreachable:
+        env.update({"STORAGE_BACKEND": "auto", "NEO4J_URL": "bolt://10.255.255.1:7687",
+                    "NEO4J_USERNAME": "neo4j", "NEO4J_PASSWORD": "benchmark"})
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    runs = []
+    for i in range(args.runs):
+        result = run_once(os.path.abspath(args.path), env, args.ready_timeout)
+        print(json.dumps(result), file=sys.stderr)
+        runs.append(result)
+
+    report = {
+        "environment": environment(),
+        "config": {"path": os.path.abspath(args.path), "runs": args.runs,
+                   "neo4j_unreachable": args.neo4j_unreachable, "env": args.env},
+        "summary": summarize(runs),
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Compares the graph storage backends on ingestion and history reads.
+
+Canned graphs (see fake_openai.py) are written one per transaction and in bulk batches,
+then history pages are read at several concurrency levels, walked page by page with the
+cursor, read at several depths (--depths, pages deep through the cursor) and single graphs
+are fetched by unique_id. SQLite runs on a temporary file.
+Neo4j runs when NEO4J_URL, NEO4J_USERNAME and NEO4J_PASSWORD are set; its benchmark
+graphs get a "bench-<run>-" unique_id prefix and are deleted at the end.
+
+Example:
+    python -m benchmarks.storage --graphs 2000 --nodes 50 --output storage.json
+    python -m benchmarks.storage --backends sqlite --graphs 10000 --depths 1,10,100,500,1000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from benchmarks.fake_openai import canned_graph
+from benchmarks.run import environment, percentile
+from storage import Neo4jStorage, SQLiteStorage
+
+DELETE_BENCHMARK_GRAPHS_QUERY = """
+MATCH (m:MetaData) WHERE m.uuid STARTS WITH $prefix
+OPTIONAL MATCH (m)-[:CONTAINS]->(n:Node)
+DETACH DELETE m, n
+"""
+
+
+def make_graphs(prefix, count, nodes, edges_per_node):
+    """
+    Returns count (meta, graph) pairs with laid out nodes and increasing lastUpdatedOn.
+    """
+    graphs = []
+    for i in range(count):
+        graph = canned_graph("{}{} nodes={}".format(prefix, i, nodes), edges_per_node=edges_per_node)
+        for j, node in enumerate(graph["nodes"]):
+            node["position"] = {"x": float(j), "y": float(-j)}
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(1700000000 + i))
+        meta = {"unique_id": "{}{:08d}".format(prefix, i), "description": graph["metadata"]["description"],
+                "createdOn": timestamp, "lastUpdatedOn": timestamp}
+        graphs.append((meta, graph))
+    return graphs
+
+
+def stats(latencies, elapsed, operations):
+    latencies = sorted(latencies)
+    return {
+        "operations": operations,
+        "elapsed_seconds": round(elapsed, 3),
+        "per_second": round(operations / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000.0, 3) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000.0, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000.0, 3) if latencies else None,
+        },
+    }
+
+
+def timed_calls(func, args_list, concurrency=1):
+    def call(args):
+        started = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(call, args_list))
+    return stats(latencies, time.perf_counter() - started, len(args_list))
+
+
+def bench_backend(storage, graphs, args):
+    results = {}
+    single = graphs[:args.single]
+    results["ingest_single"] = timed_calls(storage.save_graph, single)
+
+    started = time.perf_counter()
+    storage.save_graphs(graphs[args.single:], batch_size=args.batch_elements)
+    results["ingest_batch"] = stats([], time.perf_counter() - started, len(graphs) - args.single)
+
+    for level in args.concurrency:
+        results["history_first_page_c{}".format(level)] = timed_calls(
+            storage.fetch_graph_history, [(args.page_size, None)] * args.reads, level)
+
+    cursor = None
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.pages):
+        page_started = time.perf_counter()
+        _, cursor = storage.fetch_graph_history(args.page_size, cursor)
+        latencies.append(time.perf_counter() - page_started)
+        if cursor is None:
+            break
+    results["history_paged"] = stats(latencies, time.perf_counter() - started, len(latencies))
+
+    # pages deep into the history, read through the cursor of the page before: keyset
+    # pagination seeks straight to the cursor, so their latency should not grow with depth
+    cursors = {1: None}
+    cursor, page = None, 1
+    while page < max(args.depths):
+        _, cursor = storage.fetch_graph_history(args.page_size, cursor)
+        if cursor is None:
+            break
+        page += 1
+        cursors[page] = cursor
+    for depth in args.depths:
+        if depth in cursors:
+            results["history_page_{}".format(depth)] = timed_calls(
+                storage.fetch_graph_history, [(args.page_size, cursors[depth])] * args.reads)
+
+    rng = random.Random(0)
+    ids = [(meta["unique_id"],) for meta, _ in rng.sample(graphs, min(args.reads, len(graphs)))]
+    for level in args.concurrency:
+        results["fetch_graph_c{}".format(level)] = timed_calls(storage.fetch_graph, ids, level)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare graph storage backends on ingestion and history reads.")
+    parser.add_argument("--backends", default="sqlite,neo4j", help="comma-separated backends to run")
+    parser.add_argument("--graphs", type=int, default=1000, help="graphs to ingest")
+    parser.add_argument("--nodes", type=int, default=50, help="nodes per graph")
+    parser.add_argument("--edges-per-node", type=float, default=1.5)
+    parser.add_argument("--single", type=int, default=100, help="graphs written one per transaction")
+    parser.add_argument("--batch-elements", type=int, default=5000, help="nodes plus edges per bulk transaction")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=50, help="history pages walked with the cursor")
+    parser.add_argument("--depths", default="1,10,100,1000",
+                        help="comma-separated history page numbers read through their cursor")
+    parser.add_argument("--reads", type=int, default=200, help="reads per read scenario")
+    parser.add_argument("--concurrency", default="1,8", help="comma-separated reader concurrency levels")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    args.depths = [int(depth) for depth in args.depths.split(",")]
+    if not 0 <= args.single <= args.graphs:
+        parser.error("--single must be between 0 and --graphs")
+
+    load_dotenv()
+    prefix = "bench-{}-".format(uuid.uuid4().hex[:8])
+    graphs = make_graphs(prefix, args.graphs, args.nodes, args.edges_per_node)
+    report = {"environment": environment(), "config": {k: v for k, v in vars(args).items() if k != "output"},
+              "results": {}}
+
+    for backend in args.backends.split(","):
+        if backend == "sqlite":
+            with tempfile.TemporaryDirectory() as workdir:
+                storage = SQLiteStorage(os.path.join(workdir, "graphs.db"))
+                report["results"]["sqlite"] = bench_backend(storage, graphs, args)
+                storage.close()
+        elif backend == "neo4j":
+            url, username, password = (os.getenv(name) for name in ("NEO4J_URL", "NEO4J_USERNAME", "NEO4J_PASSWORD"))
+            if not (url and username and password):
+                print("neo4j: NEO4J_URL, NEO4J_USERNAME and NEO4J_PASSWORD are not set, skipped", file=sys.stderr)
+                continue
+            from neo4j import GraphDatabase
+
+            storage = Neo4jStorage(GraphDatabase.driver(url, auth=(username, password)))
+            storage.ensure_schema()
+            try:
+                report["results"]["neo4j"] = bench_backend(storage, graphs, args)
+            finally:
+                storage.driver.execute_query(DELETE_BENCHMARK_GRAPHS_QUERY, {"prefix": prefix})
+                storage.close()
+        else:
+            parser.error("unknown backend: {}".format(backend))
+        print("{} done".format(backend), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
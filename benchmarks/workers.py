@@ -0,0 +1,130 @@
+"""
+Compares gunicorn worker classes: requests per second of /get_response_data at a fixed
+concurrency, with the app served by sync workers (one request per process at a time)
+and by gthread workers (gunicorn.conf.py, many threads per process).
+
+Each worker class runs the real gunicorn.conf.py in a subprocess, with only the worker
+class, workers, threads and bind address overridden on the command line. OpenAI is the
+fake server (see fake_openai.py) with --latency seconds of delay per completion, which
+stands for the time a worker spends waiting on the model. Graphs are kept in memory and
+every request has a different prompt, so nothing is served from a cache.
+
+Example:
+    python -m benchmarks.workers --workers 2 --threads 50 --concurrency 32 --latency 0.5
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+
+from benchmarks.fake_openai import start_server
+from benchmarks.run import Scenario, environment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(worker_class, workers, threads, env, log):
+    """
+    Starts gunicorn with gunicorn.conf.py and returns (process, base_url) once /healthz
+    answers in every worker.
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+         "--worker-class", worker_class, "--workers", str(workers), "--threads", str(threads),
+         "--bind", "127.0.0.1:{}".format(port)],
+        cwd=ROOT, env=env, stdout=log, stderr=log)
+    base_url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with status {}".format(process.returncode))
+        try:
+            if requests.get(base_url + "/healthz", timeout=1).status_code == 200:
+                # let the other workers finish booting too
+                time.sleep(1.0)
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not answer /healthz within 60s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sync and gthread gunicorn workers.")
+    parser.add_argument("--worker-classes", default="sync,gthread", help="comma-separated worker classes")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=50, help="threads per gthread worker")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="requests per worker class")
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated OpenAI latency in seconds")
+    parser.add_argument("--nodes", type=int, default=20, help="nodes per generated graph")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show gunicorn's output")
+    args = parser.parse_args(argv)
+
+    fake = start_server(latency=args.latency)
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT,
+        "STORAGE_BACKEND": "memory",
+        "OPENAI_API_BASE": "http://{}:{}/v1".format(*fake.server_address),
+        "OPENAI_API_KEY": "benchmark",
+        # empty values keep a .env file from configuring Neo4j or the disk caches
+        "NEO4J_URL": "", "NEO4J_USERNAME": "", "NEO4J_PASSWORD": "",
+        "CACHE_DB_PATH": "", "SCRAPE_CACHE_DIR": "", "RATE_LIMIT_DB_PATH": "",
+    })
+    run_id = uuid.uuid4().hex[:8]
+    results = {}
+    with tempfile.TemporaryFile("w+") as log:
+        for worker_class in args.worker_classes.split(","):
+            # gunicorn switches sync workers to gthread when threads > 1
+            threads = 1 if worker_class == "sync" else args.threads
+            process, base_url = start_gunicorn(worker_class, args.workers, threads, env,
+                                               None if args.verbose else log)
+            try:
+                result = Scenario(base_url, "get_response_data", args.nodes, args.concurrency, args.requests,
+                                  "{}-{}".format(run_id, worker_class), []).run()
+            finally:
+                process.terminate()
+                process.wait(30)
+            # stage timings are recorded in the gunicorn workers, not here
+            result.pop("stage_mean_ms")
+            result.update({"worker_class": worker_class, "workers": args.workers, "threads": threads})
+            results[worker_class] = result
+            print("{:<8} {:>8.2f} req/s  p50 {:>8} ms  p99 {:>8} ms  errors {}".format(
+                worker_class, result["throughput_rps"] or 0.0, result["latency_ms"]["p50"],
+                result["latency_ms"]["p99"], result["errors"]), file=sys.stderr)
+    fake.shutdown()
+
+    report = {
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "verbose")},
+        "results": results,
+    }
+    if "sync" in results and "gthread" in results and results["sync"]["throughput_rps"]:
+        report["gthread_speedup"] = round(results["gthread"]["throughput_rps"] / results["sync"]["throughput_rps"], 2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
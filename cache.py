@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+from models import KnowledgeGraph
+
+# Any change to the KnowledgeGraph schema produces a new version, so cached
+# graphs generated against an older schema are never served.
+SCHEMA_VERSION = hashlib.sha256(
+    json.dumps(KnowledgeGraph.model_json_schema(), sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+
+def normalize_input(user_input):
+    """
+    Normalizes user input so that trivially different prompts share a cache entry.
+    Collapses all whitespace runs and case-folds the text.
+    """
+    return " ".join(user_input.split()).casefold()
+
+
+def make_cache_key(user_input, model):
+    """
+    Builds a content-addressed cache key from the normalized input, the model name
+    and the KnowledgeGraph schema version.
+    """
+    payload = "\x1f".join([normalize_input(user_input), model, SCHEMA_VERSION])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheTier:
+    """
+    Optional on-disk cache tier storing serialized KnowledgeGraph JSON in SQLite.
+    A new connection is opened per operation so the tier can be shared between threads
+    and between gunicorn workers pointing at the same file. Each one is closed afterwards:
+    using a connection as a context manager only commits or rolls back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS kg_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key, ttl):
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM kg_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if ttl and time.time() - created_at > ttl:
+                conn.execute("DELETE FROM kg_cache WHERE key = ?", (key,))
+                return None
+            return value
+
+    def set(self, key, value):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kg_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+
+
+class KnowledgeGraphCache:
+    """
+    Two-tier cache for generated knowledge graphs.
+
+    The first tier is an in-process LRU with a TTL, the second an optional SQLite file.
+    Values are stored as KnowledgeGraph JSON and re-validated on read, so callers always
+    receive a KnowledgeGraph instance.
+
+    Parameters:
+    max_entries (int): Maximum number of graphs kept in memory.
+    ttl (float): Seconds an entry stays valid, 0 disables expiry.
+    disk_path (str): Path of the SQLite file for the on-disk tier, or None to disable it.
+    """
+
+    def __init__(self, max_entries=256, ttl=86400, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = SQLiteCacheTier(disk_path) if disk_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached KnowledgeGraph for the key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self.ttl or now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return KnowledgeGraph.model_validate_json(value)
+                del self._entries[key]
+
+        if self.disk is not None:
+            value = self.disk.get(key, self.ttl)
+            if value is not None:
+                self._remember(key, value, now)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return KnowledgeGraph.model_validate_json(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, graph):
+        """
+        Stores a validated KnowledgeGraph in every enabled tier.
+        """
+        value = graph.model_dump_json(by_alias=True)
+        self._remember(key, value, time.time())
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def _remember(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the current in-memory size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_enabled": self.disk is not None,
+            }
+
+
+def cache_from_env():
+    """
+    Creates the cache configured through the CACHE_* environment variables.
+    """
+    return KnowledgeGraphCache(
+        max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "256")),
+        ttl=float(os.getenv("CACHE_TTL_SECONDS", "86400")),
+        disk_path=os.getenv("CACHE_DB_PATH") or None,
+    )
@@ -0,0 +1,205 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from models import Edge, KnowledgeGraph
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+NON_WORD = re.compile(r"[^\w]+")
+
+
+def estimate_tokens(text):
+    """
+    Returns the token count of the text, exact with tiktoken installed and otherwise
+    approximated as one token per four characters.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _split_oversized(piece, max_tokens):
+    # Sentences first, then words, so no part exceeds the budget
+    parts = SENTENCE_BOUNDARY.split(piece)
+    if len(parts) == 1:
+        words = piece.split()
+        step = max(1, len(words) * max_tokens // max(1, estimate_tokens(piece)))
+        return [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+    return parts
+
+
+def split_into_chunks(text, max_tokens):
+    """
+    Splits text into chunks of at most max_tokens tokens, breaking on paragraph boundaries
+    where possible and on sentence or word boundaries otherwise.
+
+    Parameters:
+    text (str): The document to split.
+    max_tokens (int): Token budget per chunk.
+
+    Returns:
+    list: The chunks, in document order.
+    """
+    # kept reversed so the next piece is popped from the end
+    pieces = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()][::-1]
+    chunks = []
+    current = []
+    current_tokens = 0
+    while pieces:
+        piece = pieces.pop()
+        tokens = estimate_tokens(piece)
+        if tokens > max_tokens:
+            parts = _split_oversized(piece, max_tokens)
+            if len(parts) > 1:
+                pieces.extend(reversed(parts))
+                continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        # one extra token for the paragraph separator
+        current_tokens += tokens + 1
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def normalize_label(label):
+    """
+    Normalizes a node label for deduplication: case-folded, punctuation and repeated
+    whitespace removed.
+    """
+    return " ".join(NON_WORD.sub(" ", label).split()).casefold()
+
+
+def merge_graphs(graphs):
+    """
+    Merges knowledge graphs extracted from consecutive chunks into one graph.
+
+    Nodes are deduplicated by normalized label. The first occurrence keeps its type and
+    color, and properties from later occurrences fill in missing keys. Merged nodes are
+    renumbered "1", "2", ... in order of first appearance. Edges are remapped onto the
+    merged nodes and deduplicated by (from, to, normalized relationship). Edges whose
+    endpoints are not nodes of their own chunk are dropped. The metadata of the first
+    graph is kept. The result only depends on the order of the input graphs.
+
+    Parameters:
+    graphs (list): KnowledgeGraph instances, in document order.
+
+    Returns:
+    KnowledgeGraph: The merged graph.
+    """
+    nodes = {}
+    edges = {}
+    for graph in graphs:
+        local_ids = {}
+        for node in graph.nodes:
+            key = normalize_label(node.label) or normalize_label(node.id)
+            merged = nodes.get(key)
+            if merged is None:
+                merged = node.model_copy(update={"id": str(len(nodes) + 1), "properties": dict(node.properties)})
+                nodes[key] = merged
+            else:
+                for name, value in node.properties.items():
+                    merged.properties.setdefault(name, value)
+            local_ids[node.id] = merged.id
+
+        for edge in graph.edges:
+            source = local_ids.get(edge.from_)
+            target = local_ids.get(edge.to)
+            if source is None or target is None:
+                continue
+            key = (source, target, normalize_label(edge.relationship))
+            if key not in edges:
+                edges[key] = Edge.model_validate({
+                    **edge.model_dump(by_alias=True), "from": source, "to": target})
+
+    return KnowledgeGraph(
+        metadata=graphs[0].metadata,
+        nodes=list(nodes.values()),
+        edges=list(edges.values()),
+    )
+
+
+def extract_graph_chunked(text, extract, max_tokens, max_workers=4):
+    """
+    Map-reduce extraction for documents that do not fit one prompt: the text is split into
+    token-bounded chunks, a KnowledgeGraph is extracted per chunk on a bounded thread pool,
+    and the results are merged with merge_graphs.
+
+    Parameters:
+    text (str): The document.
+    extract (callable): Takes one chunk of text and returns its KnowledgeGraph.
+    max_tokens (int): Token budget per chunk.
+    max_workers (int): Maximum number of chunks extracted at once.
+
+    Returns:
+    KnowledgeGraph: The merged graph.
+    """
+    chunks = split_into_chunks(text, max_tokens)
+    print("extracting knowledge graph from {} chunks".format(len(chunks)))
+    if len(chunks) == 1:
+        return extract(chunks[0])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map keeps document order, which keeps the merge deterministic
+        graphs = list(executor.map(extract, chunks))
+    return merge_graphs(graphs)
+
+
+def merge_delta(graph, delta, context_ids=None):
+    """
+    Resolves a KnowledgeGraph delta generated to extend an existing graph.
+
+    Delta nodes whose normalized label matches a node of the graph, or whose id is one of
+    the context nodes the model was shown, refer to that node; the others are new and get
+    fresh numeric ids after the graph's highest one. Edges are remapped onto those ids and
+    dropped if an endpoint is unknown or the graph already has the same (from, to,
+    normalized relationship) edge. The graph is not modified.
+
+    Parameters:
+    graph (dict): The existing knowledge graph dict ("from"/"to" edges).
+    delta (KnowledgeGraph): The nodes and edges proposed by the model.
+    context_ids (set): Ids of the nodes the model was shown, the only ones it can refer to
+        by id. Defaults to every node of the graph.
+
+    Returns:
+    dict: {"nodes": [...], "edges": [...]} holding only the new nodes and edges.
+    """
+    existing_ids = {node["id"] for node in graph["nodes"]}
+    if context_ids is None:
+        context_ids = existing_ids
+    by_label = {normalize_label(node["label"]): node["id"] for node in graph["nodes"]}
+    next_id = max((int(node_id) for node_id in existing_ids if node_id.isdigit()), default=0) + 1
+
+    local_ids = {}
+    nodes = []
+    for node in delta.nodes:
+        key = normalize_label(node.label) or normalize_label(node.id)
+        node_id = by_label.get(key)
+        if node_id is None and node.id in context_ids:
+            node_id = node.id
+        if node_id is None:
+            # also when the id belongs to a node outside the context, which is unrelated
+            node_id = str(next_id)
+            next_id += 1
+            by_label[key] = node_id
+            nodes.append({**node.model_dump(), "id": node_id})
+        local_ids[node.id] = node_id
+
+    seen = {(edge["from"], edge["to"], normalize_label(edge["relationship"])) for edge in graph["edges"]}
+    edges = []
+    for edge in delta.edges:
+        source = local_ids.get(edge.from_, edge.from_ if edge.from_ in context_ids else None)
+        target = local_ids.get(edge.to, edge.to if edge.to in context_ids else None)
+        key = (source, target, normalize_label(edge.relationship))
+        if source is None or target is None or key in seen:
+            continue
+        seen.add(key)
+        edges.append({**edge.model_dump(by_alias=True), "from": source, "to": target})
+    return {"nodes": nodes, "edges": edges}
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+
+class LazyClient:
+    """
+    A client created on first use and then shared by every thread of the process.
+
+    Creating the app's clients means importing large packages (openai and instructor,
+    neo4j) and, for databases, opening connections; deferring it keeps worker boot fast and
+    keeps an unreachable upstream from blocking startup. Attribute access is forwarded to
+    the client, so a LazyClient can be passed wherever the client itself is expected (the
+    Neo4j driver given to persistence.py, for example).
+
+    Parameters:
+    name (str): Name used in log lines.
+    create (callable): Returns the client; called once, by the first thread that needs it.
+    """
+
+    def __init__(self, name, create):
+        self.name = name
+        self._create = create
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    self._client = self._create()
+                    print("{} client initialized in {:.0f} ms".format(
+                        self.name, (time.perf_counter() - started) * 1000.0))
+                client = self._client
+        return client
+
+    @property
+    def initialized(self):
+        return self._client is not None
+
+    def __getattr__(self, attribute):
+        # private names are never forwarded, so copying or unpickling cannot recurse here
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+        return getattr(self.get(), attribute)
+
+    def close(self):
+        """
+        Closes the client if it was created. The next use creates a new one.
+        """
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None and hasattr(client, "close"):
+            client.close()
+
+
+def neo4j_driver_from_env(max_connections=50):
+    """
+    Returns a LazyClient for the Neo4j driver configured through NEO4J_URL, NEO4J_USERNAME
+    and NEO4J_PASSWORD, or None when they are not set. The neo4j package is imported and
+    the driver created on first use; the driver keeps a pool of up to max_connections
+    connections, which it opens as they are needed.
+    """
+    url, username, password = (os.getenv(name) for name in ("NEO4J_URL", "NEO4J_USERNAME", "NEO4J_PASSWORD"))
+    if not (url and username and password):
+        return None
+
+    def create():
+        from neo4j import GraphDatabase
+
+        return GraphDatabase.driver(url, auth=(username, password), max_connection_pool_size=max_connections)
+
+    return LazyClient("Neo4j", create)
@@ -0,0 +1,353 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from uuid import uuid4
+
+from cache import cache_from_env, make_cache_key
+from chunking import estimate_tokens, extract_graph_chunked
+from clients import LazyClient
+from limits import UpstreamBusyError, UpstreamLimiter
+from metrics import span
+from models import KnowledgeGraph
+from ratelimit import Coalescer, rate_limiter_from_env
+from streaming import KnowledgeGraphStreamParser
+
+
+def create_openai_client():
+    # openai takes about half a second to import, about as long as the rest of the app
+    # together, so it is loaded on first use or by the readiness check. Completions build
+    # their function schema with instructor's openai_schema, so openai.ChatCompletion is
+    # left unpatched.
+    import openai
+
+    # Set your OpenAI API key
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+
+# The openai module, configured on first use
+openai_client = LazyClient("OpenAI", create_openai_client)
+OPENAI_MODEL = "gpt-3.5-turbo-16k"
+# Longer inputs are split into chunks of this many tokens and extracted in parallel
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "6000"))
+CHUNK_MAX_WORKERS = int(os.getenv("CHUNK_MAX_WORKERS", "4"))
+
+# Generated graphs are cached by a hash of the normalized input, model and schema version
+kg_cache = cache_from_env()
+
+# Bound the number of in-flight OpenAI calls, gunicorn runs many threads per worker
+openai_limiter = UpstreamLimiter(
+    "OpenAI", int(os.getenv("OPENAI_MAX_CONCURRENCY", "100")),
+    float(os.getenv("UPSTREAM_MAX_WAIT_SECONDS", "30")))
+
+# Requests- and tokens-per-minute budgets, shared between workers with RATE_LIMIT_DB_PATH
+rate_limiter = rate_limiter_from_env()
+# Tokens reserved for a completion until its real usage is known
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", "1500"))
+# Retries per OpenAI call made while serving a request
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# Concurrent generations of the same input share one OpenAI call; the requests waiting
+# for it give up with a 503 after COALESCE_MAX_WAIT_SECONDS
+coalescer = Coalescer(float(os.getenv("COALESCE_MAX_WAIT_SECONDS", "300")))
+
+
+
+class TokenUsage:
+    """
+    Thread-safe running totals of the OpenAI calls made by this process and the tokens
+    they used.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, completion):
+        """
+        Adds the usage of a response_model completion, read from its raw OpenAI response.
+
+        Returns:
+        int: The total tokens of the completion, or None if OpenAI did not report usage.
+        """
+        raw = getattr(completion, "_raw_response", None)
+        usage = (raw or {}).get("usage") or {}
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+        if "total_tokens" in usage or "prompt_tokens" in usage:
+            return usage.get("total_tokens", usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+            }
+
+
+token_usage = TokenUsage()
+
+
+def is_retryable(error):
+    """
+    Returns True for errors a later attempt may not hit: rate limits, overload, transient
+    network failures and 5xx responses.
+    """
+    if isinstance(error, UpstreamBusyError):
+        return True
+    if not openai_client.initialized:
+        # no OpenAI call was made, the error cannot come from one
+        return False
+    errors = openai_client.error
+    if isinstance(error, (errors.RateLimitError, errors.ServiceUnavailableError, errors.APIConnectionError,
+                          errors.Timeout, errors.TryAgain)):
+        return True
+    return isinstance(error, errors.APIError) and (error.http_status or 0) >= 500
+
+
+def is_rate_limited(error):
+    """
+    Returns True if error is OpenAI's rate limit error.
+    """
+    return openai_client.initialized and isinstance(error, openai_client.error.RateLimitError)
+
+
+def retry_after(error):
+    """
+    Returns the Retry-After delay in seconds an OpenAI error carries, or None.
+    """
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def with_backoff(func, *args, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """
+    Calls func(*args), retrying retryable errors with exponential backoff and full jitter,
+    so many workers hitting the same rate limit do not retry in lockstep. A Retry-After
+    sent by OpenAI is used as the lower bound of the delay.
+
+    Raises:
+    The last error once max_retries retries failed, or any non-retryable error at once.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            delay = max(delay, retry_after(e) or 0.0)
+            print("{}: retrying in {:.1f}s ({}/{})".format(type(e).__name__, delay, attempt + 1, max_retries))
+            time.sleep(delay)
+
+
+def knowledge_graph_messages(user_input):
+    """
+    Returns the chat messages asking the model to describe the input as a knowledge graph.
+    """
+    return [
+        {
+            "role": "user",
+            "content": f"Help me understand following by describing as a detailed knowledge graph: {user_input}",
+        }
+    ]
+
+
+def estimate_request_tokens(messages):
+    """
+    Returns the tokens reserved from the rate limiter for a chat completion: its prompt
+    plus COMPLETION_TOKENS_ESTIMATE.
+    """
+    return sum(estimate_tokens(message["content"]) for message in messages) + COMPLETION_TOKENS_ESTIMATE
+
+
+def create_completion(messages, response_model=KnowledgeGraph):
+    """
+    Makes one (non-streaming) OpenAI call within the rate limiter's budgets and the
+    concurrency limit, and records its token usage.
+    """
+    estimated = estimate_request_tokens(messages)
+    # budget first, so calls waiting for it do not hold a concurrency slot
+    with span("rate_limit_wait"):
+        rate_limiter.acquire(estimated)
+    # the function call is made here rather than through instructor's response_model, so
+    # the model's latency and the Pydantic validation are timed separately
+    openai = openai_client.get()
+    from instructor import openai_schema
+
+    schema = openai_schema(response_model)
+    with openai_limiter, span("llm"):
+        response = openai.ChatCompletion.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            functions=[schema.openai_schema],
+            function_call={"name": schema.openai_schema["name"]},
+        )
+    with span("validate"):
+        completion = schema.from_response(response)
+    completion._raw_response = response
+    rate_limiter.settle(estimated, token_usage.add(completion))
+    return completion
+
+
+def request_knowledge_graph(user_input):
+    """
+    Asks OpenAI for the KnowledgeGraph of one prompt-sized input.
+    """
+    print("starting openai call")
+    return create_completion(knowledge_graph_messages(user_input))
+
+
+def generate_knowledge_graph(user_input, max_retries=OPENAI_MAX_RETRIES):
+    """
+    Returns the KnowledgeGraph for the given input, calling OpenAI only when the
+    cache has no entry for the normalized input, model and schema version.
+
+    Inputs longer than CHUNK_MAX_TOKENS are split into chunks that are extracted in
+    parallel and merged into one graph (see chunking.py). Concurrent calls for the same
+    input wait for the first one instead of calling OpenAI again.
+
+    Parameters:
+    user_input (str): Text the knowledge graph should describe.
+    max_retries (int): Retries per OpenAI call for rate limits and transient errors
+        (see with_backoff). 0 fails on the first error.
+
+    Returns:
+    KnowledgeGraph: The validated knowledge graph.
+    """
+    cache_key = make_cache_key(user_input, OPENAI_MODEL)
+    cached = kg_cache.get(cache_key)
+    if cached is not None:
+        print("knowledge graph cache hit")
+        return cached
+
+    return coalescer.run(cache_key, partial(_generate_uncached, user_input, cache_key, max_retries))
+
+
+def _generate_uncached(user_input, cache_key, max_retries):
+    request = request_knowledge_graph
+    if max_retries:
+        # retried per call, so one rate-limited chunk does not redo the others
+        request = partial(with_backoff, request_knowledge_graph, max_retries=max_retries)
+    if estimate_tokens(user_input) > CHUNK_MAX_TOKENS:
+        completion = extract_graph_chunked(user_input, request, CHUNK_MAX_TOKENS, CHUNK_MAX_WORKERS)
+    else:
+        completion: KnowledgeGraph = request(user_input)
+    kg_cache.set(cache_key, completion)
+    return completion
+
+
+def stream_knowledge_graph(user_input):
+    """
+    Generates the KnowledgeGraph for the given input using OpenAI's streaming mode.
+
+    Yields ("metadata", Metadata), ("node", Node) and ("edge", Edge) events as soon as each
+    item is complete, and finally ("graph", KnowledgeGraph) with the validated full graph.
+    Cached graphs, inputs longer than CHUNK_MAX_TOKENS and inputs another request is
+    already generating are replayed through the same events once the whole graph is
+    available.
+
+    Parameters:
+    user_input (str): Text the knowledge graph should describe.
+    """
+    cache_key = make_cache_key(user_input, OPENAI_MODEL)
+    cached = kg_cache.get(cache_key)
+    if cached is None and estimate_tokens(user_input) > CHUNK_MAX_TOKENS:
+        # Too long for one streamed prompt, the merged chunked result is replayed instead
+        cached = coalescer.run(cache_key, partial(_generate_uncached, user_input, cache_key, OPENAI_MAX_RETRIES))
+    elif cached is not None:
+        print("knowledge graph cache hit")
+    future = None
+    if cached is None:
+        future, leader = coalescer.claim(cache_key)
+        if not leader:
+            print("waiting for an identical generation in flight")
+            cached = coalescer.wait(future)
+    if cached is not None:
+        yield "metadata", cached.metadata
+        for node in cached.nodes:
+            yield "node", node
+        for edge in cached.edges:
+            yield "edge", edge
+        yield "graph", cached
+        return
+
+    # everything from here on is inside the try, so the waiting requests are released
+    # whatever fails
+    try:
+        print("starting openai streaming call")
+        openai = openai_client.get()
+        from instructor import openai_schema
+
+        schema = openai_schema(KnowledgeGraph).openai_schema
+        parser = KnowledgeGraphStreamParser()
+        messages = knowledge_graph_messages(user_input)
+        estimated = estimate_request_tokens(messages)
+        with span("rate_limit_wait"):
+            rate_limiter.acquire(estimated)
+        # includes the time the client takes to read the events
+        with openai_limiter, span("llm_stream"):
+            chunks = openai.ChatCompletion.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                functions=[schema],
+                function_call={"name": schema["name"]},
+                stream=True,
+            )
+            for chunk in chunks:
+                if not chunk["choices"]:
+                    continue
+                function_call = chunk["choices"][0]["delta"].get("function_call") or {}
+                if function_call.get("arguments"):
+                    yield from parser.feed(function_call["arguments"])
+        # streamed responses carry no usage, count what was received
+        rate_limiter.settle(estimated, estimate_tokens(messages[0]["content"]) + estimate_tokens(parser.buffer))
+
+        with span("validate"):
+            completion = KnowledgeGraph.model_validate_json(parser.buffer)
+        kg_cache.set(cache_key, completion)
+    except BaseException as e:
+        # also when the client disconnects (GeneratorExit), so waiting requests are released
+        coalescer.resolve(cache_key, future, error=e)
+        raise
+    coalescer.resolve(cache_key, future, completion)
+    yield "graph", completion
+
+
+def graph_to_dict(completion):
+    """
+    Dumps a KnowledgeGraph into a plain dict, with edges keyed by "from" instead of "from_".
+    """
+    # Its now a dict, no need to worry about json loading so many times
+    response_data = completion.model_dump()
+    # Fixing 'from_' to 'from' in the edges
+    for edge in response_data['edges']:
+        edge['from'] = edge.pop('from_')
+    return response_data
+
+
+def new_graph_meta(graph):
+    """
+    Returns the metadata of a newly generated graph: a fresh unique_id, its description
+    and creation timestamps.
+    """
+    created_on = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+    return {
+        "unique_id": str(uuid4()),
+        "description": graph["metadata"]["description"],
+        "createdOn": created_on,
+        "lastUpdatedOn": created_on,
+    }
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class GraphStore:
+    """
+    In-process store of generated graphs keyed by their unique_id.
+
+    Memory is bounded by the total number of nodes and edges held, not by the number
+    of graphs, so one huge graph cannot hide behind a small entry count. The least
+    recently used graphs are evicted first.
+
+    Parameters:
+    max_elements (int): Maximum total number of nodes plus edges kept in the store.
+    """
+
+    def __init__(self, max_elements=200000):
+        self.max_elements = max_elements
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _graph_size(graph):
+        # Every entry costs at least one unit so empty graphs are still bounded
+        return 1 + len(graph.get("nodes", [])) + len(graph.get("edges", []))
+
+    def put(self, unique_id, graph, meta):
+        """
+        Stores a graph and its metadata, evicting least recently used graphs as needed.
+
+        Parameters:
+        unique_id (str): The graph's UUID.
+        graph (dict): The knowledge graph dict with "nodes" and "edges" ("from"/"to" keys).
+        meta (dict): Metadata with unique_id, description, createdOn and lastUpdatedOn.
+        """
+        size = self._graph_size(graph)
+        with self._lock:
+            previous = self._graphs.pop(unique_id, None)
+            if previous is not None:
+                self.size -= previous[2]
+            self._graphs[unique_id] = (graph, meta, size)
+            self.size += size
+            # the newest graph is always kept, even if it alone exceeds the budget
+            while self.size > self.max_elements and len(self._graphs) > 1:
+                _, (_, _, evicted_size) = self._graphs.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def get(self, unique_id):
+        """
+        Returns (graph, meta) for the unique_id, or None if it is not in the store.
+        """
+        with self._lock:
+            entry = self._graphs.get(unique_id)
+            if entry is None:
+                return None
+            self._graphs.move_to_end(unique_id)
+            return entry[0], entry[1]
+
+    def list_meta(self):
+        """
+        Returns (meta, node_count, edge_count) for every stored graph, without touching LRU order.
+        """
+        with self._lock:
+            return [
+                (meta, len(graph.get("nodes", [])), len(graph.get("edges", [])))
+                for graph, meta, _ in self._graphs.values()
+            ]
+
+    def remove(self, unique_id):
+        with self._lock:
+            entry = self._graphs.pop(unique_id, None)
+            if entry is not None:
+                self.size -= entry[2]
+
+    def __contains__(self, unique_id):
+        with self._lock:
+            return unique_id in self._graphs
+
+    def __len__(self):
+        with self._lock:
+            return len(self._graphs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "graphs": len(self._graphs),
+                "elements": self.size,
+                "max_elements": self.max_elements,
+                "evictions": self.evictions,
+            }
+
+
+def graph_store_from_env():
+    """
+    Creates the graph store sized through the GRAPH_STORE_MAX_ELEMENTS environment variable.
+    """
+    return GraphStore(max_elements=int(os.getenv("GRAPH_STORE_MAX_ELEMENTS", "200000")))
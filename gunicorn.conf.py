@@ -0,0 +1,15 @@
+# Threaded workers: requests spend almost all of their time waiting on OpenAI and
+# Neo4j, so each process serves many of them at once instead of one per worker.
+# Per-upstream limits are enforced in the app (see limits.py).
+import multiprocessing
+import os
+
+# The app factory, so a plain "gunicorn" picks it up (see create_app in main.py)
+wsgi_app = "main:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8080")
+workers = int(os.getenv("GUNICORN_WORKERS", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "200"))
+# LLM generations routinely take longer than gunicorn's 30 second default
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+keepalive = 5
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+
+class Readiness:
+    """
+    Runs the startup checks of a process in a background thread and reports whether it is
+    ready to take traffic.
+
+    Required checks run first, then optional ones, each in the order they were added.
+    Failed ones are retried with exponential backoff until they pass, so a database that
+    comes up after the app does not need a restart. The process is ready as soon as every
+    required check has passed; optional checks (such as warming a cache) are reported but
+    do not hold readiness back.
+
+    Parameters:
+    retry_seconds (float): Delay before the first retry of failed checks.
+    max_retry_seconds (float): Longest delay between retries.
+    """
+
+    def __init__(self, retry_seconds=1.0, max_retry_seconds=30.0):
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._checks = []
+        self._results = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self.created = time.monotonic()
+
+    def add(self, name, check, required=True):
+        """
+        Adds a check. check() is called without arguments and passes unless it raises.
+        """
+        self._checks.append((name, check, required))
+        self._results[name] = {"ok": False, "required": required, "error": None, "attempts": 0, "seconds": None}
+
+    def start(self):
+        """
+        Starts the checks in a daemon thread. Later calls do nothing.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="readiness", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # required checks first, so a slow optional one cannot hold readiness back
+        pending = sorted(self._checks, key=lambda item: not item[2])
+        delay = self.retry_seconds
+        while True:
+            for name, check, required in list(pending):
+                started = time.perf_counter()
+                try:
+                    check()
+                    error = None
+                    pending.remove((name, check, required))
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    print("Readiness check {} failed: {}".format(name, error))
+                with self._lock:
+                    result = self._results[name]
+                    result["attempts"] += 1
+                    result["ok"] = error is None
+                    result["error"] = error
+                    result["seconds"] = round(time.perf_counter() - started, 3)
+                if not any(required for _, _, required in pending) and not self._ready.is_set():
+                    self._ready.set()
+                    print("Ready in {:.2f}s".format(time.monotonic() - self.created))
+            if not pending:
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_seconds)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def status(self):
+        """
+        Returns {"ready": bool, "uptime_seconds": float, "checks": {name: result}}.
+        """
+        with self._lock:
+            checks = {name: dict(result) for name, result in self._results.items()}
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.monotonic() - self.created, 3),
+            "checks": checks,
+        }
+
+
+def readiness_from_env():
+    """
+    Creates the readiness checker configured through READINESS_RETRY_SECONDS and
+    READINESS_MAX_RETRY_SECONDS.
+    """
+    return Readiness(
+        retry_seconds=float(os.getenv("READINESS_RETRY_SECONDS", "1")),
+        max_retry_seconds=float(os.getenv("READINESS_MAX_RETRY_SECONDS", "30")),
+    )
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import os
+
+import numpy as np
+
+from metrics import timed
+
+LAYOUT_ITERATIONS = int(os.getenv("LAYOUT_ITERATIONS", "100"))
+# Rows of the pairwise repulsion computed at once, bounds memory to BLOCK x nodes
+REPULSION_BLOCK = 512
+
+
+def _seed(node_ids):
+    # Same graph, same starting positions, same layout
+    digest = hashlib.sha1("\x1f".join(node_ids).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big")
+
+
+def force_directed_positions(node_ids, edges, iterations=LAYOUT_ITERATIONS):
+    """
+    Computes a Fruchterman-Reingold force-directed layout with NumPy.
+
+    Repulsion between all node pairs is evaluated in blocks of rows so memory stays linear
+    in the number of nodes; attraction is evaluated per edge. The starting positions are
+    seeded from the node ids, so a graph always gets the same layout.
+
+    Parameters:
+    node_ids (list): The node ids.
+    edges (list): (source_id, target_id) pairs, edges to unknown ids are ignored.
+    iterations (int): Number of simulation steps.
+
+    Returns:
+    numpy.ndarray: An (n, 2) array of positions in [-1, 1], in node_ids order.
+    """
+    n = len(node_ids)
+    if n == 0:
+        return np.zeros((0, 2))
+    if n == 1:
+        return np.zeros((1, 2))
+
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    pairs = np.array(
+        [(index[s], index[t]) for s, t in edges if s in index and t in index and s != t],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    rng = np.random.default_rng(_seed(node_ids))
+    # float32 halves the memory traffic of the dense repulsion step
+    pos = rng.uniform(-1.0, 1.0, size=(n, 2)).astype(np.float32)
+    k = math.sqrt(4.0 / n)  # ideal distance for a [-1, 1] square
+    temperature = 0.2
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        displacement = np.empty((n, 2), dtype=np.float32)
+        squared_norms = (pos ** 2).sum(axis=1)
+        for start in range(0, n, REPULSION_BLOCK):
+            block = pos[start:start + REPULSION_BLOCK]
+            # |a - b|^2 and sum_j w_ij (a_i - b_j) expressed as matrix products
+            distance2 = squared_norms[start:start + REPULSION_BLOCK, None] + squared_norms[None, :] - 2.0 * block @ pos.T
+            weight = (k * k) / np.maximum(distance2, 1e-6)
+            weight[np.arange(len(block)), np.arange(start, start + len(block))] = 0.0
+            displacement[start:start + REPULSION_BLOCK] = block * weight.sum(axis=1)[:, None] - weight @ pos
+
+        if len(pairs):
+            delta = pos[pairs[:, 0]] - pos[pairs[:, 1]]
+            distance = np.maximum(np.sqrt((delta ** 2).sum(axis=1)), 1e-3)
+            force = delta * (distance / k)[:, None]
+            np.add.at(displacement, pairs[:, 0], -force)
+            np.add.at(displacement, pairs[:, 1], force)
+
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+        pos += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    pos -= pos.mean(axis=0)
+    extent = np.abs(pos).max()
+    if extent > 0:
+        pos /= extent
+    return pos
+
+
+@timed("layout")
+def compute_layout(graph, iterations=LAYOUT_ITERATIONS):
+    """
+    Computes pixel positions for the nodes of a knowledge graph dict, scaled so the drawing
+    grows with the number of nodes and the 50px high Cytoscape nodes do not overlap.
+
+    Returns:
+    dict: {node_id: {"x": float, "y": float}}
+    """
+    node_ids = [node["id"] for node in graph["nodes"]]
+    positions = force_directed_positions(
+        node_ids, [(edge["from"], edge["to"]) for edge in graph["edges"]], iterations)
+    scale = 120.0 * math.sqrt(max(len(node_ids), 1))
+    return {
+        node_id: {"x": round(float(x) * scale, 1), "y": round(float(y) * scale, 1)}
+        for node_id, (x, y) in zip(node_ids, positions)
+    }
+
+
+def apply_layout(graph):
+    """
+    Stores a "position" on every node of the graph dict, computing the layout only when
+    some node has none yet.
+
+    Returns:
+    bool: True if the layout was computed.
+    """
+    if all("position" in node for node in graph["nodes"]):
+        return False
+    layout = compute_layout(graph)
+    for node in graph["nodes"]:
+        node["position"] = layout[node["id"]]
+    return True
+
+
+def place_new_nodes(graph, nodes, edges):
+    """
+    Gives positions to nodes added to an already laid out graph without moving the
+    existing ones. A new node is put on a small circle around its positioned neighbors;
+    nodes without any are put on a ring outside the current drawing.
+
+    Parameters:
+    graph (dict): The laid out knowledge graph dict.
+    nodes (list): The new node dicts, updated in place with a "position".
+    edges (list): The new edge dicts ("from"/"to" keys).
+    """
+    positions = {node["id"]: node["position"] for node in graph["nodes"] if "position" in node}
+    neighbors = {}
+    for edge in list(graph["edges"]) + list(edges):
+        neighbors.setdefault(edge["from"], []).append(edge["to"])
+        neighbors.setdefault(edge["to"], []).append(edge["from"])
+
+    extent = max((max(abs(p["x"]), abs(p["y"])) for p in positions.values()), default=0.0)
+    golden_angle = math.pi * (3.0 - math.sqrt(5.0))
+    for i, node in enumerate(nodes):
+        placed = [positions[n] for n in neighbors.get(node["id"], []) if n in positions]
+        angle = i * golden_angle
+        if placed:
+            cx = sum(p["x"] for p in placed) / len(placed)
+            cy = sum(p["y"] for p in placed) / len(placed)
+            radius = 150.0
+        else:
+            cx = cy = 0.0
+            radius = extent + 150.0
+        position = {"x": round(cx + radius * math.cos(angle), 1), "y": round(cy + radius * math.sin(angle), 1)}
+        node["position"] = positions[node["id"]] = position
@@ -0,0 +1,45 @@
+import threading
+
+
+class UpstreamBusyError(Exception):
+    """
+    Raised when an upstream's concurrency limit stays exhausted for longer than the
+    allowed wait.
+    """
+
+
+class UpstreamLimiter:
+    """
+    Bounds the number of in-flight calls to one upstream service (OpenAI, Neo4j).
+
+    Each gunicorn thread blocks only on its own upstream call, so a single process can
+    keep many generations in flight; the limiter keeps that number below what the
+    upstream (or its connection pool) accepts and sheds load instead of queueing forever.
+
+    Parameters:
+    name (str): Name of the upstream, used in error messages.
+    max_concurrency (int): Maximum number of simultaneous calls.
+    max_wait (float): Seconds to wait for a free slot before raising UpstreamBusyError.
+    """
+
+    def __init__(self, name, max_concurrency, max_wait=30.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def __enter__(self):
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            raise UpstreamBusyError(
+                "{} is at its concurrency limit of {}".format(self.name, self.max_concurrency))
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+        return False
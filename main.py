@@ -1,79 +1,239 @@
 import os
 import json
 import re
-import openai
-import requests
-from bs4 import BeautifulSoup
-from graphviz import Digraph
-from neo4j import GraphDatabase
-from flask import Flask, jsonify, render_template, request
+from flask import Blueprint, Flask, Response, g, jsonify, redirect, render_template, request, stream_with_context, url_for
 from dotenv import load_dotenv
-import instructor
-from models import KnowledgeGraph
-import time
-from uuid import uuid4
-import traceback
-from datetime import datetime
-
-instructor.patch()
 
+# Before the local modules below, they read their settings from the environment on import
 load_dotenv()
 
-app = Flask(__name__)
-
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-response_data = ""
-
-# If Neo4j credentials are set, then Neo4j is used to store information
-neo4j_username = os.environ.get("NEO4J_USERNAME")
-neo4j_password = os.environ.get("NEO4J_PASSWORD")
-neo4j_url = os.environ.get("NEO4J_URL")
-neo4j_driver = None
-
-if neo4j_username and neo4j_password and neo4j_url:
-    neo4j_driver = GraphDatabase.driver(
-        neo4j_url, auth=(neo4j_username, neo4j_password))
-    with neo4j_driver.session() as session:
+from limits import UpstreamBusyError, UpstreamLimiter
+from clients import LazyClient, neo4j_driver_from_env
+from generation import (OPENAI_MAX_RETRIES, coalescer, create_completion, generate_knowledge_graph, graph_to_dict,
+                        is_rate_limited, kg_cache, new_graph_meta, openai_client, openai_limiter, retry_after,
+                        stream_knowledge_graph, token_usage, with_backoff)
+from health import readiness_from_env
+from graph_store import graph_store_from_env
+from metrics import (REGISTRY, Observed, RequestProfiler, expansion_elements, graph_edges, graph_nodes,
+                     http_request_seconds, request_spans, server_timing, span, start_request)
+from scraper import ScrapeError, resolve_input
+from chunking import merge_delta, normalize_label
+from layout import apply_layout, place_new_nodes
+from analytics import AnalyticsCache, CSRGraph, graph_to_csr
+from render import RENDER_FORMATS, RENDER_ID_PATTERN, RenderError, graph_to_dot, renderer_from_env
+from persistence import decode_cursor, encode_cursor, migrate_node_identity
+from search import matching_nodes, search_index_from_env
+from storage import storage_class_from_env, storage_from_env
+from wire import compact_elements, compact_history, compact_response, compress_response, wants_compact
+import time
+import threading
+import hashlib
+import traceback
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+
+# The routes, registered on the app by create_app(); cli_group=None keeps the CLI commands
+# at the top level ("flask migrate-node-identity")
+bp = Blueprint("instagraph", __name__, cli_group=None)
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Generated graphs are kept per unique_id, bounded by their total node and edge count
+graph_store = graph_store_from_env()
+
+# Adjacency indexes and analytics results, reused until a graph's lastUpdatedOn changes
+analytics_cache = AnalyticsCache(int(os.getenv("ANALYTICS_CACHE_GRAPHS", "64")))
+NEIGHBORHOOD_MAX_HOPS = int(os.getenv("NEIGHBORHOOD_MAX_HOPS", "5"))
+
+# Most existing nodes sent to the model as context when expanding a graph
+EXPAND_CONTEXT_MAX_NODES = int(os.getenv("EXPAND_CONTEXT_MAX_NODES", "40"))
+# Serializes the merge step of expansions in this worker so concurrent ones cannot drop each
+# other's nodes; with storage, its transaction serializes them across workers too
+expand_lock = threading.Lock()
+
+# Graphviz renders, stored under static/renders by content hash
+renderer = renderer_from_env(STATIC_FOLDER)
+RENDER_SYNC_WAIT_SECONDS = float(os.getenv("RENDER_SYNC_WAIT_SECONDS", "5"))
+
+# Bound the number of in-flight storage calls (OpenAI's limiter lives in generation.py)
+STORAGE_MAX_CONCURRENCY = int(os.getenv("STORAGE_MAX_CONCURRENCY") or os.getenv("NEO4J_MAX_CONCURRENCY", "50"))
+
+# Requests sent with an "X-Profile: 1" header get a cProfile summary when this is on
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+# Seconds browsers and CDNs may reuse /graphs/<unique_id> before revalidating
+GRAPH_CACHE_MAX_AGE = int(os.getenv("GRAPH_CACHE_MAX_AGE", "60"))
+
+# If Neo4j credentials are set, then Neo4j is used to store information. The driver is
+# created on first use, so an unreachable database cannot block startup; the readiness
+# check below connects to it in the background.
+neo4j_driver = neo4j_driver_from_env(STORAGE_MAX_CONCURRENCY)
+
+# Graphs are persisted in Neo4j when it is configured and in a local SQLite file otherwise
+# (STORAGE_BACKEND, see storage.py); None keeps them in the graph store only. Like the
+# Neo4j driver, the storage is created on first use (by the readiness check, usually), so
+# importing the app neither creates nor migrates a SQLite file.
+storage_class = storage_class_from_env(neo4j_driver)
+storage = LazyClient(storage_class.name, lambda: storage_from_env(neo4j_driver)) if storage_class else None
+storage_limiter = UpstreamLimiter(
+    storage_class.name if storage_class else "Storage", STORAGE_MAX_CONCURRENCY,
+    float(os.getenv("UPSTREAM_MAX_WAIT_SECONDS", "30")))
+
+# BM25 index over graph descriptions and node labels/types, filled from storage in the
+# background at startup and updated as graphs are stored or expanded. Every worker has
+# its own index; graphs stored or expanded by other workers are picked up from storage
+# before searching, at most every SEARCH_REFRESH_SECONDS (0 refreshes before every search).
+search_index = search_index_from_env()
+search_index_ready = threading.Event()
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", "5"))
+# Refreshes read back this far before the newest lastUpdatedOn indexed: a graph stamped
+# earlier may be committed later by another worker. Graphs already indexed are skipped.
+SEARCH_REFRESH_OVERLAP_SECONDS = 60
+search_refresh_lock = threading.Lock()
+search_refresh_state = {"last_updated_on": None, "refreshed": 0.0}
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+# Share of an input's terms (by idf) a stored graph must contain to be returned instead
+# of generating a new one; 0 turns the near-duplicate check off
+SEARCH_DUPLICATE_COVERAGE = float(os.getenv("SEARCH_DUPLICATE_COVERAGE", "0"))
+SEARCH_DUPLICATE_MIN_SCORE = float(os.getenv("SEARCH_DUPLICATE_MIN_SCORE", "2"))
+
+
+def check_openai():
+    # imports and configures the openai client before the first request needs it
+    openai_client.get()
+
+
+def check_storage():
+    # Creating the storage on first use sets up its schema (see storage_from_env); after
+    # that one cheap lookup shows the database answers
+    storage.graph_version("")
+    print("Graph storage: {}".format(storage.name))
+
+
+def index_search_documents(since=None):
+    """
+    Adds the stored graphs updated at or after since (all of them when None) to the search
+    index and records the newest lastUpdatedOn seen. Returns the number of graphs indexed.
+    """
+    added = 0
+    newest = search_refresh_state["last_updated_on"]
+    for meta, nodes in storage.iter_search_documents(since):
+        added += search_index.add(meta, nodes)
+        if meta["lastUpdatedOn"] and (newest is None or meta["lastUpdatedOn"] > newest):
+            newest = meta["lastUpdatedOn"]
+    search_refresh_state["last_updated_on"] = newest
+    return added
+
+
+def build_search_index():
+    if storage is not None:
+        started = time.perf_counter()
+        with search_refresh_lock:
+            index_search_documents()
+            search_refresh_state["refreshed"] = time.monotonic()
+        print("Search index built: {} graphs in {:.1f}s".format(
+            len(search_index), time.perf_counter() - started))
+    search_index_ready.set()
+
+
+def refresh_search_index():
+    """
+    Adds graphs that other workers stored or expanded since the last refresh to this
+    worker's search index, at most every SEARCH_REFRESH_SECONDS. A refresh already running
+    in another thread is not waited for, and errors only leave the index as it is.
+    """
+    if storage is None or not search_index_ready.is_set():
+        return
+    if time.monotonic() - search_refresh_state["refreshed"] < SEARCH_REFRESH_SECONDS:
+        return
+    if not search_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        since = search_refresh_state["last_updated_on"]
         try:
-            session.run("RETURN 1")
-            print("Neo4j database connected successfully!")
-        except ValueError as ve:
-            print(
-                "Neo4j database [value error] connection error: {}".format(ve))
-        except Exception as e:
-            print("Neo4j database connection error: {}".format(e))
-
-# Function to scrape text from a website
-
-
-def scrape_text_from_url(url):
+            since = (datetime.strptime(since, "%Y-%m-%dT%H:%M:%S")
+                     - timedelta(seconds=SEARCH_REFRESH_OVERLAP_SECONDS)).strftime("%Y-%m-%dT%H:%M:%S")
+        except (TypeError, ValueError):
+            # nothing indexed yet, or a timestamp in another format: compared as stored
+            pass
+        with span("search_refresh"), storage_limiter:
+            index_search_documents(since)
+    except Exception as e:
+        print("Search index refresh error:", e)
+    finally:
+        search_refresh_state["refreshed"] = time.monotonic()
+        search_refresh_lock.release()
+
+
+# Startup work, run in the background by create_app() and reported by /readyz. The
+# search index fills while the app already serves requests, so it does not hold
+# readiness back.
+readiness = readiness_from_env()
+readiness.add("openai", check_openai)
+if storage is not None:
+    readiness.add("storage", check_storage)
+readiness.add("search_index", build_search_index, required=False)
+
+for name, help_text, read, kind in [
+    ("instagraph_cache_hits_total", "Knowledge graph cache hits.", lambda: kg_cache.hits, "counter"),
+    ("instagraph_cache_disk_hits_total", "Knowledge graph cache hits served by the SQLite tier.",
+     lambda: kg_cache.disk_hits, "counter"),
+    ("instagraph_cache_misses_total", "Knowledge graph cache misses.", lambda: kg_cache.misses, "counter"),
+    ("instagraph_openai_requests_total", "OpenAI completions.", lambda: token_usage.snapshot()["requests"], "counter"),
+    ("instagraph_openai_prompt_tokens_total", "Prompt tokens used.",
+     lambda: token_usage.snapshot()["prompt_tokens"], "counter"),
+    ("instagraph_openai_completion_tokens_total", "Completion tokens used.",
+     lambda: token_usage.snapshot()["completion_tokens"], "counter"),
+    ("instagraph_openai_in_flight", "OpenAI calls in flight.", lambda: openai_limiter.in_flight, "gauge"),
+    ("instagraph_storage_in_flight", "Graph storage calls in flight.", lambda: storage_limiter.in_flight, "gauge"),
+    ("instagraph_coalesced_generations", "Generations other requests are waiting on.", lambda: len(coalescer), "gauge"),
+    ("instagraph_graph_store_elements", "Nodes and edges held by the graph store.", lambda: graph_store.size, "gauge"),
+    ("instagraph_search_indexed_graphs", "Graphs in the search index.", lambda: len(search_index), "gauge"),
+]:
+    REGISTRY.register(Observed(name, help_text, read, kind))
+
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    start_request()
+    if PROFILING_ENABLED and request.headers.get("X-Profile") == "1":
+        g.profiler = RequestProfiler()
+
+
+@bp.after_app_request
+def compress(response):
     """
-    Scrapes and returns the text content from the paragraphs of the given URL using the BeautifulSoup library.
-
-    Parameters:
-    url (str): The URL of the webpage to scrape content from.
-
-    Returns:
-    str: Returns the text content of all paragraphs in the webpage concatenated as a single string.
-         Returns "Error: Could not retrieve content from URL." if the request status code is not 200.
+    Compresses large JSON, text and SVG responses with brotli or gzip. Registered before
+    record_request_metrics so it runs after it, on the final body.
+    """
+    return compress_response(response, request.accept_encodings)
 
-    Example:
-    >>> scrape_text_from_url("https://example.com")
-    'This is paragraph 1. This is paragraph 2.'
 
-    Notes:
-    - Utilizes the 'requests' library to fetch the webpage.
-    - Uses the 'html.parser' from the BeautifulSoup library to parse the HTML content.
+@bp.after_app_request
+def record_request_metrics(response):
     """
-    response = requests.get(url)
-    if response.status_code != 200:
-        return "Error: Could not retrieve content from URL."
-    soup = BeautifulSoup(response.text, "html.parser")
-    paragraphs = soup.find_all("p")
-    text = " ".join([p.get_text() for p in paragraphs])
-    print("web scrape done")
-    return text
+    Records the request duration, adds the per-stage timings as a Server-Timing header
+    and, for profiled requests, adds the cProfile summary to JSON responses as "profile".
+    Streamed responses are measured up to their first byte only.
+    """
+    # labelled without the blueprint prefix ("get_response_data", not "instagraph.get_response_data")
+    http_request_seconds.observe(
+        time.perf_counter() - g.request_started,
+        endpoint=(request.endpoint or "unknown").rpartition(".")[2], method=request.method,
+        status=response.status_code)
+    spans = request_spans()
+    if spans:
+        response.headers["Server-Timing"] = server_timing(spans)
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        summary = profiler.summary()
+        data = response.get_json(silent=True) if response.is_json and not response.is_streamed else None
+        if isinstance(data, dict):
+            data["profile"] = summary
+            response.set_data(json.dumps(data))
+    return response
 
 
 def correct_json(json_str):
@@ -91,12 +251,135 @@ def correct_json(json_str):
         return None
 
 
-@app.route("/get_response_data", methods=["POST"])
+def node_element(node):
+    """
+    Converts a knowledge graph node dict into a Cytoscape node element, including its
+    precomputed position when it has one.
+    """
+    element = {
+        "data": {
+            "id": node["id"],
+            "label": node["label"],
+            "color": node.get("color", "defaultColor"),
+        }
+    }
+    if "position" in node:
+        element["position"] = node["position"]
+    return element
+
+
+def edge_element(edge):
+    """
+    Converts a knowledge graph edge dict ("from"/"to" keys) into a Cytoscape edge element.
+    """
+    return {
+        "data": {
+            "source": edge["from"],
+            "target": edge["to"],
+            "label": edge["relationship"],
+            "color": edge.get("color", "defaultColor"),
+            "direction": edge["direction"],
+        }
+    }
+
+
+def build_elements(graph):
+    """
+    Converts a knowledge graph dict into Cytoscape "elements" (nodes and edges).
+    """
+    return {
+        "nodes": [node_element(node) for node in graph["nodes"]],
+        "edges": [edge_element(edge) for edge in graph["edges"]],
+    }
+
+
+def graph_response(graph, meta, **extra):
+    """
+    Returns the JSON response with a graph's Cytoscape elements, its metadata and any extra
+    fields, in the compact wire format (see wire.py) when the request asks for it.
+    """
+    if wants_compact(request):
+        with span("build_elements"):
+            payload = compact_elements(graph, meta, **extra)
+        with span("jsonify"):
+            response = compact_response(payload)
+    else:
+        with span("build_elements"):
+            payload = {"elements": build_elements(graph), "meta": meta, **extra}
+        with span("jsonify"):
+            response = jsonify(payload)
+    response.vary.add("Accept")
+    return response
+
+
+def store_graph(response_data):
+    """
+    Assigns a unique_id to a generated graph, keeps it in the graph store and, when a
+    storage backend is configured, writes it there.
+
+    Parameters:
+    response_data (dict): The knowledge graph dict as returned by graph_to_dict.
+
+    Returns:
+    tuple: (meta, storage_error). meta is the graph's metadata (unique_id, description,
+    createdOn, lastUpdatedOn); storage_error is None, or the reason the graph could not be
+    written to storage, in which case it is only kept in the graph store.
+    """
+    meta = new_graph_meta(response_data)
+    unique_id = meta["unique_id"]
+    graph_nodes.observe(len(response_data["nodes"]))
+    graph_edges.observe(len(response_data["edges"]))
+    # Lay the graph out once here so browsers can draw it with a preset layout
+    apply_layout(response_data)
+    # Keep the graph addressable by its unique_id for /graphviz and the other read endpoints
+    graph_store.put(unique_id, response_data, meta)
+    search_index.add(meta, response_data["nodes"])
+
+    storage_error = None
+    if storage:
+        try:
+            with storage_limiter:
+                storage.save_graph(meta, response_data)
+        except Exception as e:
+            # the graph is still served from the graph store, the completion is not wasted
+            print("An error occurred during the storage operation:", e)
+            traceback.print_exc()
+            storage_error = str(e)
+    return meta, storage_error
+
+
+def load_graph(unique_id):
+    """
+    Returns (graph, meta) for a unique_id from the graph store, falling back to the storage
+    backend and keeping the result in the store. Returns None if the graph does not exist.
+    A stored graph with a newer lastUpdatedOn than the graph store's copy (expanded through
+    another worker) replaces the copy.
+    """
+    stored = graph_store.get(unique_id)
+    if stored is not None and storage:
+        with storage_limiter:
+            version = storage.graph_version(unique_id)
+        if version is not None and version > stored[1]["lastUpdatedOn"]:
+            stored = None
+    if stored is None and storage:
+        with storage_limiter:
+            stored = storage.fetch_graph(unique_id)
+        if stored is not None:
+            graph, meta = stored
+            # graphs stored before layouts were precomputed get theirs on first read
+            if apply_layout(graph):
+                with storage_limiter:
+                    storage.save_layout(unique_id, graph)
+            graph_store.put(unique_id, graph, meta)
+    return stored
+
+
+@bp.route("/get_response_data", methods=["POST"])
 def get_response_data():
     """
     Processes user input to create a knowledge graph using OpenAI's GPT-3.5 Turbo model 
-    and stores the result in a Neo4j database. Returns a JSON object containing the graph 
-    data and metadata.
+    and stores the result in the configured storage backend (Neo4j or SQLite). Returns a
+    JSON object containing the graph data and metadata.
 
     Parameters:
     None. The function takes a POST request with 'user_input' in the request JSON body.
@@ -118,208 +401,264 @@ def get_response_data():
         }
 
     Errors:
-    - Returns 400 Bad Request if 'user_input' is not provided in the request body.
+    - Returns 400 Bad Request if 'user_input' is not provided in the request body,
+      or if it is a URL that could not be scraped.
     - Returns 429 Too Many Requests if OpenAI rate limit is exceeded.
     - Returns 400 Bad Request for general exceptions while calling OpenAI API.
-    - Returns 500 Internal Server Error for exceptions during Neo4j operations.
+    - Returns 503 Service Unavailable if OpenAI stays at its concurrency limit.
+    - If the graph cannot be written to storage it is still returned, with the reason in
+      "storage_error"; it then lives only in the in-process graph store.
 
     Note:
-    - This function utilizes the 'requests' library for API calls and BeautifulSoup for HTML parsing.
-    - It also uses a global variable 'response_data' to store the OpenAI model output.
+    - Repeated inputs are answered from the knowledge graph cache without calling OpenAI.
+    - Inputs made only of URLs are scraped (see scraper.py) and the page text is used instead.
+    - The graph is kept in the in-process graph store under "meta.unique_id".
+    - ?format=compact or an Accept header of application/vnd.instagraph.compact+json
+      selects the compact wire format (see wire.py), here and on every endpoint
+      returning graph elements.
+    - With SEARCH_DUPLICATE_COVERAGE set, a stored graph matching the input closely enough
+      is returned instead of generating a new one, with "similar_match" describing the
+      match. Send "force": true in the body to always generate.
     """
 
-    global response_data
     user_input = request.json.get("user_input", "")
     if not user_input:
         return jsonify({"error": "No input provided"}), 400
-    print("starting openai call")
     try:
-        completion: KnowledgeGraph = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo-16k",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Help me understand following by describing as a detailed knowledge graph: {user_input}",
-                }
-            ],
-            response_model=KnowledgeGraph,
-        )
-
-        # Its now a dict, no need to worry about json loading so many times
-        response_data = completion.model_dump()
-        # response_data = correct_json(response_data)
-        # Fixing 'from_' to 'from' in the edges
-        for edge in response_data['edges']:
-            edge['from'] = edge.pop('from_')
-        # print(response_data)
-
-    except openai.error.RateLimitError as e:
-        # request limit exceeded or something.
+        # URL inputs are replaced by the text of the pages
+        with span("resolve_input"):
+            user_input = resolve_input(user_input)
+    except ScrapeError as e:
+        return jsonify({"error": str(e)}), 400
+    if SEARCH_DUPLICATE_COVERAGE and not request.json.get("force"):
+        try:
+            similar = find_similar_graph(user_input)
+        except Exception as e:
+            # the check is an optimization, generate as usual
+            print("Near-duplicate check error:", e)
+            similar = None
+        if similar is not None:
+            graph, meta, match = similar
+            return graph_response(graph, meta, similar_match=match)
+    try:
+        completion = generate_knowledge_graph(user_input)
+        response_data = graph_to_dict(completion)
+
+    except UpstreamBusyError as e:
         print(e)
-        return jsonify({"error": "".format(e)}), 429
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        # general exception handling
         print(e)
-        return jsonify({"error": "".format(e)}), 400
+        if is_rate_limited(e):
+            # still rate limited after OPENAI_MAX_RETRIES retries
+            response = jsonify({"error": str(e)})
+            delay = retry_after(e)
+            if delay is not None:
+                response.headers["Retry-After"] = str(int(delay + 0.999))
+            return response, 429
+        # general exception handling
+        return jsonify({"error": str(e)}), 400
+
+    meta, storage_error = store_graph(response_data)
+    if storage_error:
+        return graph_response(response_data, meta, storage_error=storage_error)
+    return graph_response(response_data, meta)
+
+
+@bp.route("/get_response_data/stream", methods=["POST"])
+def stream_response_data():
+    """
+    Streaming variant of /get_response_data. Nodes and edges are sent to the client as
+    newline-delimited JSON as soon as the model has produced them, so the front-end can
+    draw the graph while it is still being generated.
 
-    # Assuming you have the correct neo4j_driver instance.
+    Parameters:
+    None. The function takes a POST request with 'user_input' in the request JSON body.
 
+    Returns:
+    application/x-ndjson: One JSON event per line.
+        Example:
+        {"type": "node", "data": {"id": "1", "label": "...", "color": "..."}}
+        {"type": "edge", "data": {"source": "1", "target": "2", "label": "...", ...}}
+        {"type": "layout", "data": {"1": {"x": 10.0, "y": -42.5}, ...}}
+        {"type": "meta", "data": {"unique_id": <UUID>, "description": <str>, ...}}
+        {"type": "storage_error", "data": <str>}  (only if the graph could not be stored)
+
+    Errors:
+    - Returns 400 Bad Request if 'user_input' is not provided in the request body,
+      or if it is a URL that could not be scraped.
+    - Failures after the stream has started are sent as a final {"type": "error", "error": <str>} event.
+
+    Note:
+    - With SEARCH_DUPLICATE_COVERAGE set, a stored graph matching the input closely enough
+      is streamed instead of generating a new one, followed by a
+      {"type": "similar_match", "data": {"unique_id": ..., "score": ..., "coverage": ...}}
+      event. Send "force": true in the body to always generate.
+    """
+    body = request.get_json(silent=True) or {}
+    user_input = body.get("user_input", "")
+    if not user_input:
+        return jsonify({"error": "No input provided"}), 400
     try:
-        if neo4j_driver:
-            # Import nodes
-            unique_id = str(uuid4())
-            description = response_data["metadata"]["description"]
-            created_on = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-            updated_on = created_on
-
-            # Create MetaData node
-            neo4j_driver.execute_query(
-                """
-                CREATE (m:MetaData {uuid: $uuid, description: $description, createdOn: $createdOn, lastUpdatedOn: $lastUpdatedOn})
-                RETURN m
-                """,
-                {
-                    "uuid": unique_id, "description": description,
-                    "createdOn": created_on,
-                    "lastUpdatedOn": updated_on
-                }
-            )
-
-            # Import nodes and link to MetaData
-            neo4j_driver.execute_query(
-                """
-                UNWIND $nodes AS node
-                MERGE (n:Node {id: node.id})
-                ON CREATE SET n.type = node.type, 
-                            n.label = node.label, 
-                            n.color = node.color
-                WITH n
-                MATCH (m:MetaData {uuid: $uuid})
-                MERGE (m)-[:CONTAINS]->(n)
-                """,
-                {"nodes": response_data['nodes'], "uuid": unique_id}
-            )
-
-            # Import relationships and link to MetaData
-            neo4j_driver.execute_query(
-                """
-                UNWIND $rels AS rel
-                MATCH (s:Node {id: rel.from})
-                MATCH (t:Node {id: rel.to})
-                MERGE (s)-[r:RELATIONSHIP {type: rel.relationship}]->(t)
-                ON CREATE SET r.direction = rel.direction,
-                            r.color = rel.color,
-                            r.timestamp = timestamp();
-                """,
-                {"rels": response_data['edges']}
-            )
-
-            # create a payload to return.
-            nodes = [
-                {
-                    "data": {
-                        "id": node["id"],
-                        "label": node["label"],
-                        "color": node.get("color", "defaultColor"),
-                    }
-                }
-                for node in response_data["nodes"]
-            ]
+        user_input = resolve_input(user_input)
+    except ScrapeError as e:
+        return jsonify({"error": str(e)}), 400
+    similar = None
+    if SEARCH_DUPLICATE_COVERAGE and not body.get("force"):
+        try:
+            similar = find_similar_graph(user_input)
+        except Exception as e:
+            # the check is an optimization, generate as usual
+            print("Near-duplicate check error:", e)
+
+    def event(kind, data):
+        return json.dumps({"type": kind, "data": data}) + "\n"
+
+    def replay(graph, meta, match):
+        # the stored graph, in the same events a generation would send
+        yield event("description", meta["description"])
+        for node in graph["nodes"]:
+            yield event("node", node_element(node)["data"])
+        for edge in graph["edges"]:
+            yield event("edge", edge_element(edge)["data"])
+        yield event("layout", {node["id"]: node["position"] for node in graph["nodes"] if "position" in node})
+        yield event("meta", meta)
+        yield event("similar_match", match)
+
+    def generate():
+        try:
+            completion = None
+            for kind, item in stream_knowledge_graph(user_input):
+                if kind == "node":
+                    yield event("node", node_element(item.model_dump())["data"])
+                elif kind == "edge":
+                    yield event("edge", edge_element(item.model_dump(by_alias=True))["data"])
+                elif kind == "metadata":
+                    yield event("description", item.description)
+                else:
+                    completion = item
+            response_data = graph_to_dict(completion)
+            meta, storage_error = store_graph(response_data)
+            yield event("layout", {node["id"]: node["position"] for node in response_data["nodes"]})
+            yield event("meta", meta)
+            if storage_error:
+                yield event("storage_error", storage_error)
+        except Exception as e:
+            print("An error occurred while streaming the knowledge graph:", e)
+            traceback.print_exc()
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
 
-            edges = [
-                {
-                    "data": {
-                        "source": edge["from"],
-                        "target": edge["to"],
-                        "label": edge["relationship"],
-                        "color": edge.get("color", "defaultColor"),
-                        "direction": edge["direction"],
-                    }
-                }
-                for edge in response_data["edges"]
-            ]
-
-            return jsonify({
-                "elements": {
-                    "nodes": nodes,
-                    "edges": edges
-                },
-                "meta": {
-                    "unique_id": unique_id,
-                    "description": description,
-                    "createdOn": created_on,
-                    "lastUpdatedOn": updated_on,
-                }})
-        else:
-            return jsonify(
-                {
-                    "error": "An error occurred during the Neo4j operation",
-                    "elements": {"nodes": [], "edges": []},
-                    "meta": {
-                        "unique_id": "",
-                        "description": "",
-                        "createdOn": "",
-                        "lastUpdatedOn": "",
-                    }
-                }), 500
+    events = replay(*similar) if similar is not None else generate()
+    response = Response(stream_with_context(events), mimetype="application/x-ndjson")
+    # keep reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def graph_version(graph, meta):
+    """
+    Returns a version string that changes whenever a graph changes. Expansions only add
+    nodes and edges, so the sizes tell apart changes made within the same second.
+    """
+    return "{}:{}:{}".format(meta["lastUpdatedOn"], len(graph["nodes"]), len(graph["edges"]))
 
-    except Exception as e:
-        print("An error occurred during the Neo4j operation:", e)
-        traceback.print_exc()
-        return jsonify({"error": "An error occurred during the Neo4j operation: {}".format(e)}), 500
+
+def render_url(render_id):
+    return url_for("static", filename="renders/" + render_id, _external=True)
 
 
 # Function to visualize the knowledge graph using Graphviz
-@app.route("/graphviz", methods=["POST"])
+@bp.route("/graphviz", methods=["POST"])
 def visualize_knowledge_graph_with_graphviz():
     """
     Generates a visual representation of a knowledge graph using Graphviz and returns the URL 
-    of the generated PNG file.
+    of the generated file.
 
-    This function expects 'response_data' to be populated with the knowledge graph details. 
-    It utilizes Graphviz to create a directed graph ('Digraph') and populates it with nodes 
-    and edges based on the data found in 'response_data'.
+    Renders are keyed by a hash of the graph's DOT source, so an unchanged graph is rendered
+    only once and every later request reuses the file. Graphviz runs in the background; if
+    the render does not finish within RENDER_SYNC_WAIT_SECONDS the request returns 202 and
+    the client polls the "status_url" until it redirects to the file.
 
     Parameters:
-    None. The function uses the global variable 'response_data' which should be populated prior to calling this function.
+    None. The function takes a POST request with 'unique_id' in the request JSON body,
+    as returned in "meta" by /get_response_data, and an optional 'format' ("png", "svg"
+    or "pdf", default "png").
 
     Returns:
-    json: A JSON object containing the URL of the generated PNG.
+    json: A JSON object containing the URL of the generated file.
         Example:
         {
-            "png_url": "http://server_address/static/knowledge_graph.png"
+            "url": "http://server_address/static/renders/<hash>.png",
+            "png_url": "http://server_address/static/renders/<hash>.png",
+            "format": "png",
+            "render_id": "<hash>.png"
         }
 
     Status Codes:
-    - Returns 200 OK if the PNG file is successfully generated and saved.
+    - Returns 200 OK if the file is available.
+    - Returns 202 Accepted with "status_url" while the render is in progress.
+    - Returns 400 Bad Request if 'unique_id' is not provided or 'format' is unsupported.
+    - Returns 404 Not Found if no graph is stored under 'unique_id'.
+    - Returns 500 Internal Server Error if Graphviz fails or times out.
 
     Side Effects:
-    - Generates and saves a PNG file on the server.
+    - Generates and saves the rendered file under static/renders.
     """
-    global response_data
-    dot = Digraph(comment="Knowledge Graph")
-    response_dict = response_data
-    # Add nodes to the graph
-    for node in response_dict.get("nodes", []):
-        dot.node(node["id"], f"{node['label']} ({node['type']})")
-
-    # Add edges to the graph
-    for edge in response_dict.get("edges", []):
-        dot.edge(edge["from"], edge["to"], label=edge["relationship"])
-
-    # Render and visualize
-    dot.render("knowledge_graph.gv", view=False)
-    # Render to PNG format and save it
-    dot.format = "png"
-    dot.render("static/knowledge_graph", view=False)
-
-    # Construct the URL pointing to the generated PNG
-    png_url = f"{request.url_root}static/knowledge_graph.png"
-
-    return jsonify({"png_url": png_url}), 200
-
+    body = request.get_json(silent=True) or {}
+    unique_id = body.get("unique_id", "")
+    fmt = body.get("format", "png")
+    if not unique_id:
+        return jsonify({"error": "No unique_id provided"}), 400
+    if fmt not in RENDER_FORMATS:
+        return jsonify({"error": "Unsupported format {}, use one of {}".format(fmt, ", ".join(RENDER_FORMATS))}), 400
+    stored = load_graph(unique_id)
+    if stored is None:
+        return jsonify({"error": "Graph {} not found".format(unique_id)}), 404
+    response_dict, _ = stored
+
+    render_id, future = renderer.submit(graph_to_dot(response_dict), fmt)
+    if future is not None:
+        try:
+            future.result(timeout=RENDER_SYNC_WAIT_SECONDS)
+        except FutureTimeoutError:
+            status_url = url_for(".get_render_status", render_id=render_id, _external=True)
+            response = jsonify({"status": "pending", "render_id": render_id, "status_url": status_url})
+            response.headers["Location"] = status_url
+            return response, 202
+        except RenderError as e:
+            return jsonify({"error": str(e)}), 500
+
+    url = render_url(render_id)
+    payload = {"url": url, "format": fmt, "render_id": render_id}
+    if fmt == "png":
+        payload["png_url"] = url
+    return jsonify(payload), 200
+
+
+@bp.route("/graphviz/jobs/<render_id>", methods=["GET"])
+def get_render_status(render_id):
+    """
+    Reports the state of a Graphviz render started by /graphviz.
 
-@app.route("/get_graph_data", methods=["GET"])
+    Status Codes:
+    - Returns 303 See Other to the rendered file once it is available.
+    - Returns 202 Accepted while the render is in progress.
+    - Returns 404 Not Found for unknown render ids.
+    - Returns 500 Internal Server Error if the render failed.
+    """
+    if not RENDER_ID_PATTERN.match(render_id):
+        return jsonify({"error": "Render {} not found".format(render_id)}), 404
+    status, error = renderer.status(render_id)
+    if status == "done":
+        return redirect(render_url(render_id), code=303)
+    if status == "pending":
+        return jsonify({"status": "pending", "render_id": render_id}), 202
+    if status == "failed":
+        return jsonify({"status": "failed", "render_id": render_id, "error": error}), 500
+    return jsonify({"error": "Render {} not found".format(render_id)}), 404
+
+
+@bp.route("/get_graph_data", methods=["GET"])
 def get_graph_data():
     """
     DEPRECATED: This function is now redundant and should not be used by the front-end. 
@@ -329,7 +668,8 @@ def get_graph_data():
     with the front-end graph rendering library.
 
     Parameters:
-    None. The function takes a POST request but doesn't expect specific parameters.
+    unique_id (str): Query parameter, used when Neo4j is not configured to pick the graph
+    from the in-process graph store.
 
     Returns:
     json: A JSON object containing graph elements.
@@ -372,31 +712,9 @@ def get_graph_data():
             """)
             edges = [el['rel'] for el in edges][0]
         else:
-            global response_data
-            # print(response_data)
-            response_dict = response_data
-            # Assume response_data is global or passed appropriately
-            nodes = [
-                {
-                    "data": {
-                        "id": node["id"],
-                        "label": node["label"],
-                        "color": node.get("color", "defaultColor"),
-                    }
-                }
-                for node in response_dict["nodes"]
-            ]
-            edges = [
-                {
-                    "data": {
-                        "source": edge["from_"],
-                        "target": edge["to"],
-                        "label": edge["relationship"],
-                        "color": edge.get("color", "defaultColor"),
-                    }
-                }
-                for edge in response_dict["edges"]
-            ]
+            response_dict, _ = graph_store.get(request.args.get("unique_id", ""))
+            elements = build_elements(response_dict)
+            nodes, edges = elements["nodes"], elements["edges"]
         return jsonify({"elements": {"nodes": nodes, "edges": edges},
                         "message": "This function is now redundant and will be removed soon.",
                         "DeprecationWarning": "This function is deprecated and will be removed in a future version."}), 200
@@ -407,100 +725,624 @@ def get_graph_data():
                         "DeprecationWarning": "This function is deprecated and will be removed in a future version."}), 410
 
 
-@app.route("/get_graph_history", methods=["GET"])
+@bp.route("/get_graph_history", methods=["GET"])
 def get_graph_history():
     """
     Description:
-    Fetches and returns the history of the last 10 most recently updated graph metadata along with their related nodes and relationships from a Neo4j database. If the Neo4j driver is not initialized, an error message is returned.
+    Fetches and returns one page of the most recently updated graph metadata along with their related nodes and relationships from the storage backend (Neo4j or SQLite). Without one, the in-process graph store is listed instead.
 
     Parameters:
-    None. This is a GET request and does not require input parameters. The function assumes that the 'neo4j_driver' is globally available and properly initialized.
+    limit (int): Query parameter, number of graphs per page (default HISTORY_PAGE_SIZE, at most HISTORY_MAX_PAGE_SIZE).
+    cursor (str): Query parameter, the "next_cursor" of the previous page. Omit it for the first page.
+    format (str): Query parameter, "compact" for the compact wire format (see wire.py), also
+    selected by an Accept header of application/vnd.instagraph.compact+json.
 
     Returns:
-    JSON Object: A JSON object containing an array "graph_history" which consists of metadata, nodes, and relationships for each historical graph entry. The JSON object also contains a "total" field indicating the number of historical entries.
+    JSON Object: A JSON object containing an array "graph_history" which consists of metadata, nodes, and relationships for each historical graph entry. The JSON object also contains a "total" field indicating the number of entries on this page and a "next_cursor" field that is null on the last page.
     - Example Return:
         {
             "graph_history": [...],
-            "total": 10
+            "total": 10,
+            "next_cursor": "2023-09-20T10:00:00|<UUID>"
         }
 
     Status Codes:
     - Returns 200 OK if successful.
-    - Returns 500 Internal Server Error if the Neo4j driver is not initialized or any exception occurs.
+    - Returns 400 Bad Request for an invalid limit or cursor.
+    - Returns 500 Internal Server Error if any exception occurs.
 
     Exceptions:
     Catches general exceptions and returns a 500 status code along with the exception message.
     """
     try:
-        if neo4j_driver:
-            # Fetching 10 most recent MetaData along with related nodes and relationships
-            result, _, _ = neo4j_driver.execute_query("""
-            MATCH (m:MetaData)-[:CONTAINS]->(n:Node)
-            WITH collect(n.id) as nodeIds, m as metaData
-            ORDER BY metaData.lastUpdatedOn DESC
-            LIMIT 10
-            MATCH (s:Node)-[r:RELATIONSHIP]->(t:Node)
-            WHERE s.id IN nodeIds AND t.id IN nodeIds
-            RETURN s AS source, r AS relation, t AS target, metaData
-            """)
+        limit = int(request.args.get("limit", HISTORY_PAGE_SIZE))
+        cursor = request.args.get("cursor") or None
+        decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        return jsonify({"error": "limit must be between 1 and {}".format(HISTORY_MAX_PAGE_SIZE)}), 400
 
-            current_uuid = None
-            graph_data = []  # temp storage
-            graph_history = []  # have sorted graph_data based on unique id
-
-            for record in result:
-                # Converting dict_items to dictionary
-                node_meta = dict(record['metaData'].items())
-                # they will be converted automatically in the loop
-                node_from = record['source'].items()
-                relationship = record['relation'].items()
-                node_to = record['target'].items()
-
-                if current_uuid is None:
-                    # initial logic
-                    metadata = {
-                        "description": node_meta["description"],
-                        "last_updated_on": node_meta["lastUpdatedOn"],
-                        "created_on": node_meta["createdOn"],
-                        "unique_id": node_meta["uuid"]
-                    }
-                    current_uuid = node_meta["uuid"]
-                    graph_data.append({
-                        "from": {key: value for key, value in node_from},
-                        "to": {key: value for key, value in node_to},
-                        "relationship": {key: value for key, value in relationship},
-                    })
-                elif current_uuid == node_meta["uuid"]:
-                    # continue logic
-                    graph_data.append({
-                        "from": {key: value for key, value in node_from},
-                        "to": {key: value for key, value in node_to},
-                        "relationship": {key: value for key, value in relationship},
-                    })
-                else:
-                    # changed uuid logic
-                    graph_history.append({
-                        "metadata": metadata,
-                        "graph": graph_data,
-                    })
-                    # new Entry
-                    graph_data = []
-                    metadata = {
-                        "description": node_meta["description"],
-                        "last_updated_on": node_meta["lastUpdatedOn"],
-                        "created_on": node_meta["createdOn"],
-                        "unique_id": node_meta["uuid"]
-                    }
-                    current_uuid = node_meta["uuid"]
-                    graph_data = []  # flashing the graph data
-                    graph_data.append({
-                        "from": {key: value for key, value in node_from},
-                        "to": {key: value for key, value in node_to},
-                        "relationship": {key: value for key, value in relationship},
-                    })
-            return jsonify({"graph_history": graph_history, "total": len(graph_history)})
+    try:
+        if storage:
+            with storage_limiter:
+                graph_history, next_cursor = storage.fetch_graph_history(limit, cursor)
+        else:
+            # Without storage the graphs of the in-process graph store are listed
+            graph_history, next_cursor = graph_store_history(limit, cursor)
+        if wants_compact(request):
+            response = compact_response(
+                compact_history(graph_history, total=len(graph_history), next_cursor=next_cursor))
+        else:
+            response = jsonify({"graph_history": graph_history, "total": len(graph_history), "next_cursor": next_cursor})
+        response.vary.add("Accept")
+        return response
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+def graph_store_history(limit, cursor):
+    """
+    Returns one page of the graph store in the shape of fetch_graph_history.
+    """
+    graphs, next_cursor = graph_store_index(limit, cursor)
+    graph_history = []
+    for listed in graphs:
+        stored = graph_store.get(listed["unique_id"])
+        if stored is None:
+            continue
+        graph, _ = stored
+        nodes = {
+            node["id"]: {"id": node["id"], "label": node["label"], "type": node["type"], "color": node.get("color")}
+            for node in graph["nodes"]
+        }
+        graph_history.append({
+            "metadata": {key: listed[key] for key in ("description", "last_updated_on", "created_on", "unique_id")},
+            "graph": [
+                {
+                    "from": nodes[edge["from"]],
+                    "to": nodes[edge["to"]],
+                    "relationship": {
+                        "type": edge["relationship"], "direction": edge["direction"], "color": edge.get("color"),
+                    },
+                }
+                for edge in graph["edges"] if edge["from"] in nodes and edge["to"] in nodes
+            ],
+        })
+    return graph_history, next_cursor
+
+
+def graph_store_index(limit, cursor):
+    """
+    Lists the graphs held in the in-process graph store the same way fetch_graph_index
+    lists the storage backend, for deployments without one (STORAGE_BACKEND=memory).
+    """
+    before, before_uuid = decode_cursor(cursor)
+    entries = sorted(
+        (
+            (meta["lastUpdatedOn"], meta["unique_id"], meta, node_count, edge_count)
+            for meta, node_count, edge_count in graph_store.list_meta()
+            if (meta["lastUpdatedOn"], meta["unique_id"]) < (before, before_uuid)
+        ),
+        key=lambda entry: (entry[0], entry[1]),
+        reverse=True,
+    )[:limit]
+    graphs = [
+        {
+            "unique_id": meta["unique_id"],
+            "description": meta["description"],
+            "created_on": meta["createdOn"],
+            "last_updated_on": meta["lastUpdatedOn"],
+            "node_count": node_count,
+            "edge_count": edge_count,
+        }
+        for _, _, meta, node_count, edge_count in entries
+    ]
+    next_cursor = None
+    if len(graphs) == limit:
+        next_cursor = encode_cursor(graphs[-1]["last_updated_on"], graphs[-1]["unique_id"])
+    return graphs, next_cursor
+
+
+def find_similar_graph(user_input):
+    """
+    Returns (graph, meta, match) for the best stored graph if it contains at least
+    SEARCH_DUPLICATE_COVERAGE of the input's terms and scores SEARCH_DUPLICATE_MIN_SCORE,
+    otherwise None.
+    """
+    refresh_search_index()
+    with span("search"):
+        results = search_index.search(user_input, 1)
+    if not results:
+        return None
+    unique_id, _, _, score, coverage = results[0]
+    if coverage < SEARCH_DUPLICATE_COVERAGE or score < SEARCH_DUPLICATE_MIN_SCORE:
+        return None
+    stored = load_graph(unique_id)
+    if stored is None:
+        return None
+    graph, meta = stored
+    return graph, meta, {"unique_id": unique_id, "score": round(score, 3), "coverage": round(coverage, 3)}
+
+
+def search_result_nodes(ranked):
+    """
+    Returns {unique_id: nodes} for ranked search results. A graph store copy at least as
+    new as the indexed version is used as is; the nodes of the other graphs are fetched
+    from the storage backend in one query, rather than one load_graph per result.
+    """
+    nodes = {}
+    missing = []
+    for unique_id, _, last_updated_on, _, _ in ranked:
+        stored = graph_store.get(unique_id)
+        if stored is not None and stored[1]["lastUpdatedOn"] >= last_updated_on:
+            nodes[unique_id] = stored[0]["nodes"]
+        else:
+            missing.append(unique_id)
+    if missing and storage:
+        with storage_limiter:
+            nodes.update(storage.fetch_graph_nodes(missing))
+    return nodes
+
+
+@bp.route("/search", methods=["GET"])
+def search_graphs():
+    """
+    Searches stored graphs by their description and node labels and types, ranked with BM25.
+
+    Parameters:
+    q (str): Query parameter, the search terms.
+    limit (int): Query parameter, number of graphs to return (default 10, at most SEARCH_MAX_RESULTS).
+    nodes (int): Query parameter, matching nodes listed per graph (default 5, 0 for none).
+
+    Returns:
+    json: The ranked graphs with their matching nodes.
+        Example:
+        {
+            "results": [
+                {
+                    "unique_id": <UUID>,
+                    "description": <str>,
+                    "last_updated_on": <timestamp>,
+                    "score": 12.3,
+                    "coverage": 1.0,
+                    "nodes": [{"id": "3", "label": "Marie Curie", "type": "Person"}]
+                }
+            ],
+            "total": 1,
+            "indexed": 120345,
+            "complete": true
+        }
+        "complete" is false while the index is still being built at startup.
+
+    Status Codes:
+    - Returns 200 OK if successful.
+    - Returns 400 Bad Request for a missing query or invalid parameters.
+    - Returns 500 Internal Server Error if any exception occurs.
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    try:
+        limit = int(request.args.get("limit", 10))
+        node_limit = int(request.args.get("nodes", 5))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= limit <= SEARCH_MAX_RESULTS:
+        return jsonify({"error": "limit must be between 1 and {}".format(SEARCH_MAX_RESULTS)}), 400
+
+    try:
+        refresh_search_index()
+        with span("search"):
+            ranked = search_index.search(query, limit)
+        nodes = search_result_nodes(ranked) if node_limit > 0 else {}
+        results = []
+        for unique_id, description, last_updated_on, score, coverage in ranked:
+            result = {
+                "unique_id": unique_id,
+                "description": description,
+                "last_updated_on": last_updated_on,
+                "score": round(score, 3),
+                "coverage": round(coverage, 3),
+            }
+            if node_limit > 0:
+                result["nodes"] = matching_nodes(nodes.get(unique_id, []), query, node_limit)
+            results.append(result)
+        return jsonify({
+            "results": results,
+            "total": len(results),
+            "indexed": len(search_index),
+            "complete": search_index_ready.is_set(),
+        })
+    except UpstreamBusyError as e:
+        print(e)
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@bp.route("/graphs", methods=["GET"])
+def list_graphs():
+    """
+    Lists stored graphs, most recently updated first, with metadata only. The nodes and
+    edges of a graph are fetched on demand from /graphs/<unique_id>.
+
+    Parameters:
+    limit (int): Query parameter, number of graphs per page (default HISTORY_PAGE_SIZE, at most HISTORY_MAX_PAGE_SIZE).
+    cursor (str): Query parameter, the "next_cursor" of the previous page. Omit it for the first page.
+
+    Returns:
+    json: A JSON object with the page of graphs and the cursor of the next page.
+        Example:
+        {
+            "graphs": [
+                {
+                    "unique_id": <UUID>,
+                    "description": <str>,
+                    "created_on": <timestamp>,
+                    "last_updated_on": <timestamp>,
+                    "node_count": 12,
+                    "edge_count": 15
+                }
+            ],
+            "total": 1,
+            "next_cursor": null
+        }
+
+    Status Codes:
+    - Returns 200 OK if successful.
+    - Returns 400 Bad Request for an invalid limit or cursor.
+    - Returns 500 Internal Server Error if any exception occurs.
+    """
+    try:
+        limit = int(request.args.get("limit", HISTORY_PAGE_SIZE))
+        cursor = request.args.get("cursor") or None
+        decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        return jsonify({"error": "limit must be between 1 and {}".format(HISTORY_MAX_PAGE_SIZE)}), 400
+
+    try:
+        if storage:
+            with storage_limiter:
+                graphs, next_cursor = storage.fetch_graph_index(limit, cursor)
         else:
-            return jsonify({"error": "Neo4j driver not initialized"}), 500
+            graphs, next_cursor = graph_store_index(limit, cursor)
+        return jsonify({"graphs": graphs, "total": len(graphs), "next_cursor": next_cursor})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@bp.route("/graphs/<unique_id>", methods=["GET"])
+def get_graph(unique_id):
+    """
+    Returns one stored graph in Cytoscape "elements" format, in the same shape as
+    /get_response_data.
+
+    The response carries an ETag and Last-Modified derived from the graph's unique_id and
+    lastUpdatedOn, so browsers and caches revalidate with If-None-Match/If-Modified-Since
+    and receive 304 Not Modified while the graph is unchanged.
+
+    Status Codes:
+    - Returns 200 OK with the graph, or 304 Not Modified.
+    - Returns 404 Not Found if no graph has the unique_id.
+    - Returns 500 Internal Server Error if any exception occurs.
+    """
+    try:
+        stored = load_graph(unique_id)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    if stored is None:
+        return jsonify({"error": "Graph {} not found".format(unique_id)}), 404
+    graph, meta = stored
+
+    response = graph_response(graph, meta)
+    # the full and compact formats are different representations with their own ETags
+    response.set_etag(hashlib.sha1("{}:{}:{}".format(
+        meta["unique_id"], graph_version(graph, meta), response.mimetype).encode("utf-8")).hexdigest())
+    response.last_modified = datetime.strptime(meta["lastUpdatedOn"], '%Y-%m-%dT%H:%M:%S')
+    response.cache_control.public = True
+    response.cache_control.max_age = GRAPH_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+
+def graph_analytics_entry(unique_id):
+    """
+    Returns (graph, meta, analytics cache entry) for a stored graph, or None if it does not exist.
+    """
+    stored = load_graph(unique_id)
+    if stored is None:
+        return None
+    graph, meta = stored
+    entry = analytics_cache.get(unique_id, graph_version(graph, meta), lambda: graph_to_csr(graph))
+    return graph, meta, entry
+
+
+@bp.route("/graphs/<unique_id>/analytics", methods=["GET"])
+def get_graph_analytics(unique_id):
+    """
+    Returns analytics for one stored graph: node and edge counts, density, connected
+    components and the top nodes by degree centrality and PageRank. With 'source' and
+    'target' it also returns a shortest path between the two nodes.
+
+    Parameters:
+    top (int): Query parameter, number of top nodes to return (default 10).
+    source, target (str): Query parameters, node ids for the shortest path.
+    directed (bool): Query parameter, follow edge directions for the path (default false).
+
+    Status Codes:
+    - Returns 200 OK if successful.
+    - Returns 400 Bad Request for invalid parameters or unknown node ids.
+    - Returns 404 Not Found if no graph has the unique_id.
+    - Returns 500 Internal Server Error if any exception occurs.
+    """
+    try:
+        top = int(request.args.get("top", 10))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    source = request.args.get("source")
+    target = request.args.get("target")
+    directed = request.args.get("directed", "false").lower() in ("1", "true", "yes")
+
+    try:
+        loaded = graph_analytics_entry(unique_id)
+        if loaded is None:
+            return jsonify({"error": "Graph {} not found".format(unique_id)}), 404
+        _, meta, entry = loaded
+        payload = {
+            "meta": meta,
+            "analytics": analytics_cache.result(entry, "summary:{}".format(top), lambda csr: csr.summary(top)),
+        }
+        if source or target:
+            csr = entry["csr"]
+            if source not in csr.index or target not in csr.index:
+                return jsonify({"error": "Unknown source or target node"}), 400
+            payload["shortest_path"] = analytics_cache.result(
+                entry, "path:{}:{}:{}".format(source, target, directed),
+                lambda csr: csr.shortest_path(source, target, directed))
+        return jsonify(payload)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@bp.route("/graphs/<unique_id>/neighborhood", methods=["GET"])
+def get_graph_neighborhood(unique_id):
+    """
+    Returns the k-hop neighborhood of a node as Cytoscape "elements": the nodes within k
+    hops and the edges between them.
+
+    Parameters:
+    node (str): Query parameter, the id of the center node.
+    k (int): Query parameter, number of hops (default 1, at most NEIGHBORHOOD_MAX_HOPS).
+    directed (bool): Query parameter, only follow outgoing edges (default false).
+
+    Status Codes:
+    - Returns 200 OK if successful.
+    - Returns 400 Bad Request for invalid parameters or an unknown node.
+    - Returns 404 Not Found if no graph has the unique_id.
+    - Returns 500 Internal Server Error if any exception occurs.
+    """
+    node_id = request.args.get("node", "")
+    try:
+        k = int(request.args.get("k", 1))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 0 <= k <= NEIGHBORHOOD_MAX_HOPS:
+        return jsonify({"error": "k must be between 0 and {}".format(NEIGHBORHOOD_MAX_HOPS)}), 400
+    directed = request.args.get("directed", "false").lower() in ("1", "true", "yes")
+
+    try:
+        loaded = graph_analytics_entry(unique_id)
+        if loaded is None:
+            return jsonify({"error": "Graph {} not found".format(unique_id)}), 404
+        graph, meta, entry = loaded
+        csr = entry["csr"]
+        if node_id not in csr.index:
+            return jsonify({"error": "Node {} not found".format(node_id)}), 400
+        members = {csr.node_ids[i] for i in csr.k_hop(node_id, k, directed)}
+        subgraph = {
+            "nodes": [node for node in graph["nodes"] if node["id"] in members],
+            "edges": [edge for edge in graph["edges"] if edge["from"] in members and edge["to"] in members],
+        }
+        return graph_response(subgraph, meta, center=node_id, k=k)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+def expansion_context(graph, entry, node_id, question, k):
+    """
+    Returns the part of a graph the model needs to expand it: the k-hop neighborhood of
+    node_id, or of the nodes whose labels occur in the question, or else of the highest
+    degree nodes. At most EXPAND_CONTEXT_MAX_NODES nodes are kept, seeds first.
+    """
+    csr = entry["csr"]
+    if node_id:
+        seeds = [node_id]
+    else:
+        normalized_question = " {} ".format(normalize_label(question))
+        seeds = [
+            node["id"] for node in graph["nodes"]
+            if normalize_label(node["label"]) and " {} ".format(normalize_label(node["label"])) in normalized_question
+        ]
+        if not seeds:
+            summary = analytics_cache.result(entry, "summary:10", lambda csr: csr.summary(10))
+            seeds = [item["id"] for item in summary["degree_centrality"]]
+
+    members = list(dict.fromkeys(seeds))
+    for seed in seeds:
+        members.extend(csr.node_ids[i] for i in csr.k_hop(seed, k))
+    members = set(list(dict.fromkeys(members))[:EXPAND_CONTEXT_MAX_NODES])
+    return {
+        "nodes": [node for node in graph["nodes"] if node["id"] in members],
+        "edges": [edge for edge in graph["edges"] if edge["from"] in members and edge["to"] in members],
+    }
+
+
+def expansion_messages(context, node, question):
+    """
+    Returns the chat messages asking the model for the nodes and edges that extend the
+    context graph, either around one node or to answer a question.
+    """
+    lines = ["{} [{}] {}".format(n["id"], n["type"], n["label"]) for n in context["nodes"]]
+    lines += ["{} -[{}]-> {}".format(e["from"], e["relationship"], e["to"]) for e in context["edges"]]
+    if question:
+        task = "Extend it to answer: {}".format(question)
+    else:
+        task = "Expand the node {} ({}) with more detail.".format(node["id"], node["label"])
+    return [
+        {
+            "role": "user",
+            "content": (
+                "Here is part of an existing knowledge graph, nodes as 'id [type] label' and "
+                "edges as 'from -[relationship]-> to':\n{}\n\n{}\n"
+                "Return only NEW nodes and edges. Refer to existing nodes by their id, and give "
+                "new nodes ids that are not used above.".format("\n".join(lines), task)
+            ),
+        }
+    ]
+
+
+@bp.route("/graphs/<unique_id>/expand", methods=["POST"])
+def expand_graph(unique_id):
+    """
+    Extends a stored graph instead of generating a new one. Only the relevant neighborhood
+    is sent to the model, which answers with the new nodes and edges; these are merged
+    into the graph, its layout and storage, and the graph's lastUpdatedOn is updated.
+
+    Parameters:
+    None. The function takes a POST request with 'node' (a node id) and/or 'question' in
+    the request JSON body, and optionally 'k' (hops of context, default 1).
+
+    Returns:
+    json: The added elements and the updated metadata.
+        Example:
+        {
+            "elements": {"nodes": [...], "edges": [...]},
+            "meta": {"unique_id": <UUID>, ..., "lastUpdatedOn": <timestamp>}
+        }
+
+    Errors:
+    - Returns 400 Bad Request if neither 'node' nor 'question' is given, or the node does not exist.
+    - Returns 404 Not Found if no graph has the unique_id.
+    - Returns 429 Too Many Requests if OpenAI rate limit is exceeded.
+    - Returns 503 Service Unavailable if OpenAI or the storage backend stays at its concurrency limit.
+    - Returns 500 Internal Server Error for any other exception.
+    """
+    body = request.get_json(silent=True) or {}
+    node_id = str(body.get("node") or "")
+    question = str(body.get("question") or "").strip()
+    if not node_id and not question:
+        return jsonify({"error": "Provide a node or a question"}), 400
+    try:
+        k = min(int(body.get("k", 1)), NEIGHBORHOOD_MAX_HOPS)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        loaded = graph_analytics_entry(unique_id)
+        if loaded is None:
+            return jsonify({"error": "Graph {} not found".format(unique_id)}), 404
+        graph, meta, entry = loaded
+        if node_id and node_id not in entry["csr"].index:
+            return jsonify({"error": "Node {} not found".format(node_id)}), 400
+        node = next((n for n in graph["nodes"] if n["id"] == node_id), None)
+        context = expansion_context(graph, entry, node_id, question, k)
+        # the model only refers by id to the nodes it was shown
+        context_ids = {n["id"] for n in context["nodes"]}
+
+        delta = with_backoff(
+            create_completion, expansion_messages(context, node, question), max_retries=OPENAI_MAX_RETRIES)
+
+        # laid out before the storage write lock is taken, which only covers the merge and
+        # the write (a no-op for graphs loaded through load_graph, which are laid out)
+        apply_layout(graph)
+        positions = {n["id"]: n["position"] for n in graph["nodes"]}
+
+        def merge(current):
+            added = merge_delta(current, delta, context_ids)
+            unplaced = []
+            for n in current["nodes"]:
+                if "position" not in n:
+                    if n["id"] in positions:
+                        n["position"] = positions[n["id"]]
+                    else:
+                        # added meanwhile without a position, placed like the new nodes
+                        unplaced.append(n)
+            place_new_nodes(current, unplaced + added["nodes"], added["edges"])
+            return added
+
+        last_updated_on = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        with expand_lock:
+            # merge against the latest version, another expansion may have finished meanwhile
+            # (in this worker, or in another one when the merge runs inside the storage
+            # transaction, where new node ids are allocated)
+            if storage:
+                with storage_limiter:
+                    merged = storage.merge_graph_delta(unique_id, merge, last_updated_on)
+                if merged is None:
+                    return jsonify({"error": "Graph {} not found".format(unique_id)}), 404
+                graph, meta, added = merged
+            else:
+                graph, meta = graph_store.get(unique_id) or (graph, meta)
+                # a copy, the graph store's version is not modified in place
+                graph = {**graph, "nodes": [dict(node) for node in graph["nodes"]]}
+                added = merge(graph)
+                if added["nodes"] or added["edges"]:
+                    meta = {**meta, "lastUpdatedOn": last_updated_on}
+            # a new dict, readers of the previous version are not affected
+            updated = {**graph, "nodes": graph["nodes"] + added["nodes"], "edges": graph["edges"] + added["edges"]}
+            graph_store.put(unique_id, updated, meta)
+            search_index.add(meta, updated["nodes"])
+    except UpstreamBusyError as e:
+        print(e)
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        if is_rate_limited(e):
+            print(e)
+            response = jsonify({"error": str(e)})
+            delay = retry_after(e)
+            if delay is not None:
+                response.headers["Retry-After"] = str(int(delay + 0.999))
+            return response, 429
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    expansion_elements.inc(len(added["nodes"]), kind="nodes")
+    expansion_elements.inc(len(added["edges"]), kind="edges")
+    return graph_response(added, meta)
+
+
+@bp.route("/analytics", methods=["GET"])
+def get_corpus_analytics():
+    """
+    Returns the same analytics as /graphs/<unique_id>/analytics over every relationship
+    stored in the storage backend. The corpus is streamed into the compact adjacency index once and
+    reused until a graph is added or updated.
+
+    Status Codes:
+    - Returns 200 OK if successful.
+    - Returns 500 Internal Server Error if no storage backend is configured or any exception occurs.
+    """
+    try:
+        top = int(request.args.get("top", 10))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not storage:
+        return jsonify({"error": "No graph storage configured"}), 500
+    try:
+        with storage_limiter:
+            version = storage.corpus_version()
+            entry = analytics_cache.get(
+                "corpus", version, lambda: CSRGraph.from_edges(storage.iter_corpus_edges()))
+        summary = analytics_cache.result(entry, "summary:{}".format(top), lambda csr: csr.summary(top))
+        return jsonify({"analytics": summary})
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -532,10 +1374,88 @@ def process_graph_data(record):
         return {"error": str(e)}
 
 
-@app.route("/")
+@bp.route("/healthz", methods=["GET"])
+def healthz():
+    """
+    Liveness check: answers as long as the process serves requests, without touching
+    OpenAI or storage.
+    """
+    return jsonify({"status": "ok"}), 200
+
+
+@bp.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness check: 200 once the startup checks (OpenAI client loaded, storage reachable
+    with its schema in place) have passed, 503 until then. The body reports every check.
+
+    Example Response:
+        {
+            "ready": true,
+            "uptime_seconds": 3.2,
+            "checks": {
+                "openai": {"ok": true, "required": true, "error": null, "attempts": 1, "seconds": 0.48},
+                "storage": {"ok": true, "required": true, "error": null, "attempts": 1, "seconds": 0.02},
+                "search_index": {"ok": true, "required": false, "error": null, "attempts": 1, "seconds": 1.7}
+            }
+        }
+    """
+    status = readiness.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Returns the metrics of this process (stage latencies, request latencies, cache, token
+    and graph size counters) in the Prometheus text format. Every gunicorn worker keeps
+    its own metrics, so scrape each worker or aggregate by instance.
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """
+    Returns the hit/miss counters of the knowledge graph cache.
+    """
+    return jsonify(kg_cache.stats()), 200
+
+
+@bp.cli.command("migrate-node-identity")
+def migrate_node_identity_command():
+    """
+    Moves graphs stored with globally shared node ids to graph-scoped nodes.
+    """
+    if not neo4j_driver:
+        print("Neo4j driver not initialized")
+        return
+    migrated, deleted = migrate_node_identity(neo4j_driver)
+    print("migrated {} graphs, deleted {} legacy nodes".format(migrated, deleted))
+
+
+@bp.route("/")
 def index():
     return render_template("index.html")
 
 
+def create_app():
+    """
+    Creates the Flask app and starts the readiness checks in the background.
+
+    Nothing slow happens on import or here: the OpenAI client and the Neo4j driver are
+    created on first use, and the readiness checks load them, set up the storage schema
+    and build the search index without holding up the app. A new worker accepts requests
+    within milliseconds of starting; /readyz tells load balancers when it is warm.
+
+    Returns:
+    Flask: The app (gunicorn "main:create_app()", flask --app main).
+    """
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    readiness.start()
+    return app
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080)
+    create_app().run(host="0.0.0.0", port=8080, threaded=True)
@@ -0,0 +1,222 @@
+import bisect
+import contextvars
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Seconds, from sub-millisecond queries to multi-minute generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Nodes or edges per graph
+SIZE_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} expects labels {}".format(self.name, self.labelnames))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, optionally per label values.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key, value):
+        return ["{}{} {}".format(self.name, _format_labels(self.labelnames, key), value)]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, with their sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one slot per bucket, one for +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _samples(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(
+                self.name, _format_labels(self.labelnames, key, [("le", bound)]), cumulative))
+        labels = _format_labels(self.labelnames, key)
+        lines.append("{}_sum{} {}".format(self.name, labels, counts[-1]))
+        lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+        return lines
+
+
+class Observed(_Metric):
+    """
+    Gauge or counter whose value is read from a function when the metrics are rendered,
+    for values other modules already keep (in-flight calls, cache hit counts).
+    """
+
+    def __init__(self, name, help_text, read, kind="gauge"):
+        super().__init__(name, help_text)
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind),
+                "{} {}".format(self.name, self.read())]
+
+
+class Registry:
+    """
+    The metrics of this process, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.register(Histogram(
+    "instagraph_stage_seconds", "Time spent per processing stage.", ["stage"]))
+http_request_seconds = REGISTRY.register(Histogram(
+    "instagraph_http_request_seconds", "Time to build each HTTP response.", ["endpoint", "method", "status"]))
+graph_nodes = REGISTRY.register(Histogram(
+    "instagraph_graph_nodes", "Nodes per generated graph.", buckets=SIZE_BUCKETS))
+graph_edges = REGISTRY.register(Histogram(
+    "instagraph_graph_edges", "Edges per generated graph.", buckets=SIZE_BUCKETS))
+expansion_elements = REGISTRY.register(Counter(
+    "instagraph_expansion_added_total", "Nodes and edges added to stored graphs by expansions.", ["kind"]))
+
+# Stage timings of the current request, for the Server-Timing header
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block into instagraph_stage_seconds{stage=...} and, inside a
+    request started with start_request, into that request's timings.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def timed(stage):
+    """
+    Decorator timing every call of the function as a span.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    """
+    Starts collecting the spans of the current request.
+    """
+    _request_spans.set([])
+
+
+def request_spans():
+    """
+    Returns the (stage, seconds) spans of the current request, summed per stage.
+    """
+    totals = {}
+    for stage, elapsed in _request_spans.get() or ():
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return totals
+
+
+def server_timing(spans):
+    """
+    Formats spans as a Server-Timing header value (durations in milliseconds).
+    """
+    return ", ".join("{};dur={:.1f}".format(stage, seconds * 1000.0) for stage, seconds in spans.items())
+
+
+class RequestProfiler:
+    """
+    cProfile of the current thread for the duration of one request.
+    """
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def summary(self, limit=30):
+        """
+        Stops profiling and returns the functions with the highest cumulative time.
+        """
+        self._profile.disable()
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
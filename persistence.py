@@ -0,0 +1,584 @@
+import os
+
+from chunking import normalize_label
+from metrics import timed
+
+# Node ids come from the model ("1", "2", ...) and only identify a node within its graph.
+# Nodes are keyed by uid = "<graph uuid>:<id>"; the same entity across graphs is linked
+# through an Entity node keyed by the normalized label.
+ENTITY_LAYER = os.getenv("NEO4J_ENTITY_LAYER", "true").lower() in ("1", "true", "yes")
+
+SCHEMA_STATEMENTS = [
+    # the old global id constraint would make graph-scoped nodes with the same id collide
+    "DROP CONSTRAINT node_id IF EXISTS",
+    "CREATE CONSTRAINT node_uid IF NOT EXISTS FOR (n:Node) REQUIRE n.uid IS UNIQUE",
+    "CREATE CONSTRAINT entity_key IF NOT EXISTS FOR (e:Entity) REQUIRE e.key IS UNIQUE",
+    "CREATE CONSTRAINT metadata_uuid IF NOT EXISTS FOR (m:MetaData) REQUIRE m.uuid IS UNIQUE",
+    "CREATE INDEX metadata_last_updated_on IF NOT EXISTS FOR (m:MetaData) ON (m.lastUpdatedOn)",
+]
+
+# Writes the nodes and relationships of g into the graph of MetaData m. Every lookup goes
+# through the uid constraint, so the cost depends on the size of g only.
+GRAPH_CONTENT_SUBQUERIES = """
+CALL {
+    WITH m, g
+    UNWIND g.nodes AS node
+    MERGE (n:Node {uid: g.uuid + ':' + node.id})
+    ON CREATE SET n.id = node.id,
+                n.graph = g.uuid,
+                n.type = node.type,
+                n.label = node.label,
+                n.color = node.color
+    MERGE (m)-[c:CONTAINS]->(n)
+    SET c.x = node.x, c.y = node.y
+    FOREACH (key IN CASE WHEN node.key IS NULL THEN [] ELSE [node.key] END |
+        MERGE (e:Entity {key: key})
+        ON CREATE SET e.label = node.label, e.type = node.type
+        MERGE (n)-[:INSTANCE_OF]->(e)
+    )
+}
+CALL {
+    WITH g
+    UNWIND g.edges AS rel
+    MATCH (s:Node {uid: g.uuid + ':' + rel.from})
+    MATCH (t:Node {uid: g.uuid + ':' + rel.to})
+    MERGE (s)-[r:RELATIONSHIP {type: rel.relationship}]->(t)
+    ON CREATE SET r.direction = rel.direction,
+                r.color = rel.color,
+                r.timestamp = timestamp()
+}
+"""
+
+# One round trip per batch of graphs. MetaData is created once per graph and carried into
+# both subqueries, so nodes and relationships never look it up again.
+SAVE_GRAPHS_QUERY = """
+UNWIND $graphs AS g
+CREATE (m:MetaData {uuid: g.uuid, description: g.description, createdOn: g.createdOn, lastUpdatedOn: g.lastUpdatedOn,
+                    nodeCount: size(g.nodes), edgeCount: size(g.edges)})
+WITH m, g
+""" + GRAPH_CONTENT_SUBQUERIES
+
+# Adds nodes and relationships to an existing graph, bumps its lastUpdatedOn and recounts
+# its nodes and edges (graphs stored before the counts existed have none to add to)
+SAVE_GRAPH_DELTA_QUERY = """
+WITH $graph AS g
+MATCH (m:MetaData {uuid: g.uuid})
+SET m.lastUpdatedOn = g.lastUpdatedOn
+WITH m, g
+""" + GRAPH_CONTENT_SUBQUERIES + """
+WITH DISTINCT m
+SET m.nodeCount = COUNT { (m)-[:CONTAINS]->(:Node) },
+    m.edgeCount = COUNT {
+        (m)-[:CONTAINS]->(:Node)-[:RELATIONSHIP]->(t:Node) WHERE EXISTS { (m)-[:CONTAINS]->(t) }
+    }
+"""
+
+# Takes the write lock of a graph's MetaData node for the rest of the transaction; setting
+# and removing a property locks the node without changing it
+LOCK_GRAPH_QUERY = """
+MATCH (m:MetaData {uuid: $uuid})
+SET m._lock = true
+REMOVE m._lock
+RETURN m.uuid AS uuid
+"""
+
+GRAPH_VERSION_QUERY = """
+MATCH (m:MetaData {uuid: $uuid})
+RETURN m.lastUpdatedOn AS lastUpdatedOn
+"""
+
+
+@timed("neo4j_ensure_schema")
+def ensure_schema(driver):
+    """
+    Creates the uniqueness constraints and indexes the ingestion and history queries rely on.
+    Safe to run on every startup.
+    """
+    for statement in SCHEMA_STATEMENTS:
+        driver.execute_query(statement)
+
+
+def graph_params(meta, graph):
+    """
+    Builds the query parameters for one graph, keeping only the properties that are stored.
+
+    Parameters:
+    meta (dict): Metadata with unique_id, description, createdOn and lastUpdatedOn.
+    graph (dict): The knowledge graph dict with "nodes" and "edges" ("from"/"to" keys).
+    """
+    return {
+        "uuid": meta["unique_id"],
+        "description": meta["description"],
+        "createdOn": meta["createdOn"],
+        "lastUpdatedOn": meta["lastUpdatedOn"],
+        "nodes": [
+            {
+                "id": node["id"], "type": node["type"], "label": node["label"], "color": node.get("color"),
+                "x": node.get("position", {}).get("x"), "y": node.get("position", {}).get("y"),
+                "key": (normalize_label(node["label"]) or None) if ENTITY_LAYER else None,
+            }
+            for node in graph["nodes"]
+        ],
+        "edges": [
+            {
+                "from": edge["from"], "to": edge["to"],
+                "relationship": edge["relationship"],
+                "direction": edge["direction"], "color": edge.get("color"),
+            }
+            for edge in graph["edges"]
+        ],
+    }
+
+
+def _write_graphs(tx, graphs):
+    tx.run(SAVE_GRAPHS_QUERY, graphs=graphs).consume()
+
+
+@timed("neo4j_save_graph")
+def save_graph(driver, meta, graph):
+    """
+    Writes one graph, its nodes and its relationships in a single write transaction.
+    """
+    with driver.session() as session:
+        session.execute_write(_write_graphs, [graph_params(meta, graph)])
+
+
+@timed("neo4j_merge_graph_delta")
+def merge_graph_delta(driver, unique_id, merge, last_updated_on):
+    """
+    Extends a stored graph in a single write transaction that first locks it, so
+    expansions of the same graph in different processes run one after the other and each
+    sees the nodes the previous one added.
+
+    Parameters:
+    unique_id (str): The graph to extend.
+    merge (callable): Called with the current stored graph dict; returns {"nodes": [...],
+    "edges": [...]} holding only the new nodes and edges. It may be called again if the
+    transaction is retried.
+    last_updated_on (str): The graph's new lastUpdatedOn, set only if something was added.
+
+    Returns:
+    tuple: (graph, meta, added), the graph as merge saw it, the updated metadata and
+    merge's result, or None if no graph has the unique_id.
+    """
+    def work(tx):
+        if tx.run(LOCK_GRAPH_QUERY, uuid=unique_id).single() is None:
+            return None
+        graph, meta = _graph_from_record(tx.run(GRAPH_QUERY, uuid=unique_id).single())
+        added = merge(graph)
+        if added["nodes"] or added["edges"]:
+            meta = {**meta, "lastUpdatedOn": last_updated_on}
+            tx.run(SAVE_GRAPH_DELTA_QUERY, graph=graph_params(meta, added)).consume()
+        return graph, meta, added
+
+    with driver.session() as session:
+        return session.execute_write(work)
+
+
+@timed("neo4j_graph_version")
+def graph_version(driver, unique_id):
+    """
+    Returns the lastUpdatedOn of a stored graph, or None if no graph has the unique_id.
+    """
+    records, _, _ = driver.execute_query(GRAPH_VERSION_QUERY, {"uuid": unique_id})
+    return records[0]["lastUpdatedOn"] if records else None
+
+
+@timed("neo4j_save_graphs")
+def save_graphs(driver, entries, batch_size=5000):
+    """
+    Bulk-imports many graphs. Graphs are grouped into batches of roughly batch_size nodes
+    plus edges and each batch is written in one transaction.
+
+    Parameters:
+    driver: The Neo4j driver.
+    entries (iterable): (meta, graph) pairs as accepted by graph_params.
+    batch_size (int): Approximate number of nodes plus edges per transaction.
+
+    Returns:
+    int: The number of graphs written.
+    """
+    written = 0
+    batch = []
+    batch_elements = 0
+    with driver.session() as session:
+        for meta, graph in entries:
+            params = graph_params(meta, graph)
+            batch.append(params)
+            batch_elements += 1 + len(params["nodes"]) + len(params["edges"])
+            if batch_elements >= batch_size:
+                session.execute_write(_write_graphs, batch)
+                written += len(batch)
+                batch = []
+                batch_elements = 0
+        if batch:
+            session.execute_write(_write_graphs, batch)
+            written += len(batch)
+    return written
+
+
+# Index-backed range seek on MetaData.lastUpdatedOn, then each graph's own subgraph is
+# reached through its CONTAINS edges, so the cost depends on the page, not on the corpus.
+# (lastUpdatedOn, uuid) is the cursor; uuid breaks ties between graphs stored in the same second.
+GRAPH_HISTORY_QUERY = """
+MATCH (m:MetaData)
+WHERE m.lastUpdatedOn <= $before
+  AND (m.lastUpdatedOn < $before OR m.uuid < $beforeUuid)
+WITH m
+ORDER BY m.lastUpdatedOn DESC, m.uuid DESC
+LIMIT $limit
+CALL {
+    WITH m
+    MATCH (m)-[:CONTAINS]->(s:Node)-[r:RELATIONSHIP]->(t:Node)
+    WHERE t.graph = m.uuid OR (t.graph IS NULL AND EXISTS { (m)-[:CONTAINS]->(t) })
+    RETURN collect({from: properties(s), relationship: properties(r), to: properties(t)}) AS graph
+}
+RETURN m AS metaData, graph
+ORDER BY m.lastUpdatedOn DESC, m.uuid DESC
+"""
+
+# Sorts after every stored "%Y-%m-%dT%H:%M:%S" timestamp
+FIRST_PAGE_CURSOR = "9999-12-31T23:59:59"
+
+
+def encode_cursor(last_updated_on, unique_id):
+    return "{}|{}".format(last_updated_on, unique_id)
+
+
+def decode_cursor(cursor):
+    """
+    Splits a history cursor into (lastUpdatedOn, uuid). An empty cursor means the first page.
+    Raises ValueError for malformed cursors.
+    """
+    if not cursor:
+        return FIRST_PAGE_CURSOR, ""
+    last_updated_on, separator, unique_id = cursor.partition("|")
+    if not separator:
+        raise ValueError("Invalid cursor: {}".format(cursor))
+    return last_updated_on, unique_id
+
+
+@timed("neo4j_fetch_graph_history")
+def fetch_graph_history(driver, limit=10, cursor=None):
+    """
+    Fetches one page of graphs, most recently updated first, with each graph's relationships.
+
+    Parameters:
+    driver: The Neo4j driver.
+    limit (int): Number of graphs per page.
+    cursor (str): The "next_cursor" of the previous page, or None for the first page.
+
+    Returns:
+    tuple: (graph_history, next_cursor). graph_history is a list of
+    {"metadata": {...}, "graph": [{"from": {...}, "to": {...}, "relationship": {...}}]},
+    next_cursor is None on the last page.
+    """
+    before, before_uuid = decode_cursor(cursor)
+    records, _, _ = driver.execute_query(
+        GRAPH_HISTORY_QUERY,
+        {"before": before, "beforeUuid": before_uuid, "limit": limit},
+    )
+
+    graph_history = []
+    for record in records:
+        node_meta = record["metaData"]
+        graph_history.append({
+            "metadata": {
+                "description": node_meta["description"],
+                "last_updated_on": node_meta["lastUpdatedOn"],
+                "created_on": node_meta["createdOn"],
+                "unique_id": node_meta["uuid"],
+            },
+            "graph": record["graph"],
+        })
+
+    next_cursor = None
+    if len(graph_history) == limit:
+        last = graph_history[-1]["metadata"]
+        next_cursor = encode_cursor(last["last_updated_on"], last["unique_id"])
+    return graph_history, next_cursor
+
+
+# Metadata only, for listing graphs. Counts are stored at ingestion; graphs written before
+# that fall back to counting their own CONTAINS/RELATIONSHIP edges.
+GRAPH_INDEX_QUERY = """
+MATCH (m:MetaData)
+WHERE m.lastUpdatedOn <= $before
+  AND (m.lastUpdatedOn < $before OR m.uuid < $beforeUuid)
+WITH m
+ORDER BY m.lastUpdatedOn DESC, m.uuid DESC
+LIMIT $limit
+RETURN m.uuid AS uuid, m.description AS description,
+       m.createdOn AS createdOn, m.lastUpdatedOn AS lastUpdatedOn,
+       coalesce(m.nodeCount, COUNT { (m)-[:CONTAINS]->(:Node) }) AS nodeCount,
+       coalesce(m.edgeCount, COUNT {
+           (m)-[:CONTAINS]->(:Node)-[:RELATIONSHIP]->(t:Node) WHERE EXISTS { (m)-[:CONTAINS]->(t) }
+       }) AS edgeCount
+ORDER BY lastUpdatedOn DESC, uuid DESC
+"""
+
+GRAPH_QUERY = """
+MATCH (m:MetaData {uuid: $uuid})
+CALL {
+    WITH m
+    MATCH (m)-[c:CONTAINS]->(n:Node)
+    RETURN collect({id: n.id, label: n.label, type: n.type, color: n.color, x: c.x, y: c.y}) AS nodes
+}
+CALL {
+    WITH m
+    MATCH (m)-[:CONTAINS]->(s:Node)-[r:RELATIONSHIP]->(t:Node)
+    WHERE t.graph = m.uuid OR (t.graph IS NULL AND EXISTS { (m)-[:CONTAINS]->(t) })
+    RETURN collect({from: s.id, to: t.id, relationship: r.type, direction: r.direction, color: r.color}) AS edges
+}
+RETURN m AS metaData, nodes, edges
+"""
+
+
+@timed("neo4j_fetch_graph_index")
+def fetch_graph_index(driver, limit=10, cursor=None):
+    """
+    Fetches one page of graph metadata, most recently updated first, without nodes or edges.
+
+    Returns:
+    tuple: (graphs, next_cursor). graphs is a list of dicts with unique_id, description,
+    created_on, last_updated_on, node_count and edge_count; next_cursor is None on the last page.
+    """
+    before, before_uuid = decode_cursor(cursor)
+    records, _, _ = driver.execute_query(
+        GRAPH_INDEX_QUERY,
+        {"before": before, "beforeUuid": before_uuid, "limit": limit},
+    )
+    graphs = [
+        {
+            "unique_id": record["uuid"],
+            "description": record["description"],
+            "created_on": record["createdOn"],
+            "last_updated_on": record["lastUpdatedOn"],
+            "node_count": record["nodeCount"],
+            "edge_count": record["edgeCount"],
+        }
+        for record in records
+    ]
+    next_cursor = None
+    if len(graphs) == limit:
+        next_cursor = encode_cursor(graphs[-1]["last_updated_on"], graphs[-1]["unique_id"])
+    return graphs, next_cursor
+
+
+@timed("neo4j_fetch_graph")
+def fetch_graph(driver, unique_id):
+    """
+    Fetches one stored graph.
+
+    Returns:
+    tuple: (graph, meta) in the shapes used by the graph store, or None if no graph has
+    the unique_id.
+    """
+    records, _, _ = driver.execute_query(GRAPH_QUERY, {"uuid": unique_id})
+    if not records:
+        return None
+    return _graph_from_record(records[0])
+
+
+GRAPH_NODES_QUERY = """
+UNWIND $uuids AS uuid
+MATCH (m:MetaData {uuid: uuid})-[:CONTAINS]->(n:Node)
+RETURN uuid, collect({id: n.id, label: n.label, type: n.type}) AS nodes
+"""
+
+
+@timed("neo4j_fetch_graph_nodes")
+def fetch_graph_nodes(driver, unique_ids):
+    """
+    Fetches the nodes (id, label and type only) of several stored graphs in one query.
+
+    Returns:
+    dict: {unique_id: [node dicts]} for the graphs that exist.
+    """
+    records, _, _ = driver.execute_query(GRAPH_NODES_QUERY, {"uuids": list(unique_ids)})
+    return {record["uuid"]: record["nodes"] for record in records}
+
+
+def _graph_from_record(record):
+    node_meta = record["metaData"]
+    nodes = []
+    for node in record["nodes"]:
+        x, y = node.pop("x"), node.pop("y")
+        if x is not None and y is not None:
+            node["position"] = {"x": x, "y": y}
+        nodes.append(node)
+    meta = {
+        "unique_id": node_meta["uuid"],
+        "description": node_meta["description"],
+        "createdOn": node_meta["createdOn"],
+        "lastUpdatedOn": node_meta["lastUpdatedOn"],
+    }
+    return {"nodes": nodes, "edges": record["edges"]}, meta
+
+
+# Positions are stored on the graph's own CONTAINS relationships because nodes can be
+# shared between graphs.
+SAVE_LAYOUT_QUERY = """
+MATCH (m:MetaData {uuid: $uuid})
+UNWIND $positions AS p
+MATCH (m)-[c:CONTAINS]->(:Node {id: p.id})
+SET c.x = p.x, c.y = p.y
+"""
+
+
+@timed("neo4j_save_layout")
+def save_layout(driver, unique_id, graph):
+    """
+    Persists the node positions of a graph computed after it was stored.
+    """
+    positions = [
+        {"id": node["id"], "x": node["position"]["x"], "y": node["position"]["y"]}
+        for node in graph["nodes"] if "position" in node
+    ]
+    driver.execute_query(SAVE_LAYOUT_QUERY, {"uuid": unique_id, "positions": positions})
+
+
+# Graphs are joined through their shared entities; nodes without one stay graph-local
+CORPUS_EDGES_QUERY = """
+MATCH (s:Node)-[:RELATIONSHIP]->(t:Node)
+OPTIONAL MATCH (s)-[:INSTANCE_OF]->(se:Entity)
+OPTIONAL MATCH (t)-[:INSTANCE_OF]->(te:Entity)
+RETURN coalesce(se.key, s.uid, s.id) AS source, coalesce(te.key, t.uid, t.id) AS target
+"""
+
+
+def iter_corpus_edges(driver):
+    """
+    Streams (source, target) for every relationship in the database without materializing
+    the result. Nodes are identified by their entity key where they have one.
+    """
+    with driver.session() as session:
+        result = session.run(CORPUS_EDGES_QUERY)
+        for record in result:
+            yield record["source"], record["target"]
+
+
+@timed("neo4j_corpus_version")
+def corpus_version(driver):
+    """
+    Returns a value that changes whenever a graph is added or updated, used to invalidate
+    corpus-wide analytics.
+    """
+    records, _, _ = driver.execute_query(
+        "MATCH (m:MetaData) RETURN count(m) AS graphs, max(m.lastUpdatedOn) AS lastUpdatedOn")
+    return "{}|{}".format(records[0]["graphs"], records[0]["lastUpdatedOn"])
+
+
+# Description and node labels/types of every graph, for building the search index
+SEARCH_DOCUMENT_NODES = """
+CALL {
+    WITH m
+    MATCH (m)-[:CONTAINS]->(n:Node)
+    RETURN collect({label: n.label, type: n.type}) AS nodes
+}
+RETURN m.uuid AS uuid, m.description AS description, m.lastUpdatedOn AS lastUpdatedOn, nodes
+"""
+SEARCH_DOCUMENTS_QUERY = "MATCH (m:MetaData)" + SEARCH_DOCUMENT_NODES
+# A separate query rather than "$since IS NULL OR ...", so the planner seeks the index on
+# MetaData.lastUpdatedOn
+SEARCH_DOCUMENTS_SINCE_QUERY = "MATCH (m:MetaData) WHERE m.lastUpdatedOn >= $since" + SEARCH_DOCUMENT_NODES
+
+
+def iter_search_documents(driver, since=None):
+    """
+    Streams (meta, nodes) for every stored graph, or only for those updated at or after
+    since (a lastUpdatedOn timestamp), with the node labels and types only.
+    """
+    query, parameters = (SEARCH_DOCUMENTS_QUERY, {}) if since is None else (SEARCH_DOCUMENTS_SINCE_QUERY, {"since": since})
+    with driver.session() as session:
+        for record in session.run(query, parameters):
+            meta = {"unique_id": record["uuid"], "description": record["description"],
+                    "lastUpdatedOn": record["lastUpdatedOn"]}
+            yield meta, record["nodes"]
+
+
+# Nodes written before node identity was graph-scoped have no uid and may be shared by
+# several graphs. Reads one legacy graph as a graph dict.
+LEGACY_GRAPH_QUERY = """
+MATCH (m:MetaData {uuid: $uuid})
+CALL {
+    WITH m
+    MATCH (m)-[c:CONTAINS]->(n:Node)
+    WHERE n.uid IS NULL
+    RETURN collect({id: n.id, label: n.label, type: n.type, color: n.color, x: c.x, y: c.y}) AS nodes
+}
+CALL {
+    WITH m
+    MATCH (m)-[:CONTAINS]->(s:Node)-[r:RELATIONSHIP]->(t:Node)
+    WHERE s.uid IS NULL AND EXISTS { (m)-[:CONTAINS]->(t) }
+    RETURN collect({from: s.id, to: t.id, relationship: r.type, direction: r.direction, color: r.color}) AS edges
+}
+RETURN m.uuid AS uuid, nodes, edges
+"""
+
+# Writes the graph-scoped copy and detaches the graph from its legacy nodes
+MIGRATE_GRAPH_QUERY = """
+WITH $graph AS g
+MATCH (m:MetaData {uuid: g.uuid})
+SET m.nodeCount = size(g.nodes), m.edgeCount = size(g.edges)
+WITH m, g
+""" + GRAPH_CONTENT_SUBQUERIES + """
+WITH m
+MATCH (m)-[c:CONTAINS]->(legacy:Node)
+WHERE legacy.uid IS NULL
+DELETE c
+"""
+
+DELETE_ORPHANED_LEGACY_NODES_QUERY = """
+MATCH (n:Node)
+WHERE n.uid IS NULL AND NOT EXISTS { (:MetaData)-[:CONTAINS]->(n) }
+WITH n LIMIT $limit
+DETACH DELETE n
+RETURN count(*) AS deleted
+"""
+
+
+def _migrate_graph(tx, unique_id):
+    record = tx.run(LEGACY_GRAPH_QUERY, uuid=unique_id).single()
+    if record is None or not record["nodes"]:
+        return 0
+    graph = {
+        "nodes": [
+            {**node, "position": {"x": node["x"], "y": node["y"]}} if node["x"] is not None else node
+            for node in record["nodes"]
+        ],
+        "edges": record["edges"],
+    }
+    meta = {"unique_id": unique_id, "description": None, "createdOn": None, "lastUpdatedOn": None}
+    tx.run(MIGRATE_GRAPH_QUERY, graph=graph_params(meta, graph)).consume()
+    return len(graph["nodes"])
+
+
+@timed("neo4j_migrate_node_identity")
+def migrate_node_identity(driver, batch_size=10000):
+    """
+    Migrates nodes written before node identity was graph-scoped: every graph gets its own
+    copy of its nodes and of the relationships between them, then legacy nodes no graph
+    contains any more are deleted. Each graph is migrated in its own transaction, so the
+    migration can be interrupted and run again.
+
+    A legacy relationship between two nodes shared by several graphs cannot be attributed
+    to one of them and is copied into each graph containing both nodes.
+
+    Returns:
+    tuple: (migrated graph count, deleted legacy node count)
+    """
+    ensure_schema(driver)
+    records, _, _ = driver.execute_query(
+        "MATCH (m:MetaData) WHERE EXISTS { (m)-[:CONTAINS]->(n:Node) WHERE n.uid IS NULL } RETURN m.uuid AS uuid")
+    migrated = 0
+    with driver.session() as session:
+        for record in records:
+            if session.execute_write(_migrate_graph, record["uuid"]):
+                migrated += 1
+    deleted = 0
+    while True:
+        result, _, _ = driver.execute_query(DELETE_ORPHANED_LEGACY_NODES_QUERY, {"limit": batch_size})
+        deleted += result[0]["deleted"]
+        if result[0]["deleted"] < batch_size:
+            return migrated, deleted
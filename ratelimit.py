@@ -0,0 +1,267 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from contextlib import closing
+
+from limits import UpstreamBusyError
+
+
+def _refill(level, updated, capacity, now):
+    # buckets refill continuously at capacity per minute
+    return min(capacity, level + (now - updated) * capacity / 60.0)
+
+
+class _MemoryBuckets:
+    """
+    Bucket levels kept in this process.
+    """
+
+    def __init__(self, capacities):
+        self.capacities = capacities
+        now = time.time()
+        self._levels = {name: (float(capacity), now) for name, capacity in capacities.items()}
+        self._lock = threading.Lock()
+
+    def take(self, amounts, now):
+        with self._lock:
+            levels = {
+                name: _refill(level, updated, self.capacities[name], now)
+                for name, (level, updated) in self._levels.items()
+            }
+            wait = _shortfall(levels, amounts, self.capacities)
+            if wait == 0:
+                levels = {name: level - amounts.get(name, 0) for name, level in levels.items()}
+            self._levels = {name: (level, now) for name, level in levels.items()}
+            return wait
+
+    def adjust(self, name, amount, now):
+        with self._lock:
+            if name in self._levels:
+                level, updated = self._levels[name]
+                self._levels[name] = (_refill(level, updated, self.capacities[name], now) - amount, now)
+
+
+class _SQLiteBuckets:
+    """
+    Bucket levels kept in a SQLite file, so every gunicorn worker pointing at the same file
+    draws from the same budget. Each update runs in an immediate (write-locked)
+    transaction on a new connection.
+    """
+
+    def __init__(self, capacities, path):
+        self.capacities = capacities
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    name TEXT PRIMARY KEY,
+                    level REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+                """
+            )
+            now = time.time()
+            conn.executemany(
+                "INSERT OR IGNORE INTO rate_buckets (name, level, updated) VALUES (?, ?, ?)",
+                [(name, float(capacity), now) for name, capacity in capacities.items()],
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _update(self, now, change):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT name, level, updated FROM rate_buckets WHERE name IN ({})".format(
+                    ",".join("?" * len(self.capacities))),
+                list(self.capacities),
+            ).fetchall()
+            levels = {name: _refill(level, updated, self.capacities[name], now) for name, level, updated in rows}
+            levels, result = change(levels)
+            conn.executemany(
+                "UPDATE rate_buckets SET level = ?, updated = ? WHERE name = ?",
+                [(level, now, name) for name, level in levels.items()],
+            )
+            conn.execute("COMMIT")
+            return result
+        finally:
+            conn.close()
+
+    def take(self, amounts, now):
+        def change(levels):
+            wait = _shortfall(levels, amounts, self.capacities)
+            if wait == 0:
+                levels = {name: level - amounts.get(name, 0) for name, level in levels.items()}
+            return levels, wait
+
+        return self._update(now, change)
+
+    def adjust(self, name, amount, now):
+        if name in self.capacities:
+            self._update(now, lambda levels: ({**levels, name: levels[name] - amount}, None))
+
+
+def _shortfall(levels, amounts, capacities):
+    # seconds until every bucket holds the amount asked of it, 0 if they already do
+    wait = 0.0
+    for name, level in levels.items():
+        # a single request never needs more than a full bucket
+        amount = min(amounts.get(name, 0), capacities[name])
+        if level < amount:
+            wait = max(wait, (amount - level) * 60.0 / capacities[name])
+    return wait
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for the requests-per-minute and tokens-per-minute budgets of an
+    upstream API.
+
+    acquire() takes one request and an estimate of its tokens from the buckets, waiting
+    (with jitter, so waiting threads do not wake up in lockstep) until both budgets allow
+    it. Once the real usage is known, settle() corrects the token bucket by the difference.
+    With a db_path the buckets live in SQLite and are shared by every process using the
+    same file, such as the gunicorn workers of one host.
+
+    Parameters:
+    name (str): Name of the upstream, used in error messages.
+    requests_per_minute (int): Request budget, 0 for none.
+    tokens_per_minute (int): Token budget, 0 for none.
+    max_wait (float): Seconds to wait for budget before raising UpstreamBusyError.
+    db_path (str): Optional SQLite file holding the shared bucket state.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_wait=30.0, db_path=None):
+        self.name = name
+        self.max_wait = max_wait
+        capacities = {}
+        if requests_per_minute:
+            capacities["requests"] = requests_per_minute
+        if tokens_per_minute:
+            capacities["tokens"] = tokens_per_minute
+        self.enabled = bool(capacities)
+        self._buckets = _SQLiteBuckets(capacities, db_path) if db_path and capacities else _MemoryBuckets(capacities)
+
+    def acquire(self, tokens):
+        """
+        Waits until one request of the estimated number of tokens fits the budgets.
+
+        Raises:
+        UpstreamBusyError: If it does not fit within max_wait seconds.
+        """
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self._buckets.take({"requests": 1, "tokens": tokens}, time.time())
+            if wait == 0:
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise UpstreamBusyError(
+                    "{} rate limit budget exhausted for the next {:.1f}s".format(self.name, wait))
+            time.sleep(min(remaining, wait * random.uniform(1.0, 1.5)))
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """
+        Charges (or refunds) the difference between the actual and estimated tokens of a
+        request taken with acquire().
+        """
+        if self.enabled and actual_tokens is not None:
+            self._buckets.adjust("tokens", actual_tokens - estimated_tokens, time.time())
+
+
+class Coalescer:
+    """
+    Lets concurrent callers asking for the same key share one computation: the first
+    caller (the leader) computes the result, the others wait for it and receive the same
+    result or exception. Coalescing is per process.
+
+    Parameters:
+    max_wait (float): Seconds the others wait for the leader before giving up with
+        UpstreamBusyError, or None to wait as long as it takes.
+    """
+
+    def __init__(self, max_wait=None):
+        self.max_wait = max_wait
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """
+        Returns (future, leader). The leader must call resolve() with the outcome on every
+        path, errors included; the others call wait(future).
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = self._in_flight[key] = Future()
+            return future, True
+
+    def resolve(self, key, future, result=None, error=None):
+        """
+        Removes the key and hands the leader's result or error to the others. Errors that
+        are not an Exception, such as the GeneratorExit of a disconnected client, end only
+        the leader's request; the others receive UpstreamBusyError instead.
+        """
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+        if error is not None and not isinstance(error, Exception):
+            error = UpstreamBusyError("An identical request was cancelled before it finished")
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def wait(self, future):
+        """
+        Returns the leader's result or raises its exception, or UpstreamBusyError after
+        max_wait seconds.
+        """
+        try:
+            return future.result(self.max_wait)
+        except TimeoutError:
+            raise UpstreamBusyError(
+                "An identical request is still generating after {:.0f}s".format(self.max_wait)) from None
+
+    def run(self, key, func):
+        """
+        Returns func() for the leader and the leader's result for everyone else.
+        """
+        future, leader = self.claim(key)
+        if not leader:
+            return self.wait(future)
+        try:
+            result = func()
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+        self.resolve(key, future, result)
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._in_flight)
+
+
+def rate_limiter_from_env(name="OpenAI"):
+    """
+    Creates the OpenAI rate limiter configured through OPENAI_RPM, OPENAI_TPM,
+    UPSTREAM_MAX_WAIT_SECONDS and RATE_LIMIT_DB_PATH.
+    """
+    return RateLimiter(
+        name,
+        requests_per_minute=int(os.getenv("OPENAI_RPM", "0")),
+        tokens_per_minute=int(os.getenv("OPENAI_TPM", "0")),
+        max_wait=float(os.getenv("UPSTREAM_MAX_WAIT_SECONDS", "30")),
+        db_path=os.getenv("RATE_LIMIT_DB_PATH") or None,
+    )
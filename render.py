@@ -0,0 +1,204 @@
+import hashlib
+import os
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import span
+
+RENDER_FORMATS = ("svg", "png", "pdf")
+RENDER_ID_PATTERN = re.compile(r"^[0-9a-f]{40}\.(svg|png|pdf)$")
+
+
+class RenderError(Exception):
+    """
+    Raised when Graphviz fails or exceeds the render timeout.
+    """
+
+
+def graph_to_dot(graph):
+    """
+    Returns the Graphviz DOT source for a knowledge graph dict.
+    """
+    # imported on first render rather than at startup
+    from graphviz import Digraph
+
+    dot = Digraph(comment="Knowledge Graph")
+    # Add nodes to the graph
+    for node in graph.get("nodes", []):
+        dot.node(node["id"], f"{node['label']} ({node['type']})")
+
+    # Add edges to the graph
+    for edge in graph.get("edges", []):
+        dot.edge(edge["from"], edge["to"], label=edge["relationship"])
+    return dot.source
+
+
+class Renderer:
+    """
+    Renders DOT sources to files named by a hash of their content.
+
+    Identical graphs map to the same file, so a render is only ever done once and is reused
+    afterwards. Renders run on a bounded pool of threads, each waiting on its own Graphviz
+    process, so they never occupy request threads and are killed after the timeout.
+
+    The directory is kept within max_files files and max_bytes bytes: after each render
+    the least recently used files (by mtime, which reuse refreshes) are deleted. A
+    deleted render is simply rendered again the next time it is requested.
+
+    Parameters:
+    output_dir (str): Directory the rendered files are written to.
+    max_workers (int): Maximum number of Graphviz processes running at once.
+    timeout (float): Seconds a single render may take.
+    max_files (int): Most rendered files kept, 0 for no limit.
+    max_bytes (int): Most bytes of rendered files kept, 0 for no limit.
+    """
+
+    def __init__(self, output_dir, max_workers=2, timeout=30.0, max_files=1000, max_bytes=256 * 1024 * 1024):
+        self.output_dir = output_dir
+        self.timeout = timeout
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="graphviz")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    @staticmethod
+    def render_id(source, fmt):
+        """
+        Returns the content-addressed id "<sha1 of source>.<format>" of a render.
+        """
+        return "{}.{}".format(hashlib.sha1(source.encode("utf-8")).hexdigest(), fmt)
+
+    def path(self, render_id):
+        return os.path.join(self.output_dir, render_id)
+
+    def submit(self, source, fmt):
+        """
+        Starts rendering the DOT source unless the same render exists or is in progress.
+
+        Returns:
+        tuple: (render_id, future). future is None when the file already exists.
+        """
+        if fmt not in RENDER_FORMATS:
+            raise ValueError("Unsupported format {}, use one of {}".format(fmt, ", ".join(RENDER_FORMATS)))
+        render_id = self.render_id(source, fmt)
+        try:
+            # marks the render as recently used, so eviction keeps it
+            os.utime(self.path(render_id))
+            return render_id, None
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # there, but its mtime cannot be changed
+            return render_id, None
+        with self._lock:
+            future = self._jobs.get(render_id)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(self._render, source, fmt, render_id)
+                self._jobs[render_id] = future
+                future.add_done_callback(lambda f: self._forget(render_id, f))
+        return render_id, future
+
+    def _forget(self, render_id, future):
+        # Successful renders are found on disk from now on, failures stay visible to pollers
+        if future.exception() is None:
+            with self._lock:
+                if self._jobs.get(render_id) is future:
+                    del self._jobs[render_id]
+
+    def _render(self, source, fmt, render_id):
+        try:
+            with span("graphviz_render"):
+                result = subprocess.run(
+                    ["dot", "-T{}".format(fmt)],
+                    input=source.encode("utf-8"),
+                    capture_output=True,
+                    timeout=self.timeout,
+                )
+        except subprocess.TimeoutExpired:
+            raise RenderError("Graphviz render exceeded {} seconds".format(self.timeout))
+        except OSError as e:
+            raise RenderError("Graphviz could not be started: {}".format(e))
+        if result.returncode != 0:
+            raise RenderError("Graphviz failed: {}".format(result.stderr.decode("utf-8", "replace").strip()))
+
+        path = self.path(render_id)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            f.write(result.stdout)
+        os.replace(tmp_path, path)
+        self.evict()
+        return render_id
+
+    def evict(self):
+        """
+        Deletes the least recently used renders while the directory holds more than
+        max_files files or max_bytes bytes. Returns the number of files deleted.
+        """
+        if not (self.max_files or self.max_bytes):
+            return 0
+        if not self._evict_lock.acquire(blocking=False):
+            # another render thread is already evicting
+            return 0
+        try:
+            renders = []
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if RENDER_ID_PATTERN.match(entry.name):
+                        try:
+                            info = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        renders.append((info.st_mtime, info.st_size, entry.path))
+            files, total = len(renders), sum(size for _, size, _ in renders)
+            deleted = 0
+            for _, size, path in sorted(renders):
+                if (not self.max_files or files <= self.max_files) and (not self.max_bytes or total <= self.max_bytes):
+                    break
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    # removed by another worker meanwhile
+                    pass
+                files -= 1
+                total -= size
+            return deleted
+        finally:
+            self._evict_lock.release()
+
+    def status(self, render_id):
+        """
+        Returns ("done", None), ("pending", None), ("failed", error message) or
+        ("unknown", None) for a render id.
+        """
+        if os.path.exists(self.path(render_id)):
+            return "done", None
+        with self._lock:
+            future = self._jobs.get(render_id)
+        if future is None:
+            return "unknown", None
+        if not future.done():
+            return "pending", None
+        error = future.exception()
+        if error is not None:
+            return "failed", str(error)
+        return "done", None
+
+
+def renderer_from_env(static_folder):
+    """
+    Creates the renderer configured through the RENDER_* environment variables, writing to
+    <static_folder>/renders.
+    """
+    return Renderer(
+        os.path.join(static_folder, "renders"),
+        max_workers=int(os.getenv("RENDER_MAX_WORKERS", "2")),
+        timeout=float(os.getenv("RENDER_TIMEOUT_SECONDS", "30")),
+        max_files=int(os.getenv("RENDER_MAX_FILES", "1000")),
+        max_bytes=int(os.getenv("RENDER_MAX_BYTES", str(256 * 1024 * 1024))),
+    )
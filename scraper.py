@@ -0,0 +1,333 @@
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import timed
+
+try:
+    # lxml parses incrementally while the page downloads; html.parser is the fallback
+    from lxml import etree
+except ImportError:
+    etree = None
+
+SCRAPE_TIMEOUT_SECONDS = float(os.getenv("SCRAPE_TIMEOUT_SECONDS", "10"))
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(5 * 1024 * 1024)))
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "8"))
+SCRAPE_CACHE_DIR = os.getenv("SCRAPE_CACHE_DIR") or None
+SCRAPE_MAX_REDIRECTS = int(os.getenv("SCRAPE_MAX_REDIRECTS", "5"))
+# URLs come from users, so by default only public addresses are fetched: no loopback,
+# private, link-local (cloud metadata at 169.254.169.254) or otherwise reserved ones
+SCRAPE_ALLOW_PRIVATE_ADDRESSES = os.getenv("SCRAPE_ALLOW_PRIVATE_ADDRESSES", "false").lower() in ("1", "true", "yes")
+
+URL_PATTERN = re.compile(r"^https?://\S+$", re.IGNORECASE)
+CHUNK_SIZE = 64 * 1024
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+
+class ScrapeError(Exception):
+    """
+    Raised when a URL cannot be fetched or yields no text.
+    """
+
+
+def is_public_address(address):
+    """
+    Returns True if an IP address is globally routable (and not multicast).
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_url(url):
+    """
+    Raises ScrapeError unless url is an http(s) URL whose host resolves only to public
+    addresses (any address with SCRAPE_ALLOW_PRIVATE_ADDRESSES).
+    """
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise ScrapeError("Not an http(s) URL: {}".format(url))
+    if SCRAPE_ALLOW_PRIVATE_ADDRESSES:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or None)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ScrapeError("Could not resolve {}: {}".format(parts.hostname, e))
+    blocked = sorted(address for address in addresses if not is_public_address(address))
+    if blocked:
+        raise ScrapeError("{} resolves to a non-public address ({})".format(parts.hostname, ", ".join(blocked)))
+
+
+class _PublicAddressMixin:
+    # Checks the address actually connected to, so a DNS answer that changes between
+    # check_url and the connection (DNS rebinding) cannot reach a private address
+    def _new_conn(self):
+        sock = super()._new_conn()
+        if not SCRAPE_ALLOW_PRIVATE_ADDRESSES and not is_public_address(sock.getpeername()[0]):
+            address = sock.getpeername()[0]
+            sock.close()
+            raise ConnectionRefusedError("{} connected to non-public address {}".format(self.host, address))
+        return sock
+
+
+class _PublicHTTPConnection(_PublicAddressMixin, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicAddressMixin, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class _PublicAddressAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _PublicHTTPConnectionPool,
+                                                   "https": _PublicHTTPSConnectionPool}
+
+
+def _build_session():
+    session = requests.Session()
+    # proxies from the environment would hide the address actually fetched
+    session.trust_env = False
+    adapter = _PublicAddressAdapter(pool_connections=SCRAPE_MAX_WORKERS, pool_maxsize=SCRAPE_MAX_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "instagraph-scraper"
+    return session
+
+
+# Shared so connections (and TLS sessions) are reused across requests
+session = _build_session()
+
+
+def extract_urls(user_input):
+    """
+    Returns the URLs if the input consists only of whitespace-separated URLs, otherwise an
+    empty list (the input is then treated as plain text).
+    """
+    tokens = user_input.split()
+    if tokens and all(URL_PATTERN.match(token) for token in tokens):
+        return tokens
+    return []
+
+
+class ConditionalGetCache:
+    """
+    On-disk cache of scraped text keyed by URL, revalidated with ETag/Last-Modified so
+    unchanged pages cost a 304 instead of a download and a parse.
+
+    Parameters:
+    directory (str): Directory holding one JSON file per URL.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, url, etag, last_modified, text):
+        path = self._path(url)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified, "text": text}, f)
+        os.replace(tmp_path, path)
+
+
+scrape_cache = ConditionalGetCache(SCRAPE_CACHE_DIR) if SCRAPE_CACHE_DIR else None
+
+
+def _paragraph_text_lxml(chunks):
+    parser = etree.HTMLPullParser(events=("end",), tag="p")
+    paragraphs = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            paragraphs.append("".join(element.itertext()))
+            element.clear()
+    try:
+        parser.close()
+    except etree.LxmlError:
+        # empty or truncated documents
+        pass
+    for _, element in parser.read_events():
+        paragraphs.append("".join(element.itertext()))
+    return paragraphs
+
+
+def _paragraph_text_bs4(chunks):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # Only <p> elements are turned into a tree
+    soup = BeautifulSoup(b"".join(chunks), "html.parser", parse_only=SoupStrainer("p"))
+    return [p.get_text() for p in soup.find_all("p")]
+
+
+def _limited_chunks(response, max_bytes):
+    received = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if received + len(chunk) > max_bytes:
+            # Parse what fits instead of failing on oversized pages
+            yield chunk[:max_bytes - received]
+            print("Truncated {} at {} bytes".format(response.url, max_bytes))
+            return
+        received += len(chunk)
+        yield chunk
+
+
+def _get(url, headers, timeout):
+    # redirects are followed here, one hop at a time, so every target is checked
+    for _ in range(SCRAPE_MAX_REDIRECTS + 1):
+        check_url(url)
+        response = session.get(url, headers=headers, timeout=timeout, stream=True, allow_redirects=False)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(response.url, response.headers["Location"])
+    raise ScrapeError("Too many redirects (more than {})".format(SCRAPE_MAX_REDIRECTS))
+
+
+@timed("scrape")
+def fetch_text(url, timeout=SCRAPE_TIMEOUT_SECONDS, max_bytes=SCRAPE_MAX_BYTES):
+    """
+    Fetches a web page and returns the text of its paragraphs.
+
+    The body is streamed and parsed while it downloads, and never more than max_bytes
+    are read. With SCRAPE_CACHE_DIR set, pages are revalidated with a conditional GET.
+    Only public addresses are fetched (see check_url), and at most SCRAPE_MAX_REDIRECTS
+    redirects are followed, each checked the same way.
+
+    Parameters:
+    url (str): The URL of the webpage to scrape content from.
+    timeout (float): Connect and read timeout in seconds.
+    max_bytes (int): Maximum number of body bytes to read.
+
+    Returns:
+    str: The text content of all paragraphs concatenated as a single string.
+
+    Raises:
+    ScrapeError: If the page cannot be retrieved.
+    """
+    cached = scrape_cache.get(url) if scrape_cache else None
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        with _get(url, headers, timeout) as response:
+            if response.status_code == 304 and cached:
+                return cached["text"]
+            if response.status_code != 200:
+                raise ScrapeError("Could not retrieve content from {} (status {})".format(
+                    url, response.status_code))
+            content_type = response.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+            if content_type and content_type not in HTML_TYPES:
+                raise ScrapeError("{} is not an HTML page ({})".format(url, content_type))
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                print("{} is {} bytes, reading the first {}".format(url, content_length, max_bytes))
+
+            chunks = _limited_chunks(response, max_bytes)
+            if etree is not None:
+                paragraphs = _paragraph_text_lxml(chunks)
+            else:
+                paragraphs = _paragraph_text_bs4(list(chunks))
+    except requests.RequestException as e:
+        raise ScrapeError("Could not retrieve content from {}: {}".format(url, e))
+
+    text = " ".join(paragraphs)
+    if scrape_cache and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+        scrape_cache.set(url, response.headers.get("ETag"), response.headers.get("Last-Modified"), text)
+    print("web scrape done")
+    return text
+
+
+def fetch_many(urls, max_workers=SCRAPE_MAX_WORKERS):
+    """
+    Fetches several URLs concurrently through the shared session.
+
+    Returns:
+    list: One (url, text, error) tuple per URL, in input order. error is None on success.
+    """
+    def fetch(url):
+        try:
+            return url, fetch_text(url), None
+        except ScrapeError as e:
+            return url, "", str(e)
+
+    if len(urls) == 1:
+        return [fetch(urls[0])]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        return list(executor.map(fetch, urls))
+
+
+def scrape_text_from_url(url):
+    """
+    Scrapes and returns the text content from the paragraphs of the given URL.
+
+    Parameters:
+    url (str): The URL of the webpage to scrape content from.
+
+    Returns:
+    str: Returns the text content of all paragraphs in the webpage concatenated as a single string.
+         Returns "Error: Could not retrieve content from URL." if the page cannot be retrieved.
+
+    Example:
+    >>> scrape_text_from_url("https://example.com")
+    'This is paragraph 1. This is paragraph 2.'
+    """
+    try:
+        return fetch_text(url)
+    except ScrapeError as e:
+        print(e)
+        return "Error: Could not retrieve content from URL."
+
+
+def resolve_input(user_input):
+    """
+    Returns the text a knowledge graph should be generated from. Inputs made only of URLs
+    are replaced by the scraped text of those pages, fetched concurrently; anything else is
+    returned unchanged.
+
+    Raises:
+    ScrapeError: If none of the URLs yielded any text.
+    """
+    urls = extract_urls(user_input)
+    if not urls:
+        return user_input
+    results = fetch_many(urls)
+    texts = [text for _, text, error in results if not error and text.strip()]
+    if not texts:
+        raise ScrapeError("; ".join(
+            error or "No text found at {}".format(url) for url, _, error in results))
+    return "\n\n".join(texts)
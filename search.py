@@ -0,0 +1,295 @@
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the to was were will with".split())
+
+# Term weights per field: a word in the description counts twice, a node type half
+DESCRIPTION_WEIGHT = 2.0
+LABEL_WEIGHT = 1.0
+TYPE_WEIGHT = 0.5
+
+
+def tokenize(text):
+    """
+    Splits text into case-folded word tokens without stopwords.
+    """
+    return [token for token in TOKEN.findall((text or "").casefold()) if token not in STOPWORDS]
+
+
+def document_terms(description, nodes):
+    """
+    Returns the weighted term frequencies of one graph: its description and the labels and
+    types of its nodes.
+    """
+    terms = Counter()
+    for token in tokenize(description):
+        terms[token] += DESCRIPTION_WEIGHT
+    for node in nodes:
+        for token in tokenize(node.get("label")):
+            terms[token] += LABEL_WEIGHT
+        for token in tokenize(node.get("type")):
+            terms[token] += TYPE_WEIGHT
+    return terms
+
+
+class Postings:
+    """
+    The postings of one term: the numbers of the documents containing it (ascending), the
+    term's weight in each and each document's length, as NumPy arrays ready to be scored.
+
+    Appends go to a small tail of compact arrays that is merged into the NumPy arrays
+    before the postings are read, or once it is as long as them, so building an index
+    copies every posting a constant number of times on average.
+    """
+
+    __slots__ = ("docs", "weights", "lengths", "_tail_docs", "_tail_weights", "_tail_lengths",
+                 "_frequency", "_frequency_key")
+
+    def __init__(self):
+        self.docs = np.empty(0, dtype=np.intp)
+        self.weights = np.empty(0, dtype=np.float32)
+        self.lengths = np.empty(0, dtype=np.float32)
+        self._tail_docs = array("I")
+        self._tail_weights = array("f")
+        self._tail_lengths = array("f")
+        self._frequency = 0
+        self._frequency_key = None
+
+    def append(self, doc, weight, length):
+        self._tail_docs.append(doc)
+        self._tail_weights.append(weight)
+        self._tail_lengths.append(length)
+        if len(self._tail_docs) >= max(len(self.docs), 64):
+            self.merge()
+
+    def merge(self):
+        if not self._tail_docs:
+            return
+        # np.array() copies, so the tails can be replaced while arrays built from them live on
+        self.docs = np.concatenate((self.docs, np.array(self._tail_docs, dtype=np.intp)))
+        self.weights = np.concatenate((self.weights, np.array(self._tail_weights, dtype=np.float32)))
+        self.lengths = np.concatenate((self.lengths, np.array(self._tail_lengths, dtype=np.float32)))
+        self._tail_docs, self._tail_weights, self._tail_lengths = array("I"), array("f"), array("f")
+
+    def frequency(self, live, tombstoned):
+        """
+        Returns the number of live documents containing the term, counted again only after
+        postings were added or documents tombstoned.
+        """
+        key = (len(self.docs), tombstoned)
+        if key != self._frequency_key:
+            self._frequency = int(np.count_nonzero(live[self.docs])) if tombstoned else len(self.docs)
+            self._frequency_key = key
+        return self._frequency
+
+    def __len__(self):
+        return len(self.docs) + len(self._tail_docs)
+
+
+class SearchIndex:
+    """
+    In-process inverted index over stored graphs, ranked with BM25.
+
+    Every graph is one document made of its description and its node labels and types
+    (weighted by field). Postings are appended incrementally as graphs are added; a graph
+    added again with new content (after an expansion) gets a new document and the old one
+    is tombstoned. Adding a version that is already indexed does nothing, so rebuilding
+    the index or replaying updates is safe. Each term's postings are kept as NumPy arrays
+    of document numbers, weights and document lengths (see Postings), so a query is
+    scored with a few vectorized operations per term and no gathers or conversions.
+    Document frequencies only count live documents.
+
+    Parameters:
+    k1 (float): BM25 term frequency saturation.
+    b (float): BM25 length normalization.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = array("f")
+        self._live = array("b")
+        self._dead = array("I")
+        self._scores = np.zeros(0)
+        self._documents = []
+        self._by_uuid = {}
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+        self.live_count = 0
+
+    def add(self, meta, nodes):
+        """
+        Indexes a graph, replacing the document of an earlier version of it. The version
+        already indexed is kept if it is as new (by lastUpdatedOn) and as large (expansions
+        only add nodes), so a background build cannot overwrite a newer graph indexed
+        meanwhile and adding the same version twice does nothing.
+
+        Parameters:
+        meta (dict): Metadata with unique_id, description and lastUpdatedOn.
+        nodes (list): The graph's node dicts (label and type are indexed).
+
+        Returns:
+        bool: Whether the graph was indexed.
+        """
+        unique_id = meta["unique_id"]
+        terms = document_terms(meta.get("description"), nodes)
+        length = sum(terms.values())
+        last_updated_on = meta.get("lastUpdatedOn") or ""
+        with self._lock:
+            previous = self._by_uuid.get(unique_id)
+            if previous is not None:
+                if (self._documents[previous][2], self._lengths[previous]) >= (last_updated_on, length):
+                    return False
+                self._tombstone(previous)
+            doc = len(self._documents)
+            self._documents.append((unique_id, meta.get("description"), last_updated_on))
+            self._by_uuid[unique_id] = doc
+            self._lengths.append(length)
+            self._live.append(1)
+            self._total_length += length
+            self.live_count += 1
+            for term, weight in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = Postings()
+                postings.append(doc, weight, length)
+        return True
+
+    def remove(self, unique_id):
+        with self._lock:
+            doc = self._by_uuid.pop(unique_id, None)
+            if doc is not None and self._live[doc]:
+                self._tombstone(doc)
+
+    def _tombstone(self, doc):
+        self._live[doc] = 0
+        self._total_length -= self._lengths[doc]
+        self.live_count -= 1
+        self._dead.append(doc)
+
+    def search(self, query, limit=10):
+        """
+        Ranks the indexed graphs for a query.
+
+        Returns:
+        list: Up to limit (unique_id, description, lastUpdatedOn, score, coverage) tuples,
+        best first. coverage is the share of the query's idf mass found in the graph,
+        1.0 when every query term occurs in it.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self.live_count:
+                return []
+            return self._rank(terms, limit)
+
+    def _rank(self, terms, limit):
+        # runs under the lock; the NumPy view on _live is released when it returns, before
+        # add() can grow the array again
+        count = len(self._documents)
+        live = np.frombuffer(self._live, dtype=np.int8)
+        average_length = max(self._total_length / self.live_count, 1e-9)
+        scored = []
+        total_idf = 0.0
+        for term in terms:
+            postings = self._postings.get(term)
+            document_frequency = 0
+            if postings:
+                postings.merge()
+                # tombstoned documents still have postings, they do not count towards idf
+                document_frequency = postings.frequency(live, len(self._dead))
+            idf = math.log(1.0 + (self.live_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            total_idf += idf
+            if postings:
+                weights = postings.weights
+                norm = self.k1 * (1.0 - self.b + self.b * postings.lengths / average_length)
+                scored.append((postings.docs, idf * weights * (self.k1 + 1.0) / (weights + norm), idf))
+        if not scored:
+            return []
+
+        # scores accumulate in a buffer kept zeroed between queries: allocating and
+        # clearing a new one per query costs as much as scoring
+        if len(self._scores) < count:
+            self._scores = np.zeros(max(count, 2 * len(self._scores)))
+        scores = self._scores[:count]
+        for docs, impacts, _ in scored:
+            # documents appear at most once per term, so plain fancy-index adds are safe
+            scores[docs] += impacts
+        if self._dead:
+            scores[np.array(self._dead, dtype=np.intp)] = 0.0
+        if sum(len(docs) for docs, _, _ in scored) * 64 < count:
+            # few postings: look only at the documents they contain
+            candidates = np.unique(np.concatenate([docs for docs, _, _ in scored]))
+        elif max(len(docs) for docs, _, _ in scored) * 2 < count:
+            # selecting among many equal (zero) scores is slow, leave them out first
+            candidates = np.flatnonzero(scores)
+        else:
+            candidates = None
+        if candidates is None and count > limit:
+            candidates = np.argpartition(scores, count - limit)[-limit:]
+            candidate_scores = scores[candidates]
+            scores.fill(0.0)
+        else:
+            if candidates is None:
+                candidates = np.arange(count)
+            candidate_scores = scores[candidates]
+            scores[candidates] = 0.0
+            if len(candidates) > limit:
+                top = np.argpartition(candidate_scores, len(candidates) - limit)[-limit:]
+                candidates, candidate_scores = candidates[top], candidate_scores[top]
+        order = np.argsort(-candidate_scores, kind="stable")
+        order = order[candidate_scores[order] > 0.0]
+        ranked, top_scores = candidates[order], candidate_scores[order]
+
+        # coverage, for the ranked documents only: postings are sorted by document number
+        matched = np.zeros(len(ranked))
+        for docs, _, idf in scored:
+            positions = np.minimum(np.searchsorted(docs, ranked), len(docs) - 1)
+            matched += np.where(docs[positions] == ranked, idf, 0.0)
+        return [
+            self._documents[doc] + (float(score), float(share / total_idf) if total_idf else 0.0)
+            for doc, score, share in zip(ranked.tolist(), top_scores.tolist(), matched.tolist())
+        ]
+
+    def __len__(self):
+        with self._lock:
+            return self.live_count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "graphs": self.live_count,
+                "documents": len(self._documents),
+                "tombstoned": len(self._dead),
+                "terms": len(self._postings),
+            }
+
+
+def matching_nodes(nodes, query, limit=5):
+    """
+    Returns the nodes whose label or type shares a term with the query, those matching
+    the most query terms first.
+    """
+    terms = set(tokenize(query))
+    scored = []
+    for position, node in enumerate(nodes):
+        hits = len(terms.intersection(tokenize(node.get("label"))) | terms.intersection(tokenize(node.get("type"))))
+        if hits:
+            scored.append((-hits, position, node))
+    scored.sort(key=lambda item: item[:2])
+    return [{"id": node["id"], "label": node["label"], "type": node.get("type")} for _, _, node in scored[:limit]]
+
+
+def search_index_from_env():
+    """
+    Creates the search index configured through SEARCH_BM25_K1 and SEARCH_BM25_B.
+    """
+    return SearchIndex(k1=float(os.getenv("SEARCH_BM25_K1", "1.2")), b=float(os.getenv("SEARCH_BM25_B", "0.75")))
@@ -2,11 +2,14 @@ const calcNodeWidth = (label) => Math.max(50, label.length * 8) + "px";
 const form = document.getElementById("inputForm");
 const load = document.getElementById("load");
 
+// Accept header asking graph endpoints for the compact wire format (see wire.py)
+const COMPACT_MEDIA_TYPE = "application/vnd.instagraph.compact+json";
+
 // General purpose post func
-async function postData(url, data = {}) {
+async function postData(url, data = {}, headers = {}) {
   const response = await fetch(url, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers: { "Content-Type": "application/json", ...headers },
     body: JSON.stringify(data),
   });
   console.log("---- postData ----");
@@ -18,54 +21,97 @@ async function postData(url, data = {}) {
   return await response.json();
 }
 
+// decode one compact graph into Cytoscape elements, using the palette and strings of its response.
+function decodeElements(graph, palette, strings) {
+  const { ids, nodes, edges } = graph;
+  return {
+    nodes: nodes.label.map((label, i) => {
+      const element = {
+        data: { id: ids[i], label: label, color: palette[nodes.color[i]] },
+      };
+      if (nodes.x && nodes.x[i] !== null)
+        element.position = { x: nodes.x[i], y: nodes.y[i] };
+      return element;
+    }),
+    edges: edges.source.map((source, i) => ({
+      data: {
+        source: ids[source],
+        target: ids[edges.target[i]],
+        label: strings[edges.label[i]],
+        color: palette[edges.color[i]],
+        direction: strings[edges.direction[i]],
+      },
+    })),
+  };
+}
+
+// turn a compact graph response back into the {elements, meta} shape, others pass through.
+function decodeGraphResponse(data) {
+  if (data.format !== "compact-1") return data;
+  const { format, palette, strings, elements, ...rest } = data;
+  return { ...rest, elements: decodeElements(elements, palette, strings) };
+}
+
+// Cytoscape instance currently shown in the cy div.
+let cy = null;
+
+const graphStyle = [
+  {
+    selector: "node",
+    style: {
+      "background-color": "data(color)",
+      label: "data(label)",
+      "text-valign": "center",
+      "text-halign": "center",
+      shape: "rectangle",
+      height: "50px",
+      width: (ele) => calcNodeWidth(ele.data("label")),
+      color: function (ele) {
+        return getTextColor(ele.data("color"));
+      },
+      "font-size": "12px",
+    },
+  },
+  {
+    selector: "edge",
+    style: {
+      width: 3,
+      "line-color": "data(color)",
+      "target-arrow-color": "data(color)",
+      "target-arrow-shape": "triangle",
+      label: "data(label)",
+      "curve-style": "unbundled-bezier",
+      "line-dash-pattern": [4, 4],
+      "text-background-color": "#ffffff",
+      "text-background-opacity": 1,
+      "text-background-shape": "rectangle",
+      "font-size": "10px",
+    },
+  },
+];
+
+const graphLayout = {
+  name: "cose",
+  fit: true,
+  padding: 30,
+  avoidOverlap: true,
+};
+
 // create Graph in cy div.
 async function createGraph(data) {
   const descriptionElement = document.getElementById("graphDescription");
   descriptionElement.innerText = data.meta.description;
 
-  cytoscape({
+  // positions precomputed by the server avoid running cose in the browser
+  const hasPositions =
+    data.elements.nodes.length > 0 &&
+    data.elements.nodes.every((node) => node.position);
+
+  cy = cytoscape({
     container: document.getElementById("cy"),
     elements: data.elements,
-    style: [
-      {
-        selector: "node",
-        style: {
-          "background-color": "data(color)",
-          label: "data(label)",
-          "text-valign": "center",
-          "text-halign": "center",
-          shape: "rectangle",
-          height: "50px",
-          width: (ele) => calcNodeWidth(ele.data("label")),
-          color: function (ele) {
-            return getTextColor(ele.data("color"));
-          },
-          "font-size": "12px",
-        },
-      },
-      {
-        selector: "edge",
-        style: {
-          width: 3,
-          "line-color": "data(color)",
-          "target-arrow-color": "data(color)",
-          "target-arrow-shape": "triangle",
-          label: "data(label)",
-          "curve-style": "unbundled-bezier",
-          "line-dash-pattern": [4, 4],
-          "text-background-color": "#ffffff",
-          "text-background-opacity": 1,
-          "text-background-shape": "rectangle",
-          "font-size": "10px",
-        },
-      },
-    ],
-    layout: {
-      name: "cose",
-      fit: true,
-      padding: 30,
-      avoidOverlap: true,
-    },
+    style: graphStyle,
+    layout: hasPositions ? { name: "preset", fit: true, padding: 30 } : graphLayout,
 
     ready: function () {
       this.fit(); // Fits all elements in the viewport
@@ -73,6 +119,139 @@ async function createGraph(data) {
       this.center(); // Centers the graph in the viewport
     },
   });
+  cy.data("meta", data.meta);
+  cy.on("dbltap", "node", handleNodeExpand);
+}
+
+// extend the shown graph around a double-tapped node, adding only the new elements.
+async function handleNodeExpand(event) {
+  const meta = cy.data("meta");
+  if (!meta) return;
+  const question = window.prompt(
+    `Expand "${event.target.data("label")}" (optionally ask a question):`,
+    ""
+  );
+  if (question === null) return;
+
+  load.style.display = "block";
+  load.classList.add("loading");
+  try {
+    const data = decodeGraphResponse(
+      await postData(
+        `/graphs/${encodeURIComponent(meta.unique_id)}/expand`,
+        { node: event.target.id(), question: question },
+        { Accept: COMPACT_MEDIA_TYPE }
+      )
+    );
+    cy.add([
+      ...data.elements.nodes.map((node) => ({ group: "nodes", ...node })),
+      ...data.elements.edges.map((edge) => ({ group: "edges", ...edge })),
+    ]);
+    cy.data("meta", data.meta);
+  } catch (error) {
+    console.error("Error expanding graph:", error);
+    showError(`Error expanding graph: ${error.message}`);
+  } finally {
+    load.classList.remove("loading");
+  }
+}
+
+// stream a graph from the API, drawing nodes and edges as they arrive.
+async function streamGraph(userInput) {
+  const response = await fetch("/get_response_data/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ user_input: userInput }),
+  });
+  if (!response.ok) throw new Error(await response.text());
+
+  document.getElementById("graphDescription").innerText = "";
+  cy = cytoscape({
+    container: document.getElementById("cy"),
+    elements: [],
+    style: graphStyle,
+  });
+  cy.on("dbltap", "node", handleNodeExpand);
+
+  let layoutPositions = null;
+  // edges can arrive before both of their nodes, keep them until they can be drawn
+  let pendingEdges = [];
+  let layoutTimer = null;
+  const scheduleLayout = () => {
+    if (layoutTimer) return;
+    layoutTimer = setTimeout(() => {
+      layoutTimer = null;
+      cy.layout({ ...graphLayout, animate: false }).run();
+    }, 300);
+  };
+  const addReadyEdges = () => {
+    pendingEdges = pendingEdges.filter((edge) => {
+      if (
+        cy.getElementById(edge.source).empty() ||
+        cy.getElementById(edge.target).empty()
+      )
+        return true;
+      cy.add({ group: "edges", data: edge });
+      return false;
+    });
+  };
+
+  const handleEvent = (event) => {
+    switch (event.type) {
+      case "description":
+        document.getElementById("graphDescription").innerText = event.data;
+        break;
+      case "node":
+        cy.add({ group: "nodes", data: event.data });
+        addReadyEdges();
+        scheduleLayout();
+        break;
+      case "edge":
+        pendingEdges.push(event.data);
+        addReadyEdges();
+        scheduleLayout();
+        break;
+      case "layout":
+        layoutPositions = event.data;
+        break;
+      case "meta":
+        document.getElementById("graphDescription").innerText =
+          event.data.description;
+        cy.data("meta", event.data);
+        break;
+      case "similar_match":
+        // a stored graph matched the input and was sent instead of a new one
+        cy.data("similarMatch", event.data);
+        break;
+      case "error":
+        throw new Error(event.error);
+    }
+  };
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split("\n");
+    buffered = lines.pop();
+    lines.filter((line) => line.trim()).forEach((line) => handleEvent(JSON.parse(line)));
+  }
+  if (buffered.trim()) handleEvent(JSON.parse(buffered));
+
+  clearTimeout(layoutTimer);
+  if (layoutPositions) {
+    cy.layout({
+      name: "preset",
+      positions: (node) => layoutPositions[node.id()],
+      fit: true,
+      padding: 30,
+    }).run();
+  } else {
+    cy.layout(graphLayout).run();
+  }
 }
 
 // figure out the textColor
@@ -85,10 +264,17 @@ function getTextColor(bgColor) {
   return brightness < 40 ? "#ffffff" : "#000000";
 }
 
-// fetch graph history from the API.
+// cursor of the next history page, null once everything is listed.
+let historyCursor = null;
+
+// fetch graph history from the API, metadata only.
 async function fetchGraphHistory() {
+  const graphHistoryDiv = document.getElementById("history");
   try {
-    const response = await fetch("/get_graph_history", {
+    const params = historyCursor
+      ? `?cursor=${encodeURIComponent(historyCursor)}`
+      : "";
+    const response = await fetch(`/graphs${params}`, {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
@@ -100,24 +286,38 @@ async function fetchGraphHistory() {
       return;
     }
 
-    const { graph_history } = await response.json();
+    const { graphs, next_cursor } = await response.json();
+    const offset = graphHistoryDiv.querySelectorAll("[data-unique-id]").length;
 
-    const graphHistoryDiv = document.getElementById("history");
+    graphs.forEach((metadata, index) => {
+      const item = document.createElement("div");
+      item.className = "bg-gray-200 hover:bg-gray-300 p-5 rounded";
+      item.dataset.uniqueId = metadata.unique_id;
+      item.addEventListener("click", handleGraphItemClick);
 
-    graph_history.forEach((item, index) => {
-      const metadata = item.metadata;
-      graphHistoryDiv.innerHTML += `
-                <div class="bg-gray-200 hover:bg-gray-300 p-5 rounded" onclick="handleGraphItemClick(event)" data-item='${JSON.stringify(
-                  item
-                )}'>
-                  <p>${index + 1}. ${metadata.description} <br/>
-                  - Created On: ${metadata.created_on} <br/>
-                  - Last Updated On: ${metadata.last_updated_on}</p>
-                </div>`;
+      const text = document.createElement("p");
+      text.innerText =
+        `${offset + index + 1}. ${metadata.description}\n` +
+        `- ${metadata.node_count} nodes, ${metadata.edge_count} edges\n` +
+        `- Created On: ${metadata.created_on}\n` +
+        `- Last Updated On: ${metadata.last_updated_on}`;
+      item.appendChild(text);
+      graphHistoryDiv.appendChild(item);
     });
+
+    historyCursor = next_cursor;
+    const loadMore = document.getElementById("history-more");
+    if (loadMore) loadMore.remove();
+    if (historyCursor) {
+      const button = document.createElement("button");
+      button.id = "history-more";
+      button.className = "w-full py-2 px-4 bg-blue-500 text-white rounded";
+      button.innerText = "Load more";
+      button.addEventListener("click", fetchGraphHistory);
+      graphHistoryDiv.appendChild(button);
+    }
   } catch (error) {
     console.error("Error fetching graph history:", error);
-    const graphHistoryDiv = document.getElementById("history");
     graphHistoryDiv.innerHTML += `<p> Error fetching graph history: ${error}<p>`;
     return;
   }
@@ -134,82 +334,21 @@ function showError(message) {
   }, 5000);
 }
 
-// draw graph from history.
-function handleGraphItemClick(event) {
-  const graphData = JSON.parse(event.currentTarget.getAttribute("data-item"));
-
-  const transformedData = transformDataToGraphFormat(graphData);
-  // You can also display graphData.graph to the console to see the graph elements
-  console.log("Transformed graph data:", transformedData);
-  createGraph(transformedData);
-}
-
-function transformDataToGraphFormat(graphData) {
-  /**
-   * Transforms the graph history data to a format suitable for creating a graph using the createGraph function.
-   *
-   * @author shepherd-06
-   **/
-
-  const elements = {
-    edges: [],
-    nodes: [],
-  };
-
-  // Using a Set to ensure that nodes are unique
-  const uniqueNodes = new Set();
-
-  graphData.graph.forEach((item) => {
-    // Add edge
-    elements.edges.push({
-      data: {
-        color: item.relationship.color,
-        label: item.relationship.type,
-        source: item.from.id,
-        target: item.to.id,
-      },
+// draw graph from history, fetching its elements on demand.
+async function handleGraphItemClick(event) {
+  const uniqueId = event.currentTarget.dataset.uniqueId;
+  try {
+    const response = await fetch(`/graphs/${encodeURIComponent(uniqueId)}`, {
+      headers: { Accept: COMPACT_MEDIA_TYPE },
     });
-
-    // Add nodes only if they are unique
-    if (!uniqueNodes.has(item.from.id)) {
-      elements.nodes.push({
-        data: {
-          id: item.from.id,
-          label: item.from.label,
-          type: item.from.type,
-          color: item.from.color,
-        },
-      });
-      uniqueNodes.add(item.from.id);
-    }
-
-    if (!uniqueNodes.has(item.to.id)) {
-      elements.nodes.push({
-        data: {
-          id: item.to.id,
-          label: item.to.label,
-          type: item.to.type,
-          color: item.to.color,
-        },
-      });
-      uniqueNodes.add(item.to.id);
-    }
-  });
-
-  const meta = {
-    unique_id: graphData.metadata.unique_id,
-    description: graphData.metadata.description,
-    createdOn: graphData.metadata.created_on,
-    lastUpdatedOn: graphData.metadata.last_updated_on,
-  };
-
-  return {
-    elements,
-    meta,
-  };
+    if (!response.ok) throw new Error(await response.text());
+    createGraph(decodeGraphResponse(await response.json()));
+  } catch (error) {
+    console.error("Error fetching graph:", error);
+    showError(`Error fetching graph: ${error.message}`);
+  }
 }
 
-
 // Event listener for the form submission
 function handleFormSubmit(e) {
   e.preventDefault(); // Prevent form submission
@@ -219,31 +358,16 @@ function handleFormSubmit(e) {
   load.style.display = "block"; // show the load div
   load.classList.add("loading");
 
-  fetch("/get_response_data", {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-    },
-    body: JSON.stringify({ user_input: userInput }),
-  })
-    .then((response) => {
-      if (!response.ok) {
-        return response.text().then((text) => {
-          throw new Error(text);
-        });
-      }
-      return response.json();
-    })
-    .then((data) => {
+  streamGraph(userInput)
+    .then(() => {
       // Remove the loading class to stop the animation
       load.classList.remove("loading");
-      // Call createGraph with the data received
-      createGraph(data);
     })
     .catch((error) => {
       // Remove the loading class if there's an error
       load.classList.remove("loading");
       console.error("Fetch Error:", error);
+      showError(error.message);
     });
 }
 
@@ -0,0 +1,514 @@
+import os
+import sqlite3
+import threading
+
+import persistence
+from metrics import timed
+from persistence import decode_cursor, encode_cursor, graph_params
+
+
+class Neo4jStorage:
+    """
+    Graph storage in Neo4j, through the queries in persistence.py.
+
+    Parameters:
+    driver: The Neo4j driver.
+    """
+
+    name = "Neo4j"
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def ensure_schema(self):
+        persistence.ensure_schema(self.driver)
+
+    def save_graph(self, meta, graph):
+        persistence.save_graph(self.driver, meta, graph)
+
+    def merge_graph_delta(self, unique_id, merge, last_updated_on):
+        return persistence.merge_graph_delta(self.driver, unique_id, merge, last_updated_on)
+
+    def graph_version(self, unique_id):
+        return persistence.graph_version(self.driver, unique_id)
+
+    def save_graphs(self, entries, batch_size=5000):
+        return persistence.save_graphs(self.driver, entries, batch_size)
+
+    def save_layout(self, unique_id, graph):
+        persistence.save_layout(self.driver, unique_id, graph)
+
+    def fetch_graph(self, unique_id):
+        return persistence.fetch_graph(self.driver, unique_id)
+
+    def fetch_graph_nodes(self, unique_ids):
+        return persistence.fetch_graph_nodes(self.driver, unique_ids)
+
+    def fetch_graph_history(self, limit=10, cursor=None):
+        return persistence.fetch_graph_history(self.driver, limit, cursor)
+
+    def fetch_graph_index(self, limit=10, cursor=None):
+        return persistence.fetch_graph_index(self.driver, limit, cursor)
+
+    def iter_corpus_edges(self):
+        return persistence.iter_corpus_edges(self.driver)
+
+    def corpus_version(self):
+        return persistence.corpus_version(self.driver)
+
+    def iter_search_documents(self, since=None):
+        return persistence.iter_search_documents(self.driver, since)
+
+    def close(self):
+        self.driver.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS graphs (
+    uuid TEXT PRIMARY KEY,
+    description TEXT,
+    created_on TEXT,
+    last_updated_on TEXT NOT NULL,
+    node_count INTEGER NOT NULL,
+    edge_count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS graphs_last_updated_on ON graphs (last_updated_on, uuid);
+
+CREATE TABLE IF NOT EXISTS nodes (
+    graph TEXT NOT NULL,
+    id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    label TEXT,
+    type TEXT,
+    color TEXT,
+    x REAL,
+    y REAL,
+    key TEXT,
+    PRIMARY KEY (graph, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS nodes_key ON nodes (key) WHERE key IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS edges (
+    graph TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    relationship TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    direction TEXT,
+    color TEXT,
+    PRIMARY KEY (graph, source, target, relationship)
+) WITHOUT ROWID;
+"""
+
+# Positions are updated on conflict like the SET on CONTAINS in Neo4j; everything else
+# keeps its first value like MERGE ... ON CREATE SET
+INSERT_NODE = """
+INSERT INTO nodes (graph, id, seq, label, type, color, x, y, key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (graph, id) DO UPDATE SET x = excluded.x, y = excluded.y
+"""
+INSERT_EDGE = """
+INSERT OR IGNORE INTO edges (graph, source, target, relationship, seq, direction, color) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+PAGE_QUERY = """
+SELECT uuid, description, created_on, last_updated_on, node_count, edge_count FROM graphs
+WHERE (last_updated_on, uuid) < (?, ?)
+ORDER BY last_updated_on DESC, uuid DESC
+LIMIT ?
+"""
+
+CORPUS_EDGES_SQL = """
+SELECT coalesce(s.key, e.graph || ':' || e.source), coalesce(t.key, e.graph || ':' || e.target)
+FROM edges e
+JOIN nodes s ON s.graph = e.graph AND s.id = e.source
+JOIN nodes t ON t.graph = e.graph AND t.id = e.target
+"""
+
+
+class SQLiteStorage:
+    """
+    Embedded graph storage in a SQLite file, for deployments without Neo4j. It keeps the
+    same data as Neo4jStorage (graph metadata, graph-scoped nodes with their positions and
+    entity keys, deduplicated relationships) and returns the same shapes.
+
+    The database runs in WAL mode, so readers never wait on the single writer, and every
+    graph or batch of graphs is written in one transaction with executemany. History
+    pages are an index range scan on (last_updated_on, uuid) followed by one query for the
+    nodes and one for the edges of the whole page. Each thread keeps its own connection.
+
+    Parameters:
+    path (str): Path of the SQLite file, created if missing.
+    """
+
+    name = "SQLite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.ensure_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit mode, transactions are opened explicitly
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=OFF")
+            self._local.conn = conn
+        return conn
+
+    def ensure_schema(self):
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SQLITE_SCHEMA)
+
+    def _write(self, write):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = write(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _read(self, read):
+        # one snapshot for all the queries of a read
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            return read(conn)
+        finally:
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _insert_content(conn, params, node_offset=0, edge_offset=0):
+        uuid = params["uuid"]
+        conn.executemany(INSERT_NODE, [
+            (uuid, node["id"], node_offset + i, node["label"], node["type"], node["color"],
+             node["x"], node["y"], node["key"])
+            for i, node in enumerate(params["nodes"])
+        ])
+        conn.executemany(INSERT_EDGE, [
+            (uuid, edge["from"], edge["to"], edge["relationship"], edge_offset + i, edge["direction"], edge["color"])
+            for i, edge in enumerate(params["edges"])
+        ])
+
+    @classmethod
+    def _insert_graphs(cls, conn, graphs):
+        conn.executemany(
+            "INSERT INTO graphs (uuid, description, created_on, last_updated_on, node_count, edge_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (params["uuid"], params["description"], params["createdOn"], params["lastUpdatedOn"],
+                 len(params["nodes"]), len(params["edges"]))
+                for params in graphs
+            ],
+        )
+        for params in graphs:
+            cls._insert_content(conn, params)
+
+    @timed("sqlite_save_graph")
+    def save_graph(self, meta, graph):
+        """
+        Writes one graph, its nodes and its relationships in a single transaction.
+        """
+        params = graph_params(meta, graph)
+        self._write(lambda conn: self._insert_graphs(conn, [params]))
+
+    @timed("sqlite_merge_graph_delta")
+    def merge_graph_delta(self, unique_id, merge, last_updated_on):
+        """
+        Extends a stored graph in a single transaction, with the same parameters and result
+        as persistence.merge_graph_delta. The transaction takes SQLite's write lock before
+        reading the graph, so expansions in different processes are serialized and each
+        merges against the nodes the previous one added.
+        """
+        def write(conn):
+            loaded = self._load(conn, unique_id)
+            if loaded is None:
+                return None
+            graph, meta = loaded
+            added = merge(graph)
+            if added["nodes"] or added["edges"]:
+                meta = {**meta, "lastUpdatedOn": last_updated_on}
+                params = graph_params(meta, added)
+                conn.execute(
+                    "UPDATE graphs SET last_updated_on = ?, node_count = ?, edge_count = ? WHERE uuid = ?",
+                    (last_updated_on, len(graph["nodes"]) + len(added["nodes"]),
+                     len(graph["edges"]) + len(added["edges"]), unique_id),
+                )
+                self._insert_content(conn, params, node_offset=len(graph["nodes"]), edge_offset=len(graph["edges"]))
+            return graph, meta, added
+
+        return self._write(write)
+
+    def graph_version(self, unique_id):
+        """
+        Returns the lastUpdatedOn of a stored graph, or None if no graph has the unique_id.
+        """
+        row = self._connection().execute(
+            "SELECT last_updated_on FROM graphs WHERE uuid = ?", (unique_id,)).fetchone()
+        return row[0] if row else None
+
+    @timed("sqlite_save_graphs")
+    def save_graphs(self, entries, batch_size=5000):
+        """
+        Bulk-imports many graphs in transactions of roughly batch_size nodes plus edges.
+
+        Returns:
+        int: The number of graphs written.
+        """
+        written = 0
+        batch = []
+        batch_elements = 0
+        for meta, graph in entries:
+            params = graph_params(meta, graph)
+            batch.append(params)
+            batch_elements += 1 + len(params["nodes"]) + len(params["edges"])
+            if batch_elements >= batch_size:
+                self._write(lambda conn: self._insert_graphs(conn, batch))
+                written += len(batch)
+                batch = []
+                batch_elements = 0
+        if batch:
+            self._write(lambda conn: self._insert_graphs(conn, batch))
+            written += len(batch)
+        return written
+
+    @timed("sqlite_save_layout")
+    def save_layout(self, unique_id, graph):
+        """
+        Persists the node positions of a graph computed after it was stored.
+        """
+        positions = [
+            (node["position"]["x"], node["position"]["y"], unique_id, node["id"])
+            for node in graph["nodes"] if "position" in node
+        ]
+        self._write(lambda conn: conn.executemany("UPDATE nodes SET x = ?, y = ? WHERE graph = ? AND id = ?", positions))
+
+    @staticmethod
+    def _page_content(conn, uuids):
+        # one query for the nodes and one for the edges of every graph on the page
+        placeholders = ",".join("?" * len(uuids))
+        nodes = conn.execute(
+            "SELECT graph, id, label, type, color, x, y FROM nodes WHERE graph IN ({}) ORDER BY graph, seq".format(
+                placeholders), uuids).fetchall()
+        edges = conn.execute(
+            "SELECT graph, source, target, relationship, direction, color FROM edges WHERE graph IN ({}) "
+            "ORDER BY graph, seq".format(placeholders), uuids).fetchall()
+        return nodes, edges
+
+    @staticmethod
+    def _meta(row):
+        return {"unique_id": row[0], "description": row[1], "createdOn": row[2], "lastUpdatedOn": row[3]}
+
+    @timed("sqlite_fetch_graph")
+    def fetch_graph(self, unique_id):
+        """
+        Fetches one stored graph.
+
+        Returns:
+        tuple: (graph, meta) in the shapes used by the graph store, or None if no graph has
+        the unique_id.
+        """
+        return self._read(lambda conn: self._load(conn, unique_id))
+
+    @timed("sqlite_fetch_graph_nodes")
+    def fetch_graph_nodes(self, unique_ids):
+        """
+        Fetches the nodes (id, label and type only) of several stored graphs in one query.
+
+        Returns:
+        dict: {unique_id: [node dicts]} for the graphs that exist.
+        """
+        unique_ids = list(unique_ids)
+        rows = self._connection().execute(
+            "SELECT graph, id, label, type FROM nodes WHERE graph IN ({}) ORDER BY graph, seq".format(
+                ",".join("?" * len(unique_ids))), unique_ids).fetchall()
+        nodes = {}
+        for graph, node_id, label, node_type in rows:
+            nodes.setdefault(graph, []).append({"id": node_id, "label": label, "type": node_type})
+        return nodes
+
+    @classmethod
+    def _load(cls, conn, unique_id):
+        row = conn.execute(
+            "SELECT uuid, description, created_on, last_updated_on FROM graphs WHERE uuid = ?",
+            (unique_id,)).fetchone()
+        if row is None:
+            return None
+        node_rows, edge_rows = cls._page_content(conn, [unique_id])
+        nodes = []
+        for _, node_id, label, node_type, color, x, y in node_rows:
+            node = {"id": node_id, "label": label, "type": node_type, "color": color}
+            if x is not None and y is not None:
+                node["position"] = {"x": x, "y": y}
+            nodes.append(node)
+        edges = [
+            {"from": source, "to": target, "relationship": relationship, "direction": direction, "color": color}
+            for _, source, target, relationship, direction, color in edge_rows
+        ]
+        return {"nodes": nodes, "edges": edges}, cls._meta(row)
+
+    @timed("sqlite_fetch_graph_history")
+    def fetch_graph_history(self, limit=10, cursor=None):
+        """
+        Fetches one page of graphs, most recently updated first, with each graph's
+        relationships, in the shape returned by persistence.fetch_graph_history.
+        """
+        before, before_uuid = decode_cursor(cursor)
+
+        def read(conn):
+            rows = conn.execute(PAGE_QUERY, (before, before_uuid, limit)).fetchall()
+            return rows, self._page_content(conn, [row[0] for row in rows]) if rows else ([], [])
+
+        rows, (node_rows, edge_rows) = self._read(read)
+        nodes = {
+            (graph, node_id): {"id": node_id, "label": label, "type": node_type, "color": color}
+            for graph, node_id, label, node_type, color, _, _ in node_rows
+        }
+        relationships = {row[0]: [] for row in rows}
+        for graph, source, target, relationship, direction, color in edge_rows:
+            if (graph, source) in nodes and (graph, target) in nodes:
+                relationships[graph].append({
+                    "from": nodes[(graph, source)],
+                    "to": nodes[(graph, target)],
+                    "relationship": {"type": relationship, "direction": direction, "color": color},
+                })
+        graph_history = [
+            {
+                "metadata": {
+                    "description": row[1],
+                    "last_updated_on": row[3],
+                    "created_on": row[2],
+                    "unique_id": row[0],
+                },
+                "graph": relationships[row[0]],
+            }
+            for row in rows
+        ]
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+        return graph_history, next_cursor
+
+    @timed("sqlite_fetch_graph_index")
+    def fetch_graph_index(self, limit=10, cursor=None):
+        """
+        Fetches one page of graph metadata, in the shape returned by
+        persistence.fetch_graph_index.
+        """
+        before, before_uuid = decode_cursor(cursor)
+        rows = self._connection().execute(PAGE_QUERY, (before, before_uuid, limit)).fetchall()
+        graphs = [
+            {
+                "unique_id": uuid,
+                "description": description,
+                "created_on": created_on,
+                "last_updated_on": last_updated_on,
+                "node_count": node_count,
+                "edge_count": edge_count,
+            }
+            for uuid, description, created_on, last_updated_on, node_count, edge_count in rows
+        ]
+        next_cursor = None
+        if len(graphs) == limit:
+            next_cursor = encode_cursor(graphs[-1]["last_updated_on"], graphs[-1]["unique_id"])
+        return graphs, next_cursor
+
+    def iter_corpus_edges(self):
+        """
+        Streams (source, target) for every relationship, identifying nodes by their entity
+        key where they have one. Uses its own connection so the cursor can be consumed on
+        any thread.
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield from conn.execute(CORPUS_EDGES_SQL)
+        finally:
+            conn.close()
+
+    def iter_search_documents(self, since=None):
+        """
+        Streams (meta, nodes) for every stored graph, or only for those updated at or after
+        since (a lastUpdatedOn timestamp), with the node labels and types only. All graphs
+        and their nodes are both read in uuid order and merged, so memory stays flat.
+        """
+        if since is not None:
+            # recently updated graphs are few, read them in one snapshot
+            def read(conn):
+                return [
+                    ({"unique_id": uuid, "description": description, "lastUpdatedOn": last_updated_on},
+                     [{"label": label, "type": type_} for label, type_ in conn.execute(
+                         "SELECT label, type FROM nodes WHERE graph = ? ORDER BY seq", (uuid,))])
+                    for uuid, description, last_updated_on in conn.execute(
+                        "SELECT uuid, description, last_updated_on FROM graphs WHERE last_updated_on >= ?"
+                        " ORDER BY last_updated_on, uuid", (since,)).fetchall()
+                ]
+
+            yield from self._read(read)
+            return
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            nodes = conn.execute("SELECT graph, label, type FROM nodes ORDER BY graph")
+            pending = next(nodes, None)
+            for uuid, description, last_updated_on in conn.cursor().execute(
+                    "SELECT uuid, description, last_updated_on FROM graphs ORDER BY uuid"):
+                graph_nodes = []
+                # nodes of graphs deleted meanwhile sort before and are skipped
+                while pending is not None and pending[0] <= uuid:
+                    if pending[0] == uuid:
+                        graph_nodes.append({"label": pending[1], "type": pending[2]})
+                    pending = next(nodes, None)
+                yield {"unique_id": uuid, "description": description, "lastUpdatedOn": last_updated_on}, graph_nodes
+        finally:
+            conn.close()
+
+    @timed("sqlite_corpus_version")
+    def corpus_version(self):
+        graphs, last_updated_on = self._connection().execute(
+            "SELECT count(*), max(last_updated_on) FROM graphs").fetchone()
+        return "{}|{}".format(graphs, last_updated_on)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def storage_class_from_env(neo4j_driver=None):
+    """
+    Returns the storage class configured through STORAGE_BACKEND: Neo4jStorage for
+    "neo4j" (needs the driver), SQLiteStorage for "sqlite" or None for "memory" (graphs
+    live only in the graph store). The default, "auto", uses Neo4j when a driver is given
+    and SQLite otherwise. Nothing is opened or created.
+    """
+    backend = os.getenv("STORAGE_BACKEND", "auto").lower()
+    if backend == "memory":
+        return None
+    if backend == "neo4j" or (backend == "auto" and neo4j_driver is not None):
+        if neo4j_driver is None:
+            raise ValueError("STORAGE_BACKEND=neo4j needs NEO4J_URL, NEO4J_USERNAME and NEO4J_PASSWORD")
+        return Neo4jStorage
+    if backend in ("sqlite", "auto"):
+        return SQLiteStorage
+    raise ValueError("Unknown STORAGE_BACKEND: {}".format(backend))
+
+
+def storage_from_env(neo4j_driver=None):
+    """
+    Returns the graph storage configured through STORAGE_BACKEND (see
+    storage_class_from_env), with SQLite in the file at SQLITE_DB_PATH, or None for
+    "memory". The schema is set up here, and a SQLite file created if missing.
+    """
+    storage_class = storage_class_from_env(neo4j_driver)
+    if storage_class is Neo4jStorage:
+        storage = Neo4jStorage(neo4j_driver)
+        storage.ensure_schema()
+        return storage
+    if storage_class is SQLiteStorage:
+        return SQLiteStorage(os.getenv("SQLITE_DB_PATH") or "instagraph.db")
+    return None
@@ -0,0 +1,92 @@
+import json
+
+from pydantic import ValidationError
+
+from models import Edge, Metadata, Node
+
+# Top-level keys of the KnowledgeGraph arguments whose array items are emitted one by one
+ITEM_MODELS = {"nodes": Node, "edges": Edge}
+
+
+class KnowledgeGraphStreamParser:
+    """
+    Incrementally parses the JSON arguments of a streamed KnowledgeGraph function call.
+
+    OpenAI streams the arguments as arbitrary text fragments. The parser scans each fragment
+    once, tracking string and nesting state, and reports every Node, Edge and the Metadata
+    as soon as its closing brace arrives, long before the whole graph is complete.
+
+    Example:
+    >>> parser = KnowledgeGraphStreamParser()
+    >>> parser.feed('{"nodes": [{"id": "1", "label": "A", "type": "t", "color": "#fff"}')
+    [('node', Node(id='1', label='A', type='t', color='#fff', properties={}))]
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._item_start = None
+
+    def feed(self, text):
+        """
+        Consumes the next fragment and returns the list of (kind, model) events it completed,
+        where kind is "node", "edge" or "metadata".
+        """
+        self.buffer += text
+        events = []
+        buffer = self.buffer
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = buffer[self._string_start:pos]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos + 1
+            elif char == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif char in "{[":
+                if char == "{" and self._is_item_start():
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._item_start is not None and self._is_item_start():
+                    event = self._parse_item(buffer[self._item_start:pos + 1])
+                    if event is not None:
+                        events.append(event)
+                    self._item_start = None
+        self._pos = len(buffer)
+        return events
+
+    def _is_item_start(self):
+        # Items of "nodes"/"edges" live at depth 2 (root object, then array),
+        # the metadata object directly under the root at depth 1.
+        if self._key in ITEM_MODELS:
+            return self._depth == 2
+        return self._key == "metadata" and self._depth == 1
+
+    def _parse_item(self, raw):
+        try:
+            data = json.loads(raw)
+            if self._key == "metadata":
+                return "metadata", Metadata.model_validate(data)
+            return self._key[:-1], ITEM_MODELS[self._key].model_validate(data)
+        except (ValueError, ValidationError) as e:
+            # Incomplete items are left to the validation of the full graph
+            print("Skipping unparsable streamed {} item: {}".format(self._key, e))
+            return None
@@ -0,0 +1,136 @@
+import threading
+
+from chunking import estimate_tokens, extract_graph_chunked, merge_delta, merge_graphs, split_into_chunks
+from models import KnowledgeGraph
+
+METADATA = {"createdDate": "2024-01-01", "lastUpdated": "2024-01-01", "description": "test"}
+
+
+def node(node_id, label, node_type="Thing", **properties):
+    return {"id": node_id, "label": label, "type": node_type, "color": "#FFFFFF", "properties": properties}
+
+
+def edge(source, target, relationship):
+    return {"from": source, "to": target, "relationship": relationship, "direction": "forward", "color": "#000000"}
+
+
+def graph(nodes, edges=(), description="test"):
+    return KnowledgeGraph.model_validate(
+        {"metadata": dict(METADATA, description=description), "nodes": list(nodes), "edges": list(edges)})
+
+
+def paragraph(i, words=30):
+    return " ".join("p{}w{}".format(i, j) for j in range(words)) + "."
+
+
+def test_short_text_is_one_chunk():
+    text = "First paragraph.\n\nSecond paragraph."
+    assert split_into_chunks(text, 1000) == [text]
+
+
+def test_chunks_break_on_paragraphs_within_budget():
+    paragraphs = [paragraph(i) for i in range(20)]
+    budget = estimate_tokens(paragraph(0)) * 3 + 3
+    chunks = split_into_chunks("\n\n".join(paragraphs), budget)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= budget for chunk in chunks)
+    # every paragraph is kept whole and in order
+    assert [p for chunk in chunks for p in chunk.split("\n\n")] == paragraphs
+
+
+def test_oversized_paragraph_breaks_on_sentences():
+    sentences = ["Sentence {} {}.".format(i, " ".join(["word"] * 20)) for i in range(10)]
+    budget = estimate_tokens(sentences[0]) * 2 + 2
+    chunks = split_into_chunks(" ".join(sentences), budget)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= budget for chunk in chunks)
+    assert " ".join(chunk.replace("\n\n", " ") for chunk in chunks) == " ".join(sentences)
+
+
+def test_oversized_sentence_breaks_on_words():
+    words = ["w{}".format(i) for i in range(400)]
+    chunks = split_into_chunks(" ".join(words), 50)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).replace("\n\n", " ").split() == words
+
+
+def test_merge_graphs_renumbers_and_merges_duplicate_nodes():
+    first = graph([node("a", "Marie Curie", "Person", born="1867"), node("b", "Radium")],
+                  [edge("a", "b", "discovered")], description="first")
+    second = graph([node("1", "marie  curie!", "Scientist", died="1934"), node("2", "Polonium")],
+                   [edge("1", "2", "discovered"), edge("1", "2", "Discovered"), edge("1", "9", "knows")],
+                   description="second")
+    merged = merge_graphs([first, second])
+
+    assert [(n.id, n.label, n.type) for n in merged.nodes] == [
+        ("1", "Marie Curie", "Person"), ("2", "Radium", "Thing"), ("3", "Polonium", "Thing")]
+    # later occurrences only fill in missing properties
+    assert merged.nodes[0].properties == {"born": "1867", "died": "1934"}
+    # edges are remapped, deduplicated by normalized relationship, and dangling ones dropped
+    assert [(e.from_, e.to, e.relationship) for e in merged.edges] == [("1", "2", "discovered"), ("1", "3", "discovered")]
+    assert merged.metadata.description == "first"
+    # the inputs are not modified
+    assert [n.id for n in first.nodes] == ["a", "b"]
+    assert second.nodes[0].properties == {"died": "1934"}
+
+
+def test_merge_delta_remaps_ids_onto_the_existing_graph():
+    existing = {
+        "nodes": [node("1", "Marie Curie"), node("2", "Radium"), node("x", "Paris")],
+        "edges": [edge("1", "2", "discovered")],
+    }
+    delta = graph(
+        [node("1", "Marie Curie"), node("a", "radium"), node("b", "Nobel Prize"), node("c", "Warsaw")],
+        [edge("1", "a", "Discovered"), edge("1", "b", "won"), edge("c", "x", "near"), edge("b", "zzz", "unknown")])
+    result = merge_delta(existing, delta)
+
+    # matching labels resolve to existing ids, new nodes continue after the highest numeric id
+    assert [(n["id"], n["label"]) for n in result["nodes"]] == [("3", "Nobel Prize"), ("4", "Warsaw")]
+    assert [(e["from"], e["to"], e["relationship"]) for e in result["edges"]] == [("1", "3", "won"), ("4", "x", "near")]
+    # the graph itself is left alone
+    assert len(existing["nodes"]) == 3 and len(existing["edges"]) == 1
+
+
+def test_extract_graph_chunked_merges_chunks_in_document_order():
+    paragraphs = ["{} meets {}. {}".format(a, b, paragraph(i)) for i, (a, b) in
+                  enumerate([("Alice", "Bob"), ("Bob", "Carol"), ("Carol", "Alice"), ("Dave", "Bob")])]
+    budget = max(estimate_tokens(p) for p in paragraphs) + 1
+    calls = []
+    lock = threading.Lock()
+
+    def extract(chunk):
+        # stands in for the model: one edge between the two names the chunk starts with
+        with lock:
+            calls.append(chunk)
+        first, _, rest = chunk.partition(" meets ")
+        second = rest.split(".")[0]
+        return graph([node("1", first), node("2", second)], [edge("1", "2", "meets")], description=first)
+
+    merged = extract_graph_chunked("\n\n".join(paragraphs), extract, budget, max_workers=3)
+    assert sorted(calls) == sorted(paragraphs)
+    assert [n.label for n in merged.nodes] == ["Alice", "Bob", "Carol", "Dave"]
+    assert [(e.from_, e.to) for e in merged.edges] == [("1", "2"), ("2", "3"), ("3", "1"), ("4", "2")]
+    assert merged.metadata.description == "Alice"
+
+
+def test_extract_graph_chunked_single_chunk_is_not_merged():
+    single = graph([node("a", "Alice")])
+    assert extract_graph_chunked("Alice.", lambda chunk: single, 1000) is single
+
+
+def test_merge_delta_renumbers_ids_outside_the_context():
+    existing = {
+        "nodes": [node("1", "Marie Curie"), node("2", "Radium"), node("3", "Paris")],
+        "edges": [edge("1", "2", "discovered")],
+    }
+    # the model was shown nodes 1 and 2 only, so its "3" is a new node, not Paris
+    delta = graph([node("3", "Nobel Prize")],
+                  [edge("1", "3", "won"), edge("2", "3", "mentioned in"), edge("1", "3", "born near")])
+    result = merge_delta(existing, delta, context_ids={"1", "2"})
+
+    assert [(n["id"], n["label"]) for n in result["nodes"]] == [("4", "Nobel Prize")]
+    assert [(e["from"], e["to"]) for e in result["edges"]] == [("1", "4"), ("2", "4"), ("1", "4")]
+    # an edge to a node outside the context that the delta does not define is dropped
+    delta = graph([], [edge("1", "3", "born near")])
+    assert merge_delta(existing, delta, context_ids={"1", "2"})["edges"] == []
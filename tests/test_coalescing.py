@@ -0,0 +1,124 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import generation
+from clients import LazyClient
+from limits import UpstreamBusyError
+from ratelimit import Coalescer
+
+
+def test_run_shares_the_leaders_result():
+    coalescer = Coalescer()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "graph"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(coalescer.run("key", compute)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(coalescer.run("key", compute)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ["graph", "graph"]
+    assert calls == [1]
+    assert len(coalescer) == 0
+
+
+def test_followers_give_up_after_max_wait():
+    coalescer = Coalescer(max_wait=0.1)
+    future, leader = coalescer.claim("key")
+    assert leader
+    started = time.monotonic()
+    with pytest.raises(UpstreamBusyError):
+        coalescer.run("key", lambda: "never called")
+    assert time.monotonic() - started < 1.0
+    coalescer.resolve("key", future, "graph")
+
+
+def test_stream_releases_followers_when_the_client_cannot_be_created(monkeypatch):
+    release = threading.Event()
+
+    def create():
+        release.wait(5)
+        raise RuntimeError("no client")
+
+    monkeypatch.setattr(generation, "openai_client", LazyClient("OpenAI", create))
+    monkeypatch.setattr(generation, "coalescer", Coalescer(max_wait=5))
+    user_input = "a graph nobody generated yet {}".format(time.time())
+    errors = []
+
+    def stream():
+        try:
+            list(generation.stream_knowledge_graph(user_input))
+        except Exception as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=stream, daemon=True)
+    leader.start()
+    while not len(generation.coalescer):
+        time.sleep(0.01)
+    follower = threading.Thread(target=stream, daemon=True)
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert not leader.is_alive() and not follower.is_alive()
+    assert [str(e) for e in errors] == ["no client", "no client"]
+    assert len(generation.coalescer) == 0
+
+
+def test_followers_get_an_error_when_the_leader_disconnects(monkeypatch):
+    def create(**kwargs):
+        arguments = ['{"metadata": {"createdDate": "2024-01-01", "lastUpdated": "2024-01-01", '
+                     '"description": "d"}, "nodes": [', '{"id": "1", "label": "A", "type": "t", "color": "#fff"}']
+        for fragment in arguments:
+            yield {"choices": [{"delta": {"function_call": {"arguments": fragment}}}]}
+
+    fake_openai = SimpleNamespace(ChatCompletion=SimpleNamespace(create=create))
+    monkeypatch.setattr(generation, "openai_client", LazyClient("OpenAI", lambda: fake_openai))
+    waiting = threading.Event()
+
+    class WatchedCoalescer(Coalescer):
+        def wait(self, future):
+            waiting.set()
+            return super().wait(future)
+
+    monkeypatch.setattr(generation, "coalescer", WatchedCoalescer(max_wait=5))
+    user_input = "a graph whose client goes away {}".format(time.time())
+    results = []
+    errors = []
+
+    def follow():
+        try:
+            results.append(list(generation.stream_knowledge_graph(user_input)))
+        except BaseException as e:
+            errors.append(e)
+
+    leader = generation.stream_knowledge_graph(user_input)
+    assert next(leader)[0] == "metadata"
+    follower = threading.Thread(target=follow, daemon=True)
+    follower.start()
+    # the follower is waiting on the leader's future
+    waiting.wait(5)
+    time.sleep(0.05)
+    # what Flask does when the client of a streamed response disconnects
+    leader.close()
+    follower.join(5)
+    assert not follower.is_alive()
+    assert results == []
+    assert len(errors) == 1 and isinstance(errors[0], UpstreamBusyError)
+    assert len(generation.coalescer) == 0
@@ -0,0 +1,36 @@
+import threading
+
+from health import Readiness
+
+
+def test_ready_before_a_slow_optional_check_finishes():
+    readiness = Readiness(retry_seconds=0.01)
+    release = threading.Event()
+    # added first, like a cache warm-up registered before the database check
+    readiness.add("warm_up", lambda: release.wait(5), required=False)
+    readiness.add("database", lambda: None)
+    readiness.start()
+    try:
+        assert readiness.wait(1)
+        status = readiness.status()
+        assert status["checks"]["database"]["ok"]
+        assert not status["checks"]["warm_up"]["ok"]
+    finally:
+        release.set()
+
+
+def test_retries_failed_required_checks():
+    readiness = Readiness(retry_seconds=0.01)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("not up yet")
+
+    readiness.add("database", flaky)
+    readiness.start()
+    assert readiness.wait(5)
+    result = readiness.status()["checks"]["database"]
+    assert result["ok"] and result["error"] is None
+    assert result["attempts"] == 3
@@ -0,0 +1,50 @@
+import os
+
+from render import Renderer
+
+
+def write_render(renderer, name, size, mtime):
+    path = renderer.path("{}.svg".format(name * 40))
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evicts_the_oldest_files_over_max_files(tmp_path):
+    renderer = Renderer(str(tmp_path), max_files=3, max_bytes=0)
+    paths = [write_render(renderer, name, 10, 1000 + i) for i, name in enumerate("abcde")]
+    assert renderer.evict() == 2
+    assert [os.path.exists(path) for path in paths] == [False, False, True, True, True]
+
+
+def test_evicts_the_oldest_files_over_max_bytes(tmp_path):
+    renderer = Renderer(str(tmp_path), max_files=0, max_bytes=250)
+    paths = [write_render(renderer, name, 100, 1000 + i) for i, name in enumerate("abc")]
+    assert renderer.evict() == 1
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+
+
+def test_reuse_keeps_a_render(tmp_path):
+    renderer = Renderer(str(tmp_path), max_files=2, max_bytes=0)
+    source = "digraph { a -> b }"
+    render_id = renderer.render_id(source, "svg")
+    with open(renderer.path(render_id), "wb") as f:
+        f.write(b"<svg/>")
+    os.utime(renderer.path(render_id), (1000, 1000))
+    others = [write_render(renderer, name, 10, 2000 + i) for i, name in enumerate("ab")]
+
+    # an existing render is reused, not submitted again, and becomes the most recent file
+    assert renderer.submit(source, "svg") == (render_id, None)
+    assert renderer.evict() == 1
+    assert os.path.exists(renderer.path(render_id))
+    assert [os.path.exists(path) for path in others] == [False, True]
+
+
+def test_ignores_other_files(tmp_path):
+    renderer = Renderer(str(tmp_path), max_files=1, max_bytes=0)
+    (tmp_path / "README").write_text("not a render")
+    (tmp_path / "{}.svg.123.tmp".format("a" * 40)).write_text("in progress")
+    write_render(renderer, "b", 10, 1000)
+    assert renderer.evict() == 0
+    assert len(os.listdir(str(tmp_path))) == 3
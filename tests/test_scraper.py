@@ -0,0 +1,100 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+import scraper
+from scraper import ScrapeError, check_url, fetch_text
+
+PARAGRAPHS = ["Paragraph number {} of the page.".format(i) for i in range(200)]
+PAGE = ("<html><body>" + "".join("<p>{}</p>".format(p) for p in PARAGRAPHS) + "</body></html>").encode()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(1.0)
+        if self.path == "/redirect":
+            self._send(302, headers={"Location": "/page"})
+        elif self.path == "/loop":
+            self._send(302, headers={"Location": "/loop"})
+        elif self.path == "/missing":
+            self._send(404, b"not here")
+        elif self.path == "/json":
+            self._send(200, b'{"p": "not a page"}', {"Content-Type": "application/json"})
+        else:
+            self._send(200, PAGE, {"Content-Type": "text/html; charset=utf-8"})
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def local(monkeypatch):
+    # the fixture server is on loopback, which is refused by default
+    monkeypatch.setattr(scraper, "SCRAPE_ALLOW_PRIVATE_ADDRESSES", True)
+
+
+def test_fetches_paragraph_text(server, local):
+    text = fetch_text(server + "/page")
+    assert text.startswith(PARAGRAPHS[0])
+    assert text.endswith(PARAGRAPHS[-1])
+
+
+def test_reads_at_most_max_bytes(server, local):
+    text = fetch_text(server + "/page", max_bytes=1000)
+    assert PARAGRAPHS[0] in text
+    assert PARAGRAPHS[-1] not in text
+    assert len(text) < 1000
+
+
+def test_times_out(server, local):
+    started = time.monotonic()
+    with pytest.raises(ScrapeError):
+        fetch_text(server + "/slow", timeout=0.2)
+    assert time.monotonic() - started < 1.0
+
+
+def test_rejects_non_html(server, local):
+    with pytest.raises(ScrapeError, match="not an HTML page"):
+        fetch_text(server + "/json")
+
+
+def test_rejects_error_status(server, local):
+    with pytest.raises(ScrapeError, match="status 404"):
+        fetch_text(server + "/missing")
+
+
+def test_follows_redirects_up_to_the_limit(server, local):
+    assert fetch_text(server + "/redirect").startswith(PARAGRAPHS[0])
+    with pytest.raises(ScrapeError, match="Too many redirects"):
+        fetch_text(server + "/loop")
+
+
+def test_refuses_non_public_addresses(server):
+    with pytest.raises(ScrapeError, match="non-public"):
+        fetch_text(server + "/page")
+    for url in ("http://169.254.169.254/latest/meta-data/", "http://10.0.0.1/", "http://[::1]/"):
+        with pytest.raises(ScrapeError, match="non-public"):
+            check_url(url)
+    with pytest.raises(ScrapeError, match="Not an http"):
+        check_url("file:///etc/passwd")
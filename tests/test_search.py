@@ -0,0 +1,78 @@
+import math
+
+from search import SearchIndex, matching_nodes
+
+
+def meta(unique_id, description, last_updated_on="2024-01-01T00:00:00"):
+    return {"unique_id": unique_id, "description": description, "lastUpdatedOn": last_updated_on}
+
+
+def nodes(*labels):
+    return [{"id": str(i), "label": label, "type": "Thing"} for i, label in enumerate(labels)]
+
+
+def idf(index, document_frequency):
+    return math.log(1.0 + (index.live_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def test_ranks_by_bm25():
+    index = SearchIndex()
+    index.add(meta("a", "Marie Curie"), nodes("radium", "polonium"))
+    index.add(meta("b", "Pierre Curie"), nodes("piezoelectricity"))
+    index.add(meta("c", "Albert Einstein"), nodes("relativity"))
+    results = index.search("curie radium")
+    assert [result[0] for result in results] == ["a", "b"]
+    assert results[0][4] == 1.0
+    assert 0.0 < results[1][4] < 1.0
+    assert index.search("nothing matches") == []
+
+
+def test_adding_the_same_version_again_does_nothing():
+    index = SearchIndex()
+    graph = (meta("a", "Marie Curie"), nodes("radium"))
+    assert index.add(*graph)
+    before = index.search("curie")
+    # a readiness retry or a refresh replays graphs that are already indexed
+    assert not index.add(*graph)
+    assert index.stats() == {"graphs": 1, "documents": 1, "tombstoned": 0, "terms": 4}
+    assert index.search("curie") == before
+
+
+def test_keeps_the_newest_version():
+    index = SearchIndex()
+    index.add(meta("a", "Marie Curie", "2024-01-02T00:00:00"), nodes("radium", "polonium"))
+    assert not index.add(meta("a", "Marie Curie", "2024-01-01T00:00:00"), nodes("radium"))
+    # an expansion within the same second adds nodes
+    assert index.add(meta("a", "Marie Curie", "2024-01-02T00:00:00"), nodes("radium", "polonium", "nobel"))
+    assert index.search("nobel")[0][0] == "a"
+    assert len(index) == 1
+    assert index.stats()["tombstoned"] == 1
+
+
+def test_document_frequency_excludes_tombstoned_documents():
+    index = SearchIndex()
+    index.add(meta("a", "Marie Curie"), nodes("radium"))
+    index.add(meta("b", "Albert Einstein"), nodes("relativity"))
+    for day in range(2, 6):
+        index.add(meta("a", "Marie Curie", "2024-01-0{}T00:00:00".format(day)), nodes("radium"))
+    # one live document contains "radium", whatever the number of tombstoned versions
+    (unique_id, _, _, score, coverage), = index.search("radium")
+    assert unique_id == "a"
+    fresh = SearchIndex()
+    fresh.add(meta("a", "Marie Curie", "2024-01-05T00:00:00"), nodes("radium"))
+    fresh.add(meta("b", "Albert Einstein"), nodes("relativity"))
+    assert math.isclose(score, fresh.search("radium")[0][3], rel_tol=1e-6)
+    assert math.isclose(idf(index, 1), idf(fresh, 1))
+
+
+def test_remove():
+    index = SearchIndex()
+    index.add(meta("a", "Marie Curie"), nodes("radium"))
+    index.remove("a")
+    assert index.search("curie") == []
+    assert len(index) == 0
+
+
+def test_matching_nodes():
+    graph = nodes("Marie Curie", "Radium", "Paris")
+    assert [node["label"] for node in matching_nodes(graph, "curie radium")] == ["Marie Curie", "Radium"]
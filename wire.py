@@ -0,0 +1,168 @@
+import gzip
+import json
+import os
+
+from flask import Response
+
+try:
+    # brotli is optional; gzip is used when it is not installed
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPACT_MEDIA_TYPE = "application/vnd.instagraph.compact+json"
+COMPACT_FORMAT = "compact-1"
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+COMPRESSIBLE_TYPES = ("application/json", COMPACT_MEDIA_TYPE, "text/", "image/svg+xml")
+
+
+def wants_compact(request):
+    """
+    Returns True if the request asks for the compact format, with ?format=compact or an
+    Accept header preferring COMPACT_MEDIA_TYPE. ?format=full forces the full format.
+    """
+    requested = request.args.get("format")
+    if requested:
+        return requested == "compact"
+    return request.accept_mimetypes.best_match(["application/json", COMPACT_MEDIA_TYPE]) == COMPACT_MEDIA_TYPE
+
+
+class _Interner:
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def __call__(self, value):
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+class CompactEncoder:
+    """
+    Encodes graphs in the compact wire format. Colors are interned in a palette and
+    relationship labels, directions and node types in a string table, both shared by every
+    graph the encoder writes. Each graph is columnar:
+
+        {"ids": [...],
+         "nodes": {"label": [...], "type": [...], "color": [...], "x": [...], "y": [...]},
+         "edges": {"source": [...], "target": [...], "label": [...], "color": [...], "direction": [...]}}
+
+    The first len(nodes["label"]) ids are the graph's nodes; edges may point past them at
+    ids of nodes the response does not include (such as the existing nodes an expansion
+    connects to). source and target index ids, color indexes the palette and label,
+    direction and type index the strings. Positions are rounded to 0.1 and x/y are omitted
+    when no node has one.
+    """
+
+    def __init__(self):
+        self._palette = _Interner()
+        self._strings = _Interner()
+
+    def graph(self, nodes, edges):
+        """
+        Encodes knowledge graph nodes and edges ("from"/"to" keys) as one compact graph.
+        """
+        ids = _Interner()
+        columns = {"label": [], "type": [], "color": [], "x": [], "y": []}
+        for node in nodes:
+            ids(node["id"])
+            columns["label"].append(node["label"])
+            columns["type"].append(self._strings(node.get("type")))
+            columns["color"].append(self._palette(node.get("color", "defaultColor")))
+            position = node.get("position")
+            columns["x"].append(round(position["x"], 1) if position else None)
+            columns["y"].append(round(position["y"], 1) if position else None)
+        if all(x is None for x in columns["x"]):
+            del columns["x"], columns["y"]
+        return {
+            "ids": ids.values,
+            "nodes": columns,
+            "edges": {
+                "source": [ids(edge["from"]) for edge in edges],
+                "target": [ids(edge["to"]) for edge in edges],
+                "label": [self._strings(edge["relationship"]) for edge in edges],
+                "color": [self._palette(edge.get("color", "defaultColor")) for edge in edges],
+                "direction": [self._strings(edge["direction"]) for edge in edges],
+            },
+        }
+
+    def tables(self):
+        return {"format": COMPACT_FORMAT, "palette": self._palette.values, "strings": self._strings.values}
+
+
+def compact_elements(graph, meta, **extra):
+    """
+    Returns the compact counterpart of {"elements": ..., "meta": ...} for one graph.
+    """
+    encoder = CompactEncoder()
+    elements = encoder.graph(graph["nodes"], graph["edges"])
+    return {**encoder.tables(), "elements": elements, "meta": meta, **extra}
+
+
+def compact_history(graph_history, **extra):
+    """
+    Returns the compact counterpart of a history page. Every graph's relationships are
+    turned back into a node table and index pairs, so a node is sent once per graph
+    instead of once per relationship it takes part in; palette and strings are shared by
+    the whole page.
+    """
+    encoder = CompactEncoder()
+    entries = []
+    for entry in graph_history:
+        nodes = {}
+        edges = []
+        for relationship in entry["graph"]:
+            for node in (relationship["from"], relationship["to"]):
+                nodes.setdefault(node["id"], node)
+            edges.append({
+                "from": relationship["from"]["id"],
+                "to": relationship["to"]["id"],
+                "relationship": relationship["relationship"].get("type"),
+                "direction": relationship["relationship"].get("direction"),
+                "color": relationship["relationship"].get("color"),
+            })
+        entries.append({"metadata": entry["metadata"], "graph": encoder.graph(list(nodes.values()), edges)})
+    return {**encoder.tables(), "graph_history": entries, **extra}
+
+
+def compact_response(payload):
+    return Response(json.dumps(payload, separators=(",", ":")), mimetype=COMPACT_MEDIA_TYPE)
+
+
+def compress_response(response, accept_encodings):
+    """
+    Compresses a buffered response body with brotli or gzip, whichever the client accepts
+    (brotli first), if it is large enough and of a compressible type. ETags become weak,
+    since the bytes differ from the uncompressed representation.
+
+    Parameters:
+    response: The Flask response.
+    accept_encodings: The request's Accept-Encoding (werkzeug MIMEAccept-like object).
+    """
+    response.vary.add("Accept-Encoding")
+    if (response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and accept_encodings["br"]:
+        encoding, body = "br", brotli.compress(body, quality=BROTLI_QUALITY)
+    elif accept_encodings["gzip"]:
+        encoding, body = "gzip", gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    else:
+        return response
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response